@@ -14,7 +14,11 @@ DUCK_PROB_OPTIONS = [(i/100.0, "Duck probability: %i%%" % i)
                      for i in range(11)]
 
 PLAYER_NUMBER_OPTIONS = [(i, "%i players" % i) 
-                         for i in range(2, 6)]
+                         for i in list(range(2, 6)) + [10, 25, 50, 100]]
+
+# In larger games, only this many opponents are shown, as
+# the server only sends the snapshots of some of them
+MAX_OPPONENT_MONITORS = 8
 
 MAX_NUMBER_OF_GAMES = 20
 
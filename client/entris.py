@@ -66,7 +66,10 @@ def main():
                     sys.exit()
                     
                 if event.type == pygame.KEYDOWN:
-                    game.handle_keypress(event)
+                    if event.key == pygame.K_F3:
+                        game_window.perf_hud.toggle()
+                    else:
+                        game.handle_keypress(event)
                 elif event.type == pygame.KEYUP:
                     game.handle_keyrelease(event)
             
@@ -74,6 +77,7 @@ def main():
             pygame.display.update()
             
             passed_time = clock.tick(30)
+            game_window.perf_hud.record_frame(passed_time, clock.get_rawtime())
             game.proceed(passed_time)
 
 if __name__ == '__main__':
@@ -5,7 +5,7 @@ from collections import deque
 
 from part import Part, DUCK_INDICES, random_part_generator, get_part_for_index
 from events import LinesDeletedEvent, QuackEvent
-from networking import ServerEventListener, initialize_network_game, DEFAULT_SERVER
+from networking import LISTENER_CLASSES, initialize_network_game, DEFAULT_SERVER, DEFAULT_TRANSPORT
 
 logger = logging.getLogger("gamemodel")
 logger.setLevel(logging.DEBUG)
@@ -69,10 +69,11 @@ def create_game(config):
     # signal from the server.
     game.started = False
 
-    game.listener = ServerEventListener(game,
-                                        online_game_id=game_id,
-                                        screen_name=config['screen_name'],
-                                        host=config.get('server_name', DEFAULT_SERVER))
+    listener_class = LISTENER_CLASSES[config.get('transport', DEFAULT_TRANSPORT)]
+    game.listener = listener_class(game,
+                                   online_game_id=game_id,
+                                   screen_name=config['screen_name'],
+                                   host=config.get('server_name', DEFAULT_SERVER))
     game.listener.listen()
 
     return game
@@ -88,6 +89,10 @@ class Game(object):
         # The active piece for the player to control
         self.moving_piece = None
 
+        # Incremented whenever the cells or the moving piece change,
+        # so that unchanged boards needn't be encoded and sent again
+        self.board_version = 0
+
         # Game is lost
         self.gameover = False
         # Game is won (probably for multiplayer only)
@@ -228,6 +233,7 @@ class Game(object):
                 for idx in self.moving_piece.get_indexes():
                     self.cells[idx] = self.moving_piece.color
                 self.moving_piece = None
+                self.board_version += 1
         else:
             # create and insert a new piece
             next_piece = self.get_next_piece()
@@ -254,6 +260,7 @@ class Game(object):
             return False
 
         self.moving_piece.rotate(steps, rotation_key == "CLOCKWISE")
+        self.board_version += 1
 
     def rotation_legal(self, steps, clockwise):
         """
@@ -299,6 +306,7 @@ class Game(object):
             return False
 
         self.moving_piece.position_index += direction_delta
+        self.board_version += 1
 
         return True
 
@@ -356,6 +364,7 @@ class Game(object):
 
         for _ in row_indexes:
             self.cells = [0 for _ in range(self.column_nr)] + self.cells
+        self.board_version += 1
 
         self.after_row_deletion(len(row_indexes))
 
@@ -385,6 +394,7 @@ class Game(object):
         part.rotate(random.randint(0, 3), clockwise=True)
 
         self.moving_piece = part
+        self.board_version += 1
 
     def add_observer(self, observer):
         self.observers.append(observer)
@@ -407,6 +417,10 @@ class MultiplayerGame(Game):
         # Penalties can be received from other players
         self.penalties = deque()
 
+        # Number of times a new piece was due but no part
+        # had arrived from the server yet
+        self.part_underruns = 0
+
     def proceed(self, passed_time):
         if not self.moving_piece and self.penalties:
             # Time to insert penalty lines, if any
@@ -432,10 +446,16 @@ class MultiplayerGame(Game):
 
     def get_next_piece(self):
         if len(self.piece_queue) < 10:
+            # Doesn't wait for the server, parts are prefetched
             next_parts = [get_part_for_index(idx)
                           for idx in self.listener.get_next_parts()]
             self.piece_queue.extend(next_parts)
-        return self.piece_queue.popleft() if self.piece_queue else None
+        if not self.piece_queue:
+            # Try again on the next step
+            self.part_underruns += 1
+            logger.info("No parts received yet (%s underruns)" % self.part_underruns)
+            return None
+        return self.piece_queue.popleft()
 
     def regurgitate(self, number_of_lines):
         """
@@ -459,6 +479,7 @@ class MultiplayerGame(Game):
             gap_index = random.randint(0, self.column_nr - 1)
             penalty_line[gap_index:gap_index + 1] = 0, 0
             self.cells.extend(penalty_line * number_of_lines)
+        self.board_version += 1
 
         if penalty_is_fatal:
             # That was too much to swallow ... we're screwed
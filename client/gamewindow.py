@@ -3,6 +3,7 @@ import logging
 
 from infopanel import InfoPanel
 from messagelayover import TransparentLayover
+from perfhud import PerfHUD
 from sound import SoundManager
 
 logger = logging.getLogger("gamewindow")
@@ -39,6 +40,9 @@ class GameWindow(pygame.Surface):
         self.info_panel = InfoPanel((350, 600), self.game_model)
         
         self.message_layover = TransparentLayover(self)
+
+        # Toggled by the player, see entris.py
+        self.perf_hud = PerfHUD((self.dimensions[0] - 10, 130), self.game_model)
     
         self.last_frame_before_death_rendered = False
     
@@ -65,6 +69,8 @@ class GameWindow(pygame.Surface):
 
         self.render_status_window()
         screen.blit(self.info_panel, (self.get_width(), 0))        
+
+        self.perf_hud.render(screen)
         
     def render_game_window(self):
         """
@@ -1,6 +1,7 @@
 
 import pygame
 from monitoring import GameMonitor
+from config import MAX_OPPONENT_MONITORS
 
 class InfoPanel(pygame.Surface):
     """
@@ -64,8 +65,9 @@ class InfoPanel(pygame.Surface):
         player_list_for_display = (self.players_at_game_start 
                                    or self.game.listener.players)
         
-        # We need monitors for each opponent
-        number_of_monitors = self.game.listener.game_size - 1
+        # We need monitors for each opponent, up to a limit
+        number_of_monitors = min(self.game.listener.game_size - 1,
+                                 MAX_OPPONENT_MONITORS)
         
         # Determine width of the monitor. Only if there is 
         # just one opponent, we use the entire width available
@@ -77,9 +79,12 @@ class InfoPanel(pygame.Surface):
         number_of_monitor_rows = (number_of_monitors+1)/2 
         player_monitor_height = vertical_remainder/number_of_monitor_rows - 4
         
-        # Filter out our own id ... no need to monitor ourselves
-        opponent_ids = [pid for pid in player_list_for_display.keys() 
-                        if pid != self.game.listener.player_id]
+        # Filter out our own id ... no need to monitor ourselves.
+        # Opponents whose snapshots we get come first.
+        snapshots = self.game.listener.player_game_snapshots
+        opponent_ids = sorted((pid for pid in player_list_for_display.keys()
+                               if pid != self.game.listener.player_id),
+                              key=lambda pid: pid not in snapshots)
          
         for idx in range(number_of_monitors):
             x_start = (idx % 2) * (player_monitor_width + 2) + 2
@@ -11,8 +11,9 @@ except ImportError:
 
 import logging
 import codecs
+import threading
 
-from pygame.locals import K_r, K_RETURN, K_UP, K_DOWN
+from pygame.locals import K_r, K_RETURN, K_UP, K_DOWN, K_LEFT, K_RIGHT
 
 from statewindows import StateWindow
 from config import SCREEN_DIMENSIONS, MAX_NUMBER_OF_GAMES
@@ -28,7 +29,10 @@ logger.addHandler(handler)
 class Lobby(StateWindow):
     
     column_headings = ("Grid size", "Duck probability", "Players", "Free slots")
-    DEFAULT_SUBTITLE = "Select a game to join - press 'R' to refresh list"
+    DEFAULT_SUBTITLE = "Select a game to join - arrow keys browse, 'R' refreshes"
+
+    # Seconds between refreshes of the game list while the lobby is shown
+    REFRESH_INTERVAL = 3
     
     def __init__(self, dimensions=SCREEN_DIMENSIONS):
         """
@@ -42,9 +46,12 @@ class Lobby(StateWindow):
         ******GAME1 DATA******
         ******GAME1 DATA******
         ...
-        ******GAME25 DATA*****
+        ******GAME20 DATA*****
         **********************
         ********SUBTITLE******
+
+        The server sends the games in pages of MAX_NUMBER_OF_GAMES,
+        which are browsed with the arrow keys.
         """
         
         StateWindow.__init__(self, dimensions)
@@ -58,6 +65,9 @@ class Lobby(StateWindow):
         self.game_list_y_offset = self.row_height*4
         self.subtitle_y_offset = self.get_height() - self.row_height 
         
+        # The game list and the selected index are replaced together by
+        # the refresh thread, under this lock, see selection()
+        self.lock = threading.Lock()
         self.game_configs = []
         self.selected_index = 0
         self.subtitle = self.DEFAULT_SUBTITLE
@@ -66,31 +76,157 @@ class Lobby(StateWindow):
         self.server_info_func = lambda: None
 
         self.response_reader = codecs.getreader("utf-8")
-        
-    def get_game_data(self):
-        try:
-            server_address = self.server_info_func() or DEFAULT_SERVER
+
+        # Keep-alive connection to the lobby's server, and the
+        # ETag of the game list we got from it
+        self.connection = None
+        self.server_address = None
+        self.etag = None
+        self.etag_target = None
+
+        # Cursors of the pages up to the one shown (None for the
+        # first page), the cursor of the next page if there is one,
+        # and which game to select once a new page arrives
+        self.page_cursors = [None]
+        self.next_cursor = None
+        self.page_selection = None
+
+        # The game list is refreshed by a background thread,
+        # see proceed()
+        self.refresh_thread = None
+        self.since_refresh = self.REFRESH_INTERVAL * 1000
+
+    def connect(self, server_address):
+        if self.connection is None or server_address != self.server_address:
             if ":" in server_address:
                 host, port = server_address.split(":")
-                connection = http.HTTPConnection(host, int(port))
+                self.connection = http.HTTPConnection(host, int(port))
             else:
-                connection = http.HTTPConnection(server_address)
+                self.connection = http.HTTPConnection(server_address)
+            if server_address != self.server_address:
+                self.etag = None
+                with self.lock:
+                    self.game_configs = []
+                    self.selected_index = 0
+                self.page_cursors = [None]
+                self.next_cursor = None
+            self.server_address = server_address
+        return self.connection
 
-            connection.request("GET", "/list")
-            resp_json = json.load(self.response_reader(connection.getresponse()))
+    def list_target(self):
+        target = "/list?joinable=1&limit=%d" % MAX_NUMBER_OF_GAMES
+        if self.page_cursors[-1]:
+            target += "&cursor=" + self.page_cursors[-1]
+        return target
 
-            # Read response and filter out started 
-            # games (as we cannot join those anymore)
-            games = {gid: game for gid, game in resp_json.items()
-                     if not game['started']}
-
-            self.game_configs = sorted(games.values(), key=lambda g: g['game_id'])
+    def get_game_data(self):
+        """
+        Fetches the current page of joinable games, unless it
+        didn't change since we got it last time. Fetches again
+        if the page was changed in the meantime.
+        """
+        try:
+            target = None
+            while target != self.list_target():
+                target = self.list_target()
+                self.fetch_page(target)
         except Exception as ex:
             logger.error(ex)
+            self.connection = None
             self.subtitle = "Error connecting to server"
+
+    def fetch_page(self, target):
+        connection = self.connect(self.server_info_func() or DEFAULT_SERVER)
+        # ETags are only comparable for the same page
+        headers = ({"If-None-Match": self.etag}
+                   if self.etag and target == self.etag_target else {})
+        connection.request("GET", target, headers=headers)
+        response = connection.getresponse()
+        if response.status == 304:
+            response.read()
+            return
+
+        resp_json = json.load(self.response_reader(response))
+        if "games" in resp_json:
+            games, self.next_cursor = resp_json["games"], resp_json["next_cursor"]
+        else:
+            # A server without paging sends all games at once
+            games, self.next_cursor = list(resp_json.values()), None
+
+        # Filter out started games (as we cannot join
+        # those anymore), in case the server didn't
+        games = [game for game in games if not game['started']]
+        if not games and len(self.page_cursors) > 1:
+            # The games of this page are gone, go back
+            self.page_cursors.pop()
+            return
+
+        self.set_game_configs(games[:MAX_NUMBER_OF_GAMES])
+        self.etag = response.getheader("ETag")
+        self.etag_target = target
+
+    def set_game_configs(self, game_configs):
+        """
+        Replaces the game list, keeping the selected game selected
+        (unless the page changed)
+        """
+        game_ids = [game['game_id'] for game in game_configs]
+        with self.lock:
+            selected = (self.game_configs[self.selected_index]['game_id']
+                        if self.selected_index < len(self.game_configs) else None)
+            if self.page_selection is not None and game_ids:
+                self.selected_index = self.page_selection % len(game_ids)
+                self.page_selection = None
+            else:
+                self.selected_index = game_ids.index(selected) if selected in game_ids else 0
+            self.game_configs = game_configs
+
+    def selection(self):
+        """
+        Returns the game list and the selected index, consistent
+        with each other even while the list is being refreshed
+        """
+        with self.lock:
+            return self.game_configs, self.selected_index
+
+    def change_page(self, direction, selection=0):
+        """
+        Switches to the next (direction 1) or previous (-1) page,
+        selecting the game at index 'selection' once it arrives.
+        Returns False if there is no such page.
+        """
+        if direction > 0:
+            if self.next_cursor is None:
+                return False
+            self.page_cursors.append(self.next_cursor)
+            self.next_cursor = None
+        else:
+            if len(self.page_cursors) == 1:
+                return False
+            self.page_cursors.pop()
+
+        self.page_selection = selection
+        self.refresh()
+        return True
+
+    def refresh(self):
+        """
+        Starts fetching the game list in the background
+        """
+        if self.refresh_thread is None or not self.refresh_thread.is_alive():
+            self.since_refresh = 0
+            self.refresh_thread = threading.Thread(target=self.get_game_data)
+            self.refresh_thread.daemon = True
+            self.refresh_thread.start()
+
+    def proceed(self, milliseconds):
+        self.since_refresh += milliseconds
+        if self.since_refresh >= self.REFRESH_INTERVAL * 1000:
+            self.refresh()
     
     def as_dict(self):
-        return self.game_configs[self.selected_index]
+        game_configs, selected_index = self.selection()
+        return game_configs[selected_index]
 
     def handle_keypress(self, event):
         key = event.key
@@ -100,14 +236,25 @@ class Lobby(StateWindow):
         
         if key == K_r:
             # Refresh game list
-            self.get_game_data()
+            self.refresh()
         elif key == K_RETURN:
             if self.game_configs:
                 self.finished = True
         elif key in (K_UP, K_DOWN):
-            if self.game_configs:
+            game_configs, selected_index = self.selection()
+            if game_configs:
                 direction = 1 if key == K_DOWN else -1
-                self.selected_index = (self.selected_index+direction) % len(self.game_configs)
+                index = selected_index + direction
+                # Moving past the first or last game leaves the page
+                if not 0 <= index < len(game_configs) and \
+                        self.change_page(direction, 0 if direction > 0 else -1):
+                    return
+                with self.lock:
+                    # Unless the list was replaced in the meantime
+                    if self.game_configs is game_configs:
+                        self.selected_index = index % len(game_configs)
+        elif key in (K_LEFT, K_RIGHT):
+            self.change_page(1 if key == K_RIGHT else -1)
         else:
             StateWindow.handle_keypress(self, event)
     
@@ -119,9 +266,9 @@ class Lobby(StateWindow):
             text_pos.top = y_offset
             screen.blit(text_img, text_pos)    
         
-    def render_selection_bar(self, screen):
-        if self.game_configs:
-            y_offset = self.game_list_y_offset + self.selected_index * self.row_height
+    def render_selection_bar(self, screen, game_configs, selected_index):
+        if game_configs:
+            y_offset = self.game_list_y_offset + selected_index * self.row_height
             screen.fill(self.selection_bar_color, 
                         (0, y_offset, self.get_width(), self.row_height))
         
@@ -151,7 +298,10 @@ class Lobby(StateWindow):
     def render(self, screen):
         screen.fill((0, 0, 0))
         
-        header_img = self.font.render('Online Games', 1, self.font_color)
+        title = 'Online Games'
+        if len(self.page_cursors) > 1 or self.next_cursor is not None:
+            title += ' (page %d)' % len(self.page_cursors)
+        header_img = self.font.render(title, 1, self.font_color)
         header_pos = header_img.get_rect()
         header_pos.centerx = self.get_rect().centerx
         header_pos.top = self.title_y_offset
@@ -162,10 +312,11 @@ class Lobby(StateWindow):
                         self.column_headings_y_offset, 
                         self.hint_color)
     
-        self.render_selection_bar(screen)
+        game_configs, selected_index = self.selection()
+        self.render_selection_bar(screen, game_configs, selected_index)
         self.render_subtitle(screen)
     
-        for idx, game in enumerate(self.game_configs):
+        for idx, game in enumerate(game_configs):
             items = self._repr_for_display(game)
             y_offset = self.game_list_y_offset + idx * self.row_height
             self.render_row(screen, items, y_offset, self.font_color)
@@ -4,39 +4,39 @@ import pygame
 
 import math
 from part import random_part_generator
+import snapshotcodec
 
 
-def compress(game):
+def compress(game, format=1):
     """
-    Builds a compressed version of a game instance
+    Builds a compressed version of a game instance, in one of
+    the formats of snapshotcodec
     """
-    cells = "".join(["1" if (c or idx in game.moving_piece_indexes) 
-                     else "0" 
-                     for idx, c in enumerate(game.cells)])
-    return str(game.column_nr) + "," + cells
+    flags = snapshotcodec.cells_to_flags(game.cells, game.moving_piece_indexes)
+    return snapshotcodec.encode(game.column_nr, flags, format)
+
+def patch(compressed, rows):
+    """
+    Applies a list of changed rows [[row_index, row_bits], ...],
+    as sent by the server's snapshot deltas, to a compressed game.
+    """
+    row_length_str, _, data = compressed.partition(",")
+    row_length = int(row_length_str)
+    cells = list(data)
+    for row_index, row_bits in rows:
+        cells[row_index*row_length:(row_index+1)*row_length] = row_bits
+    return row_length_str + "," + "".join(cells)
 
 def decompress(compressed):
     """
     Builds a two-dimensional boolean array from a compressed
     string representing a game.
     """
-    
-    parts = compressed.split(",")
-    
-    if len(parts) != 2:
+    try:
+        return snapshotcodec.rows(compressed)
+    except ValueError:
         # Probably still empty ... ignore it
         return None
-    
-    row_length_str, data = int(parts[0]), parts[1]
-    row_length = int(row_length_str)
-    
-    number_of_rows = len(data)/row_length
-    
-    bin_array = []
-    for idx in range(int(number_of_rows)):
-        bin_array.append([int(x) for x in data[idx*row_length:(idx+1)*row_length]])
-    
-    return bin_array
 
 class GameMonitor(pygame.Surface):
     """
@@ -49,6 +49,10 @@ class GameMonitor(pygame.Surface):
         pygame.Surface.__init__(self, self.dimensions)
         self.font = pygame.font.Font('jack_type.ttf', 14)
         self.big_font = pygame.font.Font('jack_type.ttf', 36)
+        # The last game rendered and its decompressed board,
+        # as a game changes far less often than it's rendered
+        self.last_compressed_game = None
+        self.last_game_as_array = None
         
     def render_game(self, compressed_game, player_name, player_alive):
         """
@@ -58,8 +62,12 @@ class GameMonitor(pygame.Surface):
 
         self.fill((0, 0, 0))
         
-        if compressed_game:
-            game_as_array = decompress(compressed_game)
+        if compressed_game != self.last_compressed_game:
+            self.last_compressed_game = compressed_game
+            self.last_game_as_array = decompress(compressed_game) if compressed_game else None
+        game_as_array = self.last_game_as_array
+
+        if game_as_array:
             nr_columns, nr_rows = len(game_as_array[0]), len(game_as_array)
             pixel_width = self.get_width()/float(nr_columns)
             pixel_height = self.get_height()/float(nr_rows)
@@ -100,8 +108,12 @@ if __name__ == '__main__':
     compressed = compress(game)
     assert compressed == "10,00000000001111111110", "Compressed repr corrupted: %s" % compressed
     
+    patched = patch("10,00000000001111111110", [[0, "1000000001"]])
+    assert patched == "10,10000000011111111110", "Bad patch: %s" % patched
+    
     decomp = decompress("10,00000000001111111110")
     assert decomp == [[0, 0, 0, 0, 0, 0, 0, 0, 0, 0], [1, 1, 1, 1, 1, 1, 1, 1, 1, 0]], "Bad decompression: %s" % decomp
+    assert decompress(compress(game, format=2)) == decomp, "Bad decompression of format 2"
     
     # Test a bigger game ...
     game.cells = [0] * 70
@@ -4,11 +4,16 @@ import threading
 import logging
 import json
 import http.client
-import codecs
+import socket
+import asyncio
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from events import LinesDeletedEvent
-from monitoring import compress
+from monitoring import compress, patch
+from ringbuffer import RingBuffer
+import snapshotcodec
+import wire
 
 logger = logging.getLogger("networking")
 logger.setLevel(logging.DEBUG)
@@ -24,8 +29,20 @@ class ConnectionFailed(Exception):
 POST_HEADERS = {"Content-type": "application/x-www-form-urlencoded",
                 "Accept": "text/plain"}
 
+# Headers of a /sync request, see wire.py for the binary encoding
+SYNC_HEADERS = {"Content-type": "application/x-www-form-urlencoded",
+                "Accept": "%s, application/json" % wire.CONTENT_TYPE}
+BINARY_SYNC_HEADERS = {"Content-type": wire.CONTENT_TYPE,
+                       "Accept": wire.CONTENT_TYPE}
+
 DEFAULT_SERVER = "entris.charra.de"
 
+# Number of request round trip times kept for the performance HUD
+RTT_SAMPLES = 100
+
+# Which listener class to use for online games, see LISTENER_CLASSES
+DEFAULT_TRANSPORT = "poll"
+
 
 # DEFAULT_SERVER = "localhost:8888"
 
@@ -44,6 +61,108 @@ def initialize_network_game(config):
     return json.loads(rawresponse.decode())
 
 
+class RequestWorker(object):
+    """
+    Performs the HTTP requests to the server on POOL_SIZE I/O
+    threads, each owning a keep-alive connection, so that threads
+    of the client never share a connection. Requests are submitted
+    as futures of (status, headers, body), headers with lower case
+    names.
+    
+    After a connection broke, the next one is opened after a backoff
+    doubling from BACKOFF_MIN up to BACKOFF_MAX seconds. Idempotent
+    requests are retried up to RETRIES times; others fail with
+    ConnectionFailed, as the server may have performed them already.
+    The counters in 'stats' show how often all that happens, and
+    'rtts' keeps the round trip times of the last requests.
+    """
+
+    POOL_SIZE = 2
+    RETRIES = 3
+    BACKOFF_MIN = 0.1
+    BACKOFF_MAX = 2.0
+
+    def __init__(self, address, timeout=10):
+        if ":" in address:
+            host, port = address.split(":")
+        else:
+            host, port = address, 80
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(self.POOL_SIZE)
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'retries': 0, 'reconnects': 0}
+        self.rtts = RingBuffer(RTT_SAMPLES)
+
+    def submit(self, method, url, body=None, headers=None, idempotent=False):
+        return self.executor.submit(self.perform, method, url, body, headers or {}, idempotent)
+
+    def request(self, method, url, body=None, headers=None, idempotent=False):
+        """
+        Like submit, but waits for the response
+        """
+        return self.submit(method, url, body, headers, idempotent).result()
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def perform(self, method, url, body, headers, idempotent):
+        self.count('requests')
+        attempts = 0
+        while True:
+            connection = self.connection()
+            start = time.monotonic()
+            try:
+                connection.request(method, url, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as ex:
+                self.count('errors')
+                self.drop_connection()
+                attempts += 1
+                if not idempotent or attempts > self.RETRIES:
+                    raise ConnectionFailed(str(ex))
+                self.count('retries')
+                continue
+
+            self.local.failures = 0
+            self.rtts.append(time.monotonic() - start)
+            return (response.status,
+                    dict((name.lower(), value) for name, value in response.getheaders()),
+                    data)
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            failures = getattr(self.local, 'failures', 0)
+            if failures:
+                time.sleep(min(self.BACKOFF_MIN * 2 ** (failures - 1), self.BACKOFF_MAX))
+                self.count('reconnects')
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    def drop_connection(self):
+        connection = self.local.connection
+        self.local.connection = None
+        self.local.failures = getattr(self.local, 'failures', 0) + 1
+        with self.lock:
+            self.connections.remove(connection)
+        connection.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+
+
 class ServerEventListener(object):
     """
     Class responsible for all interaction with the game server,
@@ -55,7 +174,12 @@ class ServerEventListener(object):
     
     As long as its game is 'alive', the synchronisation thread
     of the ServerEventListener keeps asking the server for info
-    and sending info in regular intervals of 1 second.
+    and sending info in regular intervals of 1 second, in a single
+    /sync request if the server supports it.
+    
+    Parts are fetched ahead of time by a prefetch thread, so the
+    game never waits for the server when asking for parts. All
+    requests are performed by a RequestWorker.
     
     Constructor expects a 'screen name' for the player to send
     to the server.
@@ -63,6 +187,11 @@ class ServerEventListener(object):
 
     CANNOT_CONNECT_MSG = "Cannot connect to server"
 
+    # When syncing, more parts are requested as soon as
+    # fewer than PARTS_LOW_WATER are left in the buffer.
+    PARTS_LOW_WATER = 10
+    PARTS_BATCH = 20
+
     def __init__(self, game, online_game_id, screen_name, host):
         self.game = game
         self.game.add_observer(self)
@@ -73,9 +202,45 @@ class ServerEventListener(object):
         self.player_id = None
 
         self.lines_to_send = deque()
+        # Number of the first entry in lines_to_send
+        self.lines_seq = 0
+
         self.players = {}
         self.player_game_snapshots = {}
         self.players_alive = 0
+        # Number of penalties received so far
+        self.penalties_received = 0
+        # time.monotonic() of the last exchange with the server
+        # that went through, None before the first
+        self.last_sync = None
+
+        # Offset of the next part in the game's part sequence,
+        # and parts received not yet taken by the game
+        self.parts_offset = 0
+        self.parts_buffer = deque()
+        self.parts_lock = threading.Lock()
+        # Set to wake up the prefetch thread, initially
+        # to have parts at hand when the game starts
+        self.parts_wanted = threading.Event()
+        self.parts_wanted.set()
+
+        # Whether the server offers /sync, None until we know
+        self.sync_supported = None
+        # Whether the server answered a /sync in binary
+        self.binary_supported = False
+        # Newest snapshot format the server understands,
+        # see snapshotcodec.py
+        self.snapshot_format = 1
+
+        # The last snapshot of our board encoded, as (board version,
+        # format, snapshot), and the board version the server has
+        self.snapshot_cache = (None, None, None)
+        self.board_version_sent = None
+        self.board_version_sending = None
+
+        # Version of the snapshots we know, if the server supports
+        # sending snapshot deltas
+        self.snapshot_version = None
 
         self.game_size = None
 
@@ -84,16 +249,18 @@ class ServerEventListener(object):
         # displaying them somewhere.
         self.error_msg = ""
 
-        self.response_reader = codecs.getreader("utf-8")
-        self.connection = None
+        self.io = RequestWorker(host)
         self.connect_to_game()
 
     def listen(self):
-        if not self.connection:
+        if self.player_id is None:
             self.error_msg = self.CANNOT_CONNECT_MSG
         else:
             self.updateThread = threading.Thread(target=self._synchronize)
             self.updateThread.start()
+            self.prefetchThread = threading.Thread(target=self._prefetch_parts)
+            self.prefetchThread.daemon = True
+            self.prefetchThread.start()
 
     def _synchronize(self):
         while not self.game.aborted:
@@ -113,42 +280,84 @@ class ServerEventListener(object):
                and not self.game.victorious):
             time.sleep(1)
 
+            # A failed sync is retried next round rather than falling
+            # back, which would send lines the server may have acknowledged
+            if self.sync_supported is not False:
+                self.sync()
+            if self.sync_supported is not False:
+                continue
+
             self.get_lines()
             self.send_lines()
             self.update_players_list()
 
         self.unregister_from_server()
 
+    def request_json(self, method, url, body=None, headers=None, idempotent=False):
+        """
+        Performs a request with the RequestWorker and returns the
+        decoded JSON response. Raises ConnectionFailed or ValueError.
+        """
+        _, _, data = self.io.request(method, url, body, headers, idempotent)
+        return json.loads(data.decode("utf-8"))
+
     def unregister_from_server(self):
         params = urllib.parse.urlencode({'game_id': self.game_id,
                                          'player_id': self.player_id})
 
         try:
-            self.connection.request("POST",
-                                    "/unregister",
-                                    params,
-                                    POST_HEADERS)
-            resp_json = json.load(self.response_reader(self.connection.getresponse()))
+            resp_json = self.request_json("POST", "/unregister", params, POST_HEADERS)
             logging.info(resp_json)
-        except Exception:
+        except (ConnectionFailed, ValueError):
             # That's not too bad ...
             logging.info("Unregistration failed")
-            pass
+        logger.info("Requests: %s", self.io_stats())
+        self.io.close()
+
+    def io_stats(self):
+        """
+        Returns the counters of requests, errors, retries and reconnects
+        """
+        return dict(self.io.stats)
+
+    def rtt_samples(self):
+        """
+        Returns the round trip times of the last requests in seconds
+        """
+        return self.io.rtts.values()
 
     def ask_for_start_permission(self):
         try:
-            self.connection.request("GET", "/status?game_id=%s" % self.game_id)
-            game_info = json.load(self.response_reader(self.connection.getresponse()))
+            game_info = self.request_json("GET", "/status?game_id=%s" % self.game_id,
+                                          idempotent=True)
             return game_info['started']
-        except:
+        except (ConnectionFailed, ValueError, KeyError, TypeError):
             self.error_msg = self.CANNOT_CONNECT_MSG
 
     def update_players_list(self):
+        url = self.status_url()
+        try:
+            game_info = self.request_json("GET", url, idempotent=True)
+        except (ConnectionFailed, ValueError) as ex:
+            logger.error("Update failed %s", ex)
+            self.error_msg = "Cannot fetch game data from server"
+            return
+
+        self.handle_status(game_info)
+
+    def status_url(self):
+        url = "/status?game_id=%s&player_id=%s" % (self.game_id, self.player_id)
+        if self.snapshot_version is not None:
+            url += "&since=%s" % self.snapshot_version
+        return url
+
+    def handle_status(self, game_info):
+        """
+        Applies the game status sent by the server
+        """
         try:
-            self.connection.request("GET", "/status?game_id=%s" % self.game_id)
-            game_info = json.load(self.response_reader(self.connection.getresponse()))
             self.game_size = game_info['size']
-        except Exception as ex:
+        except (KeyError, TypeError) as ex:
             logger.error("Update failed %s", ex)
             self.error_msg = "Cannot fetch game data from server"
             return
@@ -159,19 +368,157 @@ class ServerEventListener(object):
             count_alive = 0
             for info in player_infos:
                 self.players[info['player_id']] = info['player_id']
-                self.player_game_snapshots[info['player_id']] = info['snapshot']
+                if 'snapshot' in info:
+                    self.player_game_snapshots[info['player_id']] = info['snapshot']
                 if info["alive"]:
                     count_alive += 1
             self.players_alive = count_alive
 
-        except KeyError:
+            self.apply_snapshot_deltas(game_info.get('snapshot_deltas', {}))
+            self.snapshot_version = game_info.get('snapshot_version')
+        except (KeyError, ValueError, TypeError):
             self.players = {}
             self.player_game_snapshots = {}
+            self.snapshot_version = None
 
         # If we get here, everything should be okay,
         # so clear the error message
         self.error_msg = ""
 
+    def apply_snapshot_deltas(self, deltas):
+        """
+        Updates our opponents' snapshots with the changes the
+        server sent since our last known snapshot version.
+        """
+        for player_id, delta in deltas.items():
+            if 'snapshot' in delta:
+                self.player_game_snapshots[player_id] = delta['snapshot']
+            else:
+                self.player_game_snapshots[player_id] = patch(
+                    self.player_game_snapshots[player_id], delta['rows'])
+
+    def sync(self):
+        """
+        Sends our lines and snapshot, and receives penalties, snapshot
+        changes and parts in one round trip to the server's /sync.
+        Returns False if that didn't work out.
+        """
+        body, headers = self.sync_request()
+        try:
+            # Not retried: the server hands out penalties only once, so
+            # a retry would lose those of a response that got dropped.
+            # Unacknowledged lines are sent again next round, see lines_seq.
+            status, response_headers, data = self.io.request("POST", "/sync", body, headers)
+        except ConnectionFailed as ex:
+            logger.info("Sync failed: %s", ex)
+            return False
+        return self.handle_sync_response(status, response_headers.get("content-type", ""), data)
+
+    def sync_request(self):
+        """
+        Returns the body and headers of a /sync request
+        """
+        lines = list(self.lines_to_send)
+        with self.parts_lock:
+            parts_offset = self.parts_offset
+            parts_wanted = (self.PARTS_BATCH
+                            if len(self.parts_buffer) < self.PARTS_LOW_WATER
+                            else 0)
+
+        params = {'game_id': self.game_id,
+                  'player_id': self.player_id,
+                  'lines': lines,
+                  'lines_seq': self.lines_seq,
+                  # The binary encoding packs format 1 snapshots itself
+                  'game_snapshot': self.changed_snapshot(
+                      1 if self.binary_supported else self.snapshot_format),
+                  'since': self.snapshot_version or 0,
+                  'parts_offset': parts_offset,
+                  'parts': parts_wanted}
+        if self.binary_supported:
+            return wire.encode_sync_request(params), BINARY_SYNC_HEADERS
+        params['lines'] = ",".join(str(n) for n in lines)
+        if params['game_snapshot'] is None:
+            del params['game_snapshot']
+        return urllib.parse.urlencode(params), SYNC_HEADERS
+
+    def encoded_snapshot(self, format):
+        """
+        Returns the snapshot of our board in the given format,
+        encoding it only if the board changed since the last time
+        """
+        version = self.game.board_version
+        cached_version, cached_format, snapshot = self.snapshot_cache
+        if version != cached_version or format != cached_format:
+            snapshot = compress(self.game, format)
+            self.snapshot_cache = (version, format, snapshot)
+        return snapshot
+
+    def changed_snapshot(self, format, optional=True):
+        """
+        Returns the snapshot of our board for a request, or None if
+        it's optional and the server already has this version of the
+        board. Call snapshot_sent() once the request succeeded.
+        """
+        version = self.game.board_version
+        self.board_version_sending = version
+        if optional and version == self.board_version_sent:
+            return None
+        return self.encoded_snapshot(format)
+
+    def snapshot_sent(self):
+        self.board_version_sent = self.board_version_sending
+
+    def handle_sync_response(self, status, content_type, data):
+        """
+        Applies what the server sent in response to a /sync.
+        Returns False if the sync failed.
+        """
+        if status == 404:
+            logger.info("Server doesn't support /sync, polling instead")
+            self.sync_supported = False
+            return False
+        try:
+            if content_type.startswith(wire.CONTENT_TYPE):
+                sync_info = wire.decode_sync_response(data)
+                self.binary_supported = True
+            else:
+                sync_info = json.loads(data.decode("utf-8"))
+        except (ValueError, wire.WireError) as ex:
+            logger.info("Sync failed: %s", ex)
+            return False
+        if 'error' in sync_info:
+            self.error_msg = sync_info['error']
+            return False
+
+        self.sync_supported = True
+        self.snapshot_sent()
+        self.last_sync = time.monotonic()
+
+        # Forget the line clears the server has received
+        while self.lines_seq < sync_info['lines_seq'] and self.lines_to_send:
+            self.lines_to_send.popleft()
+            self.lines_seq += 1
+
+        for lines_received in sync_info['penalties']:
+            logging.info("Ouch! Received %s lines" % lines_received)
+            self.game.regurgitate(lines_received)
+        self.penalties_received += len(sync_info['penalties'])
+
+        try:
+            self.apply_snapshot_deltas(sync_info['snapshot_deltas'])
+            self.snapshot_version = sync_info['snapshot_version']
+        except KeyError:
+            # Got a delta for a snapshot we don't know, start over
+            self.snapshot_version = None
+
+        self.players_alive = len(sync_info['players_alive'])
+
+        self.add_parts(sync_info['parts_offset'], sync_info['parts'])
+
+        self.error_msg = ""
+        return True
+
     def get_lines(self):
         """
         This request is sent periodically to the server, in
@@ -181,20 +528,23 @@ class ServerEventListener(object):
         of his game in a compressed format.
         """
 
-        params = urllib.parse.urlencode({'game_id': self.game_id,
-                                         'player_id': self.player_id,
-                                         'game_snapshot': compress(self.game)})
+        params = {'game_id': self.game_id, 'player_id': self.player_id}
+        # Servers knowing newer snapshot formats take a missing snapshot as unchanged
+        snapshot = self.changed_snapshot(self.snapshot_format, optional=self.snapshot_format > 1)
+        if snapshot is not None:
+            params['game_snapshot'] = snapshot
 
         try:
-            self.connection.request("GET", "/receive?%s" % params)
-            response = self.connection.getresponse()
-            penalty_info = json.load(self.response_reader(response))
+            penalty_info = self.request_json("GET", "/receive?%s" % urllib.parse.urlencode(params))
             lines_received = penalty_info['penalty']
+            self.snapshot_sent()
+            self.last_sync = time.monotonic()
 
             if lines_received:
                 logging.info("Ouch! Received %s lines" % lines_received)
                 self.game.regurgitate(lines_received)
-        except (http.client.CannotSendRequest, ValueError) as ex:
+                self.penalties_received += 1
+        except (ConnectionFailed, ValueError, KeyError) as ex:
             # Not too bad ... but we must take care that we
             # don't miss fetching our penalties for too long,
             # otherwise we might get dismissed from the game.
@@ -209,27 +559,79 @@ class ServerEventListener(object):
             params = urllib.parse.urlencode({'game_id': self.game_id,
                                              'player_id': self.player_id,
                                              'num_lines': lines})
-            self.connection.request("POST", "/sendlines", params, POST_HEADERS)
-            response = json.load(self.response_reader(self.connection.getresponse()))
+            response = self.request_json("POST", "/sendlines", params, POST_HEADERS)
 
             if response["info"].startswith("Added"):
                 # If it worked, remove the element from the deque
                 self.lines_to_send.popleft()
+                self.lines_seq += 1
             else:
-                raise http.client.CannotSendRequest('Sending failed with response %s' % response)
+                logging.info("Sending failed with response %s" % response)
 
-        except (http.client.CannotSendRequest, Exception):
-            logging.info("Errors while sending data to server")
+        except (ConnectionFailed, ValueError, KeyError) as ex:
+            logging.info("Errors while sending data to server: %s" % ex)
 
     def get_next_parts(self):
-        params = urllib.parse.urlencode({'game_id': self.game_id,
-                                         'player_id': self.player_id})
-        try:
-            self.connection.request("GET", "/getparts?%s" % params)
-            return json.load(self.response_reader(self.connection.getresponse()))
-        except:
-            # This may fail from time to time ...
-            return []
+        """
+        Returns the parts received so far, without waiting for
+        the server, and has more fetched in the background.
+        """
+        with self.parts_lock:
+            parts = list(self.parts_buffer)
+            self.parts_buffer.clear()
+        self.request_parts()
+        return parts
+
+    def request_parts(self):
+        self.parts_wanted.set()
+
+    def parts_needed(self):
+        """
+        Returns the offset of the parts to fetch, or None
+        if enough parts are buffered
+        """
+        with self.parts_lock:
+            if len(self.parts_buffer) < self.PARTS_LOW_WATER:
+                return self.parts_offset
+            return None
+
+    def add_parts(self, offset, parts):
+        """
+        Buffers parts received from offset, unless parts from
+        there on were already received in the meantime
+        """
+        with self.parts_lock:
+            if offset == self.parts_offset:
+                self.parts_buffer.extend(parts)
+                self.parts_offset += len(parts)
+
+    def parts_url(self, offset):
+        # Asking for parts by offset makes retrying safe: a lost
+        # response doesn't make us skip any parts.
+        return "/getparts?%s" % urllib.parse.urlencode({'game_id': self.game_id,
+                                                         'player_id': self.player_id,
+                                                         'offset': offset})
+
+    def _prefetch_parts(self):
+        while (not self.game.aborted
+               and not self.game.gameover
+               and not self.game.victorious):
+            if not self.parts_wanted.wait(1):
+                continue
+            self.parts_wanted.clear()
+
+            offset = self.parts_needed()
+            if offset is None:
+                continue
+            try:
+                parts = self.request_json("GET", self.parts_url(offset), idempotent=True)
+            except (ConnectionFailed, ValueError) as ex:
+                # This may fail from time to time ... try again in a second
+                logger.info("Getting parts failed: %s", ex)
+                time.sleep(1)
+                self.parts_wanted.set()
+                continue
+            self.add_parts(offset, parts)
 
     def notify(self, event):
         if isinstance(event, LinesDeletedEvent):
@@ -248,25 +650,438 @@ class ServerEventListener(object):
         attempts = 0
         while attempts < 3:
             try:
-                server_address = self.host
-                if ":" in server_address:
-                    host, port = server_address.split(":")
-                    self.connection = http.client.HTTPConnection(host, int(port))
-                else:
-                    self.connection = http.client.HTTPConnection(server_address)
-
-                self.connection.request("GET", "/register?game_id=%s&screen_name=%s"
-                                        % (self.game_id, self.screen_name))
-
-                response = self.connection.getresponse()
-                json_response = json.load(self.response_reader(response))
+                _, headers, data = self.io.request("GET", "/register?game_id=%s&screen_name=%s"
+                                                   % (self.game_id, self.screen_name))
+                json_response = json.loads(data.decode("utf-8"))
                 self.player_id = json_response['player_id']
+                self.snapshot_format = min(int(headers.get('x-snapshot-format', 1)),
+                                           snapshotcodec.FORMAT)
 
                 return
-            except Exception as ex:
+            except (ConnectionFailed, ValueError, KeyError) as ex:
                 logging.warning("Connection failed: {}".format(ex))
-                self.connection = None
                 time.sleep(1)
                 attempts += 1
 
         self.error_msg = "Could not connect to server"
+
+
+class PushEventListener(ServerEventListener):
+    """
+    Variant of the ServerEventListener using the server's push
+    channel (see server/pushchannel.py): a persistent connection on
+    which the server pushes penalties and opponent snapshots as soon
+    as they happen, and line clears are sent the moment they are
+    reported by the game.
+    
+    If the server doesn't offer a push channel, or the channel
+    breaks down, it falls back to polling like its base class.
+    """
+
+    PROTOCOL = "entris-push"
+
+    # Interval of sending our own snapshot, which
+    # also keeps our player alive on the server.
+    SNAPSHOT_INTERVAL = 1
+
+    def __init__(self, game, online_game_id, screen_name, host):
+        self.channel = None
+        self.channel_lock = threading.Lock()
+        self.server_started = False
+        ServerEventListener.__init__(self, game, online_game_id, screen_name, host)
+
+    def _synchronize(self):
+        try:
+            self.open_channel()
+        except (OSError, ConnectionFailed) as ex:
+            logger.info("Push channel unavailable (%s), polling instead", ex)
+            ServerEventListener._synchronize(self)
+            return
+
+        self.receiveThread = threading.Thread(target=self._receive_frames)
+        self.receiveThread.daemon = True
+        self.receiveThread.start()
+
+        while not self.game.aborted and not self.server_started and self.channel:
+            time.sleep(0.1)
+
+        while (self.channel
+               and not self.game.aborted
+               and not self.game.gameover
+               and not self.game.victorious):
+            self.game.started = self.server_started
+            frame = {'type': 'snapshot'}
+            snapshot = self.changed_snapshot(self.snapshot_format,
+                                             optional=self.snapshot_format > 1)
+            if snapshot is not None:
+                frame['snapshot'] = snapshot
+            if self.send_frame(frame):
+                self.snapshot_sent()
+            time.sleep(self.SNAPSHOT_INTERVAL)
+
+        if self.channel:
+            self.close_channel()
+            self.unregister_from_server()
+        elif not self.game.aborted:
+            logger.info("Push channel lost, polling instead")
+            ServerEventListener._synchronize(self)
+        else:
+            self.unregister_from_server()
+
+    def open_channel(self):
+        if ":" in self.host:
+            host, port = self.host.split(":")
+        else:
+            host, port = self.host, 80
+
+        sock = socket.create_connection((host, int(port)), timeout=10)
+        sock.sendall(("GET /push?game_id=%s&player_id=%s HTTP/1.1\r\n"
+                      "Host: %s\r\n"
+                      "Connection: Upgrade\r\n"
+                      "Upgrade: %s\r\n\r\n"
+                      % (self.game_id, self.player_id, self.host, self.PROTOCOL)).encode())
+
+        stream = sock.makefile('rb')
+        status_line = stream.readline().decode('latin-1')
+        if " 101 " not in status_line:
+            sock.close()
+            raise ConnectionFailed("Upgrade refused: %s" % status_line.strip())
+
+        # Skip the remaining response headers
+        while stream.readline() not in (b'\r\n', b''):
+            pass
+
+        sock.settimeout(None)
+        self.channel = sock
+        self.channel_stream = stream
+
+    def close_channel(self):
+        with self.channel_lock:
+            channel, self.channel = self.channel, None
+        if channel:
+            try:
+                channel.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            channel.close()
+
+    def _receive_frames(self):
+        try:
+            for line in self.channel_stream:
+                self.last_sync = time.monotonic()
+                self.handle_frame(json.loads(line.decode()))
+        except (OSError, ValueError, KeyError) as ex:
+            logger.info("Push channel failed: %s", ex)
+
+        self.close_channel()
+
+    def handle_frame(self, frame):
+        kind = frame['type']
+        if kind == 'penalty':
+            logging.info("Ouch! Received %s lines" % frame['penalty'])
+            self.game.regurgitate(frame['penalty'])
+            self.penalties_received += 1
+        elif kind == 'snapshot':
+            self.player_game_snapshots[frame['player_id']] = frame['snapshot']
+        elif kind == 'status':
+            self.game_size = frame['size']
+            self.players = {info['player_id']: info['screen_name']
+                            for info in frame['players']}
+            self.players_alive = len([info for info in frame['players']
+                                      if info['alive']])
+            self.server_started = frame['started']
+            self.error_msg = ""
+
+    def send_frame(self, frame):
+        data = (json.dumps(frame) + "\n").encode()
+        with self.channel_lock:
+            if not self.channel:
+                return False
+            try:
+                self.channel.sendall(data)
+                return True
+            except OSError as ex:
+                logger.info("Sending on push channel failed: %s", ex)
+                return False
+
+    def notify(self, event):
+        if isinstance(event, LinesDeletedEvent):
+            logging.info("Been notified of %s lines" % event.number_of_lines)
+            # Push the lines right away. Only if that isn't possible,
+            # they are left for the polling fallback to send.
+            if not self.send_frame({'type': 'lines',
+                                    'num_lines': event.number_of_lines}):
+                self.lines_to_send.append(event.number_of_lines)
+
+
+class AsyncHTTPClient(object):
+    """
+    Minimal HTTP/1.1 client for asyncio, keeping up to pool_size
+    connections to the server alive so that as many requests
+    can be in flight at the same time.
+    """
+
+    def __init__(self, address, pool_size=4, timeout=10):
+        if ":" in address:
+            host, port = address.split(":")
+        else:
+            host, port = address, 80
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(pool_size)
+        self.idle = []
+        # Same counters as RequestWorker.stats
+        self.stats = {'requests': 0, 'errors': 0, 'retries': 0, 'reconnects': 0}
+        self.rtts = RingBuffer(RTT_SAMPLES)
+
+    async def request(self, method, target, body=b'', headers=None):
+        """
+        Returns the status, headers (with lower case names)
+        and body of the response
+        """
+        if isinstance(body, str):
+            body = body.encode()
+        head = ["%s %s HTTP/1.1" % (method, target),
+                "Host: %s" % self.host,
+                "Content-Length: %d" % len(body)]
+        head.extend("%s: %s" % item for item in (headers or {}).items())
+        data = ("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body
+
+        self.stats['requests'] += 1
+        async with self.slots:
+            start = time.monotonic()
+            try:
+                response = await asyncio.wait_for(self.send(data), self.timeout)
+                self.rtts.append(time.monotonic() - start)
+                return response
+            except asyncio.TimeoutError:
+                self.stats['errors'] += 1
+                raise
+
+    async def send(self, data):
+        while True:
+            reused = bool(self.idle)
+            if reused:
+                reader, writer = self.idle.pop()
+            else:
+                try:
+                    reader, writer = await asyncio.open_connection(self.host, self.port)
+                except OSError as ex:
+                    self.stats['errors'] += 1
+                    raise ConnectionFailed(str(ex))
+
+            try:
+                writer.write(data)
+                status, headers, body = await self.read_response(reader)
+            except (OSError, EOFError, ValueError) as ex:
+                writer.close()
+                self.stats['errors'] += 1
+                if reused:
+                    # The server closed the idle connection, try a new one
+                    self.stats['retries'] += 1
+                    continue
+                raise ConnectionFailed(str(ex))
+            except asyncio.CancelledError:
+                writer.close()
+                raise
+
+            if headers.get('connection', '').lower() == 'close':
+                writer.close()
+            else:
+                self.idle.append((reader, writer))
+            return status, headers, body
+
+    @staticmethod
+    async def read_response(reader):
+        head = await reader.readuntil(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            status = int(lines[0].split(' ')[1])
+        except IndexError:
+            raise ValueError("Malformed response line: %r" % lines[0])
+
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        body = await reader.readexactly(length) if length else b''
+        return status, headers, body
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+
+class AsyncEventListener(ServerEventListener):
+    """
+    Variant of the ServerEventListener running its requests on an
+    asyncio event loop in the synchronisation thread. Syncs and part
+    requests use separate pooled connections, so parts never wait
+    behind a sync in flight, and a reported line clear triggers a
+    sync right away.
+    
+    Instead of syncing every second, the interval adapts to the game:
+    MIN_INTERVAL while penalties are flowing or at most two players
+    are left, growing by BACKOFF per quiet round up to MAX_INTERVAL.
+    It is never shorter than the interval the server suggests in the
+    X-Poll-Interval header of its responses.
+    
+    If the server doesn't offer /sync, it falls back to polling like
+    its base class.
+    """
+
+    MIN_INTERVAL = 0.25
+    MAX_INTERVAL = 2.0
+    BACKOFF = 1.5
+
+    # Interval of asking for the game's start
+    START_INTERVAL = 0.5
+
+    def __init__(self, game, online_game_id, screen_name, host):
+        self.loop = None
+        self.prefetching = None
+        self.wakeup = None
+        self.http = None
+        self.interval = self.MIN_INTERVAL
+        self.server_interval = 0
+        ServerEventListener.__init__(self, game, online_game_id, screen_name, host)
+
+    def _synchronize(self):
+        asyncio.run(self.run())
+        if self.sync_supported is False and not self.game.aborted:
+            ServerEventListener._synchronize(self)
+        else:
+            self.unregister_from_server()
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        self.http = AsyncHTTPClient(self.host)
+        self.loop = asyncio.get_running_loop()
+        try:
+            while not self.game.aborted and not await self.poll_status():
+                await self.pause(max(self.START_INTERVAL, self.server_interval))
+            self.game.started = True
+
+            while (not self.game.aborted
+                   and not self.game.gameover
+                   and not self.game.victorious):
+                await self.pause(max(self.interval, self.server_interval))
+                if not await self.sync_round() and self.sync_supported is False:
+                    break
+        finally:
+            self.loop = None
+            self.http.close()
+
+    async def pause(self, seconds):
+        """
+        Waits for seconds, or until a line clear is reported
+        """
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+
+    async def fetch(self, method, target, body=b'', headers=None):
+        status, response_headers, data = await self.http.request(method, target, body, headers)
+        try:
+            self.server_interval = float(response_headers.get('x-poll-interval', 0))
+        except ValueError:
+            pass
+        return status, response_headers, data
+
+    async def poll_status(self):
+        """
+        Updates the players list, returns whether the game has started
+        """
+        try:
+            _, _, data = await self.fetch("GET", self.status_url())
+            game_info = json.loads(data.decode("utf-8"))
+        except (ConnectionFailed, asyncio.TimeoutError, ValueError) as ex:
+            logger.info("Status update failed: %s", ex)
+            self.error_msg = self.CANNOT_CONNECT_MSG
+            return False
+
+        self.handle_status(game_info)
+        return bool(game_info.get('started'))
+
+    async def sync_round(self):
+        penalties, lines_seq = self.penalties_received, self.lines_seq
+        body, headers = self.sync_request()
+        try:
+            status, response_headers, data = await self.fetch("POST", "/sync", body, headers)
+        except (ConnectionFailed, asyncio.TimeoutError) as ex:
+            logger.info("Sync failed: %s", ex)
+            self.adapt_interval(busy=False)
+            return False
+
+        synced = self.handle_sync_response(status, response_headers.get('content-type', ''), data)
+        self.adapt_interval(busy=(self.penalties_received != penalties
+                                  or self.lines_seq != lines_seq
+                                  or (synced and self.players_alive <= 2)))
+        return synced
+
+    def io_stats(self):
+        stats = ServerEventListener.io_stats(self)
+        if self.http is not None:
+            for name, value in self.http.stats.items():
+                stats[name] += value
+        return stats
+
+    def rtt_samples(self):
+        samples = ServerEventListener.rtt_samples(self)
+        if self.http is not None:
+            samples += self.http.rtts.values()
+        return samples
+
+    def adapt_interval(self, busy):
+        if busy:
+            self.interval = self.MIN_INTERVAL
+        else:
+            self.interval = min(self.interval * self.BACKOFF, self.MAX_INTERVAL)
+
+    async def prefetch_parts(self):
+        try:
+            offset = self.parts_needed()
+            if offset is None:
+                return
+            _, _, data = await self.fetch("GET", self.parts_url(offset))
+            self.add_parts(offset, json.loads(data.decode("utf-8")))
+        except (ConnectionFailed, asyncio.TimeoutError, ValueError) as ex:
+            logger.info("Getting parts failed: %s", ex)
+        finally:
+            self.prefetching = None
+
+    def request_parts(self):
+        loop = self.loop
+        if loop is None:
+            ServerEventListener.request_parts(self)
+            return
+        try:
+            loop.call_soon_threadsafe(self.start_prefetch)
+        except RuntimeError:
+            # The loop just finished
+            ServerEventListener.request_parts(self)
+
+    def start_prefetch(self):
+        if self.prefetching is None:
+            self.prefetching = asyncio.ensure_future(self.prefetch_parts())
+
+    def notify(self, event):
+        ServerEventListener.notify(self, event)
+        loop = self.loop
+        if isinstance(event, LinesDeletedEvent) and loop is not None:
+            try:
+                loop.call_soon_threadsafe(self.wakeup.set)
+            except RuntimeError:
+                # The loop just finished
+                pass
+
+
+LISTENER_CLASSES = {"poll": ServerEventListener,
+                    "push": PushEventListener,
+                    "async": AsyncEventListener}
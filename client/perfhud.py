@@ -0,0 +1,92 @@
+import time
+
+import pygame
+
+from ringbuffer import RingBuffer, percentiles
+
+
+class PerfHUD(pygame.Surface):
+    """
+    Overlay showing how the game is doing: frame times, round trip
+    times of requests to the server, queue depths and the time since
+    the last sync, to tell rendering stalls from network stalls.
+
+    Frames are recorded into ring buffers all the time, which is
+    about as cheap as it gets; everything else is only looked at
+    when the overlay is shown, and the text is rendered again no
+    more than every REFRESH_INTERVAL seconds.
+    """
+
+    FRAME_SAMPLES = 120
+    REFRESH_INTERVAL = 0.5
+
+    def __init__(self, dimensions, game):
+        self.dimensions = dimensions
+        pygame.Surface.__init__(self, dimensions)
+        self.set_alpha(200)
+
+        self.game = game
+        self.visible = False
+        self.font = pygame.font.Font('jack_type.ttf', 12)
+        self.font_color = (255, 255, 0)
+
+        # Milliseconds between frames, and of those the time spent
+        # on the frame rather than waiting for the next one
+        self.frame_times = RingBuffer(self.FRAME_SAMPLES)
+        self.busy_times = RingBuffer(self.FRAME_SAMPLES)
+
+        self.last_refresh = 0
+
+    def toggle(self):
+        self.visible = not self.visible
+        self.last_refresh = 0
+
+    def record_frame(self, frame_time, busy_time):
+        self.frame_times.append(frame_time)
+        self.busy_times.append(busy_time)
+
+    def render(self, screen, position=(5, 5)):
+        if not self.visible:
+            return
+        now = time.monotonic()
+        if now - self.last_refresh >= self.REFRESH_INTERVAL:
+            self.last_refresh = now
+            self.render_lines(self.readouts(now))
+        screen.blit(self, position)
+
+    def readouts(self, now):
+        p50, p95, p99 = self.frame_times.percentiles(50, 95, 99)
+        if p50 is None:
+            return ["No frames yet"]
+
+        values = self.frame_times.values()
+        lines = ["FPS %.1f" % (1000.0 * len(values) / max(sum(values), 1)),
+                 "Frame ms p50 %d p95 %d p99 %d max %d" % (p50, p95, p99, max(values)),
+                 "Busy ms p50 %d p95 %d" % tuple(self.busy_times.percentiles(50, 95))]
+
+        # Single player games have no listener
+        listener = getattr(self.game, 'listener', None)
+        if listener is None:
+            return lines
+
+        rtts = [1000 * rtt for rtt in listener.rtt_samples()]
+        if rtts:
+            lines.append("RTT ms p50 %d p95 %d max %d"
+                         % tuple(percentiles(rtts, 50, 95) + [max(rtts)]))
+        lines.append("Lines to send %d  penalties %d"
+                     % (len(listener.lines_to_send), len(self.game.penalties)))
+        lines.append("Parts buffered %d + queued %d  underruns %d"
+                     % (len(listener.parts_buffer), len(self.game.piece_queue),
+                        self.game.part_underruns))
+        if listener.last_sync is not None:
+            lines.append("Last sync %.1fs ago" % (now - listener.last_sync))
+        stats = listener.io_stats()
+        lines.append("Errors %(errors)d  retries %(retries)d  reconnects %(reconnects)d" % stats)
+        return lines
+
+    def render_lines(self, lines):
+        self.fill((0, 0, 0))
+        line_height = self.font.get_linesize()
+        for index, line in enumerate(lines):
+            text = self.font.render(line, True, self.font_color)
+            self.blit(text, (5, 5 + index * line_height))
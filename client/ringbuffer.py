@@ -0,0 +1,48 @@
+
+class RingBuffer(object):
+    """
+    Keeps the last 'size' values appended. Appending is cheap enough
+    for every frame or request; the statistics are computed only
+    when someone asks for them.
+
+    Values may be appended from one thread while another reads them.
+    """
+
+    def __init__(self, size):
+        self.items = [None] * size
+        self.index = 0
+        self.count = 0
+
+    def append(self, value):
+        self.items[self.index] = value
+        self.index = (self.index + 1) % len(self.items)
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, len(self.items))
+
+    def values(self):
+        """
+        Returns the values in the order they were appended
+        """
+        items, index = list(self.items), self.index
+        if self.count < len(items):
+            return items[:index]
+        return items[index:] + items[:index]
+
+    def last(self):
+        return self.items[self.index - 1] if self.count else None
+
+    def percentiles(self, *percents):
+        return percentiles(self.values(), *percents)
+
+
+def percentiles(values, *percents):
+    """
+    Returns the given percentiles of the values, None if there are none
+    """
+    values = sorted(values)
+    if not values:
+        return [None] * len(percents)
+    return [values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+            for percent in percents]
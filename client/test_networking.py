@@ -0,0 +1,240 @@
+import asyncio
+import os
+import socket
+import sys
+import time
+import unittest
+
+import networking
+from networking import AsyncEventListener, ServerEventListener
+
+CLIENT_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(CLIENT_DIR, os.pardir, 'server')
+
+# The server runs in this process. Its modules are imported from its
+# directory, along with its own events module, and ours is put back
+client_events = sys.modules.pop('events')
+sys.path.insert(0, SERVER_DIR)
+try:
+    from servertest import ServerTestCase
+finally:
+    sys.path.remove(SERVER_DIR)
+    sys.modules['events'] = client_events
+
+
+class FakeGame(object):
+    """
+    The parts of a game the listeners use, with a 4x5 board
+    """
+
+    column_nr = 4
+
+    def __init__(self):
+        self.cells = [0] * 20
+        self.moving_piece_indexes = []
+        self.board_version = 0
+        self.penalties = []
+        self.aborted = self.gameover = self.victorious = False
+        self.started = False
+
+    def add_observer(self, observer):
+        pass
+
+    def regurgitate(self, lines):
+        self.penalties.append(lines)
+
+
+def close_worker(worker):
+    worker.close()
+    for connection in list(worker.connections):
+        connection.close()
+
+
+class ListenerTestCase(ServerTestCase):
+    """
+    Creates a game of 'size' players, joined by our listener as p0
+    and by the others through the server's test client
+    """
+
+    size = 2
+    listener_class = ServerEventListener
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.game_id = self.post("/new", {'size': self.size})['game_id']
+        self.game = FakeGame()
+        self.listener = self.listener_class(self.game, self.game_id, 'p0',
+                                            self.server_thread.address)
+        self.player_ids = [self.listener.player_id] + [
+            self.get("/register?game_id=%s&screen_name=p%d" % (self.game_id, idx))['player_id']
+            for idx in range(1, self.size)]
+
+    def tearDown(self):
+        close_worker(self.listener.io)
+        ServerTestCase.tearDown(self)
+
+    def send_lines(self, player_idx, lines):
+        resp = self.post("/sendlines", {'game_id': self.game_id,
+                                        'player_id': self.player_ids[player_idx],
+                                        'num_lines': lines})
+        assert resp['info'].startswith("Added"), "Lines not added %s" % resp
+
+
+class AsyncListenerTest(ListenerTestCase):
+    size = 3
+    listener_class = AsyncEventListener
+
+    def sync_rounds(self, count):
+        """
+        Runs count sync rounds, returns the intervals after each
+        """
+        async def run():
+            self.listener.http = networking.AsyncHTTPClient(self.listener.host)
+            try:
+                intervals = []
+                for _ in range(count):
+                    assert await self.listener.sync_round(), "Sync failed"
+                    intervals.append(self.listener.interval)
+                return intervals
+            finally:
+                self.listener.http.close()
+        return asyncio.run(run())
+
+    def test_interval_adaptation(self):
+        listener = self.listener
+        # Quiet rounds back off up to MAX_INTERVAL
+        intervals = self.sync_rounds(8)
+        assert intervals[:3] == [listener.MIN_INTERVAL * listener.BACKOFF ** n
+                                 for n in range(1, 4)], "No backoff %s" % intervals
+        assert intervals[-1] == listener.MAX_INTERVAL, "Interval not capped %s" % intervals
+
+        # Penalties make it sync fast again
+        self.send_lines(1, 2)
+        assert self.sync_rounds(1) == [listener.MIN_INTERVAL], "Penalty ignored"
+        assert self.game.penalties == [2], "Bad penalties %s" % self.game.penalties
+        assert self.sync_rounds(1) == [listener.MIN_INTERVAL * listener.BACKOFF], \
+            "No backoff after penalty"
+
+        # And so does the end game of two players
+        self.post("/unregister", {'game_id': self.game_id, 'player_id': self.player_ids[2]})
+        assert self.sync_rounds(2) == [listener.MIN_INTERVAL] * 2, "End game not busy"
+
+
+class PartsTest(ListenerTestCase):
+    def test_refill_threshold(self):
+        listener = self.listener
+        assert listener.parts_needed() == 0, "Empty buffer not refilled"
+
+        assert listener.sync(), "Sync failed"
+        # The sequence of parts is the same for all players
+        parts = self.post("/sync", {'game_id': self.game_id, 'player_id': self.player_ids[1],
+                                    'parts_offset': 0, 'parts': 2 * listener.PARTS_BATCH})['parts']
+        assert list(listener.parts_buffer) == parts[:listener.PARTS_BATCH], "Bad parts"
+        assert listener.parts_needed() is None, "Full buffer refilled"
+
+        # Taking parts down to PARTS_LOW_WATER doesn't fetch any
+        for _ in range(listener.PARTS_BATCH - listener.PARTS_LOW_WATER):
+            listener.parts_buffer.popleft()
+        assert listener.sync(), "Sync failed"
+        assert len(listener.parts_buffer) == listener.PARTS_LOW_WATER, "Parts fetched early"
+
+        # Below it, the next sync brings a batch
+        listener.parts_buffer.popleft()
+        assert listener.parts_needed() == listener.PARTS_BATCH, "Bad offset"
+        assert listener.sync(), "Sync failed"
+        assert listener.parts_offset == 2 * listener.PARTS_BATCH, "Bad offset"
+        taken = listener.get_next_parts()
+        assert taken == parts[listener.PARTS_LOW_WATER + 1:2 * listener.PARTS_BATCH], \
+            "Parts out of sequence %s" % taken
+        assert listener.parts_needed() == 2 * listener.PARTS_BATCH, "Empty buffer not refilled"
+
+
+class SingleConnectionWorker(networking.RequestWorker):
+    POOL_SIZE = 1
+    BACKOFF_MIN = 0.05
+
+
+class RequestWorkerTest(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.worker = SingleConnectionWorker(self.server_thread.address)
+
+    def tearDown(self):
+        close_worker(self.worker)
+        ServerTestCase.tearDown(self)
+
+    def drop_connections(self):
+        for connection in self.worker.connections:
+            connection.sock.shutdown(socket.SHUT_RDWR)
+
+    def test_dropped_connection(self):
+        assert self.worker.request("GET", "/list", idempotent=True)[0] == 200, "Request failed"
+
+        # Idempotent requests are retried on a new connection
+        self.drop_connections()
+        assert self.worker.request("GET", "/list", idempotent=True)[0] == 200, "Not retried"
+        assert self.worker.stats == {'requests': 2, 'errors': 1, 'retries': 1, 'reconnects': 1}, \
+            "Bad stats %s" % self.worker.stats
+
+        # Others fail, the server might have performed them
+        self.drop_connections()
+        self.assertRaises(networking.ConnectionFailed, self.worker.request,
+                          "POST", "/new", "size=2", networking.POST_HEADERS)
+        assert self.worker.stats['retries'] == 1, "Retried %s" % self.worker.stats
+        assert len(self.get("/list")) == 0, "Game created"
+
+    def test_backoff(self):
+        # Nobody listens on a bound socket
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            worker = SingleConnectionWorker("127.0.0.1:%d" % sock.getsockname()[1])
+            try:
+                started = time.monotonic()
+                self.assertRaises(networking.ConnectionFailed, worker.request,
+                                  "GET", "/list", idempotent=True)
+                elapsed = time.monotonic() - started
+            finally:
+                close_worker(worker)
+
+        assert worker.stats == {'requests': 1, 'errors': 4, 'retries': 3, 'reconnects': 3}, \
+            "Bad stats %s" % worker.stats
+        # Waiting BACKOFF_MIN, then twice and four times as long
+        assert elapsed >= 7 * worker.BACKOFF_MIN, "No backoff: %.3f seconds" % elapsed
+
+
+class SnapshotTest(ListenerTestCase):
+    def sent_snapshot(self):
+        """
+        Returns the snapshot the next sync would send
+        """
+        body, _ = self.listener.sync_request()
+        return networking.wire.decode_sync_request(body)['game_snapshot']
+
+    def opponent_snapshot(self):
+        resp = self.get("/status?game_id=%s&player_id=%s" % (self.game_id, self.player_ids[1]))
+        return dict((info['player_id'], info.get('snapshot'))
+                    for info in resp['screen_names'])[self.player_ids[0]]
+
+    def test_unchanged_snapshot_skipped(self):
+        listener = self.listener
+        assert listener.sync(), "Sync failed"
+        assert listener.binary_supported, "Server answered in JSON"
+        assert self.opponent_snapshot() == "4," + "0" * 20, "Bad snapshot"
+
+        # The server has this version already
+        assert self.sent_snapshot() is None, "Unchanged snapshot sent"
+        assert listener.sync(), "Sync failed"
+        assert self.opponent_snapshot() == "4," + "0" * 20, "Snapshot lost"
+
+        self.game.cells[-4:] = [1] * 4
+        self.game.board_version += 1
+        assert self.sent_snapshot() == "4," + "0" * 16 + "1" * 4, "Changed snapshot not sent"
+        # Until a sync went through, it is sent again
+        assert self.sent_snapshot() is not None, "Snapshot not sent again"
+        assert listener.sync(), "Sync failed"
+        assert self.opponent_snapshot() == "4," + "0" * 16 + "1" * 4, "Snapshot not updated"
+        assert self.sent_snapshot() is None, "Unchanged snapshot sent"
+
+
+if __name__ == '__main__':
+    unittest.main()
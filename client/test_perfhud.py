@@ -0,0 +1,41 @@
+import os
+import unittest
+
+# No window needed to render into surfaces
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+from gamemodel import create_game
+from perfhud import PerfHUD
+
+CLIENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class PerfHUDTest(unittest.TestCase):
+    def setUp(self):
+        # The font is loaded relative to the client directory
+        self.cwd = os.getcwd()
+        os.chdir(CLIENT_DIR)
+        pygame.init()
+
+    def tearDown(self):
+        pygame.quit()
+        os.chdir(self.cwd)
+
+    def test_single_player(self):
+        game = create_game({'game_type': 'single', 'dimensions': (10, 20), 'duck_prob': 0.1})
+        hud = PerfHUD((300, 130), game)
+        assert hud.readouts(0) == ["No frames yet"], "Bad readouts %s" % hud.readouts(0)
+
+        for frame in range(10):
+            hud.record_frame(33 + frame, 5)
+        lines = hud.readouts(0)
+        assert len(lines) == 3 and lines[0].startswith("FPS"), "Bad readouts %s" % lines
+
+        hud.toggle()
+        hud.render(pygame.Surface((450, 600)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+"""
+Compact binary encoding of /sync requests and responses.
+
+The same module lives in client/wire.py and server/wire.py, since
+client and server are deployed separately. Keep both copies
+identical, test_wire.py checks that they are. Bits are packed by
+snapshotcodec.pack_bits, the packer shared with the snapshot codec.
+
+Every message starts with a struct-packed header: the magic bytes
+'EW', the protocol version and the message type. The fields follow
+as unsigned LEB128 varints. Boards ('<cols>,<bits>' snapshots) and
+rows are sent as bit strings, i.e. their length followed by the bits
+packed into bytes. Lists are prefixed with their length.
+
+A client announces that it understands binary responses by sending
+'Accept: application/x-entris'. Once it got one, it knows the server
+speaks the protocol and sends its requests in binary as well. Clients
+and servers without binary support keep talking JSON.
+"""
+
+import struct
+
+from snapshotcodec import pack_bits, unpack_bits
+
+CONTENT_TYPE = 'application/x-entris'
+
+MAGIC = b'EW'
+VERSION = 1
+
+SYNC_REQUEST = 1
+SYNC_RESPONSE = 2
+
+HEADER = struct.Struct('>2sBB')
+
+# Kinds of snapshot deltas in a sync response
+FULL_SNAPSHOT = 0
+CHANGED_ROWS = 1
+
+
+class WireError(Exception):
+    pass
+
+
+class Writer(object):
+    def __init__(self, message_type):
+        self.buf = bytearray(HEADER.pack(MAGIC, VERSION, message_type))
+
+    def varint(self, value):
+        while value >= 0x80:
+            self.buf.append((value & 0x7F) | 0x80)
+            value >>= 7
+        self.buf.append(value)
+
+    def varints(self, values):
+        self.varint(len(values))
+        for value in values:
+            self.varint(value)
+
+    def bits(self, bits):
+        self.varint(len(bits))
+        self.buf += pack_bits(bits)
+
+    def board(self, snapshot):
+        cols, _, bits = snapshot.partition(',')
+        self.varint(int(cols or 0))
+        self.bits(bits)
+
+    def getvalue(self):
+        return bytes(self.buf)
+
+
+class Reader(object):
+    def __init__(self, data, message_type):
+        if len(data) < HEADER.size:
+            raise WireError("Message too short")
+        magic, version, actual_type = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise WireError("Unsupported protocol %r version %s" % (magic, version))
+        if actual_type != message_type:
+            raise WireError("Expected message type %s, got %s" % (message_type, actual_type))
+
+        self.data = data
+        self.pos = HEADER.size
+
+    def varint(self):
+        value = shift = 0
+        while True:
+            if self.pos >= len(self.data):
+                raise WireError("Truncated message")
+            byte = self.data[self.pos]
+            self.pos += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def varints(self):
+        return [self.varint() for _ in range(self.varint())]
+
+    def bits(self):
+        length = self.varint()
+        end = self.pos + (length + 7) // 8
+        if end > len(self.data):
+            raise WireError("Truncated message")
+        data, self.pos = self.data[self.pos:end], end
+        return unpack_bits(data, length)
+
+    def board(self):
+        cols = self.varint()
+        bits = self.bits()
+        return "%d,%s" % (cols, bits) if cols else ''
+
+
+def encode_sync_request(request):
+    """
+    Encodes a dictionary holding the /sync parameters game_id, player_id,
+    lines, lines_seq, game_snapshot (None if unchanged), since,
+    parts_offset and parts. Ids must be numeric.
+    """
+    writer = Writer(SYNC_REQUEST)
+    writer.varint(int(request['game_id']))
+    writer.varint(int(request['player_id']))
+    writer.varint(request['lines_seq'])
+    writer.varints(request['lines'])
+
+    snapshot = request['game_snapshot']
+    writer.varint(0 if snapshot is None else 1)
+    if snapshot is not None:
+        writer.board(snapshot)
+
+    writer.varint(request['since'])
+    writer.varint(request['parts_offset'])
+    writer.varint(request['parts'])
+    return writer.getvalue()
+
+
+def decode_sync_request(data):
+    reader = Reader(data, SYNC_REQUEST)
+    request = {'game_id': str(reader.varint()),
+               'player_id': str(reader.varint()),
+               'lines_seq': reader.varint(),
+               'lines': reader.varints()}
+    request['game_snapshot'] = reader.board() if reader.varint() else None
+    request['since'] = reader.varint()
+    request['parts_offset'] = reader.varint()
+    request['parts'] = reader.varint()
+    return request
+
+
+def encode_sync_response(response):
+    """
+    Encodes the dictionary a /sync request is answered with in JSON
+    """
+    writer = Writer(SYNC_RESPONSE)
+    writer.varint(response['lines_seq'])
+    writer.varints(response['penalties'])
+    writer.varint(response['snapshot_version'])
+    writer.varints([int(pid) for pid in response['players_alive']])
+
+    deltas = response['snapshot_deltas']
+    writer.varint(len(deltas))
+    for player_id, delta in deltas.items():
+        writer.varint(int(player_id))
+        writer.varint(delta['version'])
+        if 'rows' in delta:
+            writer.varint(CHANGED_ROWS)
+            writer.varint(len(delta['rows']))
+            for row_index, row_bits in delta['rows']:
+                writer.varint(row_index)
+                writer.bits(row_bits)
+        else:
+            writer.varint(FULL_SNAPSHOT)
+            writer.board(delta['snapshot'])
+
+    writer.varint(response['parts_offset'])
+    writer.varints(response['parts'])
+    return writer.getvalue()
+
+
+def decode_sync_response(data):
+    reader = Reader(data, SYNC_RESPONSE)
+    response = {'lines_seq': reader.varint(),
+                'penalties': reader.varints(),
+                'snapshot_version': reader.varint(),
+                'players_alive': [str(pid) for pid in reader.varints()]}
+
+    deltas = response['snapshot_deltas'] = {}
+    for _ in range(reader.varint()):
+        player_id = str(reader.varint())
+        delta = deltas[player_id] = {'version': reader.varint()}
+        if reader.varint() == CHANGED_ROWS:
+            delta['rows'] = [[reader.varint(), reader.bits()]
+                             for _ in range(reader.varint())]
+        else:
+            delta['snapshot'] = reader.board()
+
+    response['parts_offset'] = reader.varint()
+    response['parts'] = reader.varints()
+    return response
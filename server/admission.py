@@ -0,0 +1,78 @@
+"""
+Admission control for new games, based on the measured load of
+the server process instead of a fixed maximum number of games.
+
+A LoadMonitor is sampled periodically. It keeps the resident memory
+of the process and a moving average of its CPU utilization (1.0 being
+one core fully busy, which is all a worker's event loop can use).
+New games are refused while either exceeds its limit, so short bursts
+of work don't lock out players.
+"""
+
+import os
+import time
+
+# Weight of the latest sample in the CPU utilization average
+CPU_SMOOTHING = 0.3
+
+# Default limits: the share of the physical memory a server (or all
+# its workers together) may use, and the CPU utilization of a worker
+DEFAULT_MEMORY_SHARE = 0.75
+DEFAULT_MAX_CPU = 0.9
+
+
+def resident_memory():
+    """
+    Returns the resident set size of the process in bytes,
+    or None where it can't be determined.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def physical_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def default_max_memory(workers=1):
+    total = physical_memory()
+    return int(total * DEFAULT_MEMORY_SHARE / workers) if total else None
+
+
+class LoadMonitor(object):
+    def __init__(self, max_memory=None, max_cpu=DEFAULT_MAX_CPU):
+        """
+        max_memory is in bytes. A limit of None isn't enforced.
+        """
+        self.max_memory = max_memory
+        self.max_cpu = max_cpu
+
+        self.memory = resident_memory()
+        self.cpu = 0.0
+        self.last_wall = time.monotonic()
+        self.last_cpu = time.process_time()
+
+    def sample(self):
+        wall, cpu = time.monotonic(), time.process_time()
+        if wall > self.last_wall:
+            utilization = (cpu - self.last_cpu) / (wall - self.last_wall)
+            self.cpu += CPU_SMOOTHING * (utilization - self.cpu)
+        self.last_wall, self.last_cpu = wall, cpu
+        self.memory = resident_memory()
+
+    def overloaded(self):
+        """
+        Returns the reason for refusing new games, or None
+        """
+        if self.max_memory is not None and self.memory is not None \
+                and self.memory > self.max_memory:
+            return 'memory'
+        if self.max_cpu is not None and self.cpu > self.max_cpu:
+            return 'cpu'
+        return None
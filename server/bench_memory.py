@@ -0,0 +1,96 @@
+"""
+Benchmark of the memory held per game and per player.
+
+Creates idle games (no players yet), then running games whose
+players have sent a number of snapshots, penalties and part requests,
+all through the application's handlers. Memory is measured with
+tracemalloc, so only what the server keeps for the games counts.
+Prints one JSON line:
+
+    python bench_memory.py --games 20000 --running 5000 --size 4
+"""
+
+import argparse
+import gc
+import json
+import logging
+import random
+import tracemalloc
+import urllib.parse
+
+import server
+from httpserver import Request
+from timerwheel import TimerWheel
+
+FORM_HEADERS = {'content-type': 'application/x-www-form-urlencoded'}
+
+
+def call(method, path, params):
+    query = urllib.parse.urlencode(params)
+    if method == 'GET':
+        request = Request('GET', '%s?%s' % (path, query), {})
+    else:
+        request = Request('POST', path, FORM_HEADERS, query.encode())
+    response = server.application.dispatch(request)
+    return json.loads(response.body or response.out.getvalue())
+
+
+def traced():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def create_games(number, size):
+    return [call('POST', '/new', {'size': size})['game_id'] for _ in range(number)]
+
+
+def play(game_ids, size, snapshots, rng, cols=20, rows=25):
+    for game_id in game_ids:
+        player_ids = [call('GET', '/register', {'game_id': game_id})['player_id']
+                      for _ in range(size)]
+        for player_id in player_ids:
+            ids = {'game_id': game_id, 'player_id': player_id}
+            board = ['0' * cols] * rows
+            for _ in range(snapshots):
+                board[rng.randrange(rows)] = "".join(rng.choice('01') for _ in range(cols))
+                call('GET', '/receive', dict(ids, game_snapshot="%d,%s" % (cols, "".join(board))))
+            call('GET', '/getparts', ids)
+            call('POST', '/sendlines', dict(ids, num_lines=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--games', type=int, default=20000, help='idle games')
+    parser.add_argument('--running', type=int, default=5000, help='running games')
+    parser.add_argument('--size', type=int, default=4, help='players per running game')
+    parser.add_argument('--snapshots', type=int, default=10,
+                        help='snapshots sent by every player')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    server.games.clear()
+    server.timers = TimerWheel()
+    rng = random.Random(args.seed)
+
+    tracemalloc.start()
+    start = traced()
+    create_games(args.games, args.size)
+    idle = traced()
+
+    game_ids = create_games(args.running, args.size)
+    running_games = traced()
+    play(game_ids, args.size, args.snapshots, rng)
+    running = traced()
+    tracemalloc.stop()
+
+    players = args.running * args.size
+    print(json.dumps({'games': len(server.games),
+                      'players': players,
+                      'bytes_per_idle_game': round((idle - start) / float(args.games)),
+                      'bytes_per_active_player': round((running - running_games) / float(players)),
+                      'bytes_total': running - start}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark of /receive throughput for different numbers of worker processes.
+
+Starts the server with --workers N for every N given, creates a set of
+running two-player games and lets several load processes poll /receive
+on keep-alive connections for a while. Prints one JSON line per N:
+
+    python bench_sharding.py --workers 1 2 4 --seconds 5
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import multiprocessing
+import os
+import time
+
+from sharding import read_response
+from serverprocess import free_port, start_server
+
+
+def create_players(port, games):
+    """
+    Returns a list of (game_id, player_id) of running games
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    players = []
+    for _ in range(games):
+        conn.request("POST", "/new", "size=2",
+                     {"Content-type": "application/x-www-form-urlencoded"})
+        game_id = json.loads(conn.getresponse().read().decode())['game_id']
+        for _ in range(2):
+            conn.request("GET", "/register?game_id=%s" % game_id)
+            player_id = json.loads(conn.getresponse().read().decode())['player_id']
+            players.append((game_id, player_id))
+    conn.close()
+    return players
+
+
+async def poll(port, players, deadline):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    requests = [("GET /receive?game_id=%s&player_id=%s HTTP/1.1\r\nHost: bench\r\n\r\n"
+                 % player).encode() for player in players]
+    count = 0
+    while time.time() < deadline:
+        writer.write(requests[count % len(requests)])
+        await read_response(reader)
+        count += 1
+    writer.close()
+    return count
+
+
+def load_process(port, players, connections, seconds, results):
+    async def run():
+        deadline = time.time() + seconds
+        counts = await asyncio.gather(*[poll(port, players[idx::connections], deadline)
+                                        for idx in range(connections)])
+        return sum(counts)
+    results.put(asyncio.run(run()))
+
+
+def measure(workers, args):
+    port = free_port(workers + 1)
+    process = start_server(port, workers)
+    try:
+        players = create_players(port, args.games)
+        results = multiprocessing.Queue()
+        loaders = [multiprocessing.Process(target=load_process,
+                                           args=(port, players[idx::args.clients],
+                                                 args.connections, args.seconds, results))
+                   for idx in range(args.clients)]
+        for loader in loaders:
+            loader.start()
+        total = sum(results.get() for _ in loaders)
+        for loader in loaders:
+            loader.join()
+    finally:
+        process.terminate()
+        process.wait()
+
+    return {'workers': workers,
+            'requests': total,
+            'requests_per_second': round(total / float(args.seconds), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=os.cpu_count() or 1,
+                        help='number of load generating processes')
+    parser.add_argument('--connections', type=int, default=16,
+                        help='keep-alive connections per load process')
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in args.workers:
+        result = measure(workers, args)
+        baseline = baseline or result['requests_per_second']
+        result['speedup'] = round(result['requests_per_second'] / baseline, 2)
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Microbenchmark of the board snapshot encodings of snapshotcodec.py.
+
+For each grid size offered by the client, encodes and decodes boards
+filled up to various heights with a moving piece on top, the way the
+client's monitoring.compress and decompress do, and compares them to
+the original per-cell implementation. Prints one JSON line per grid
+size and encoding:
+
+    python bench_snapshots.py --boards 200
+"""
+
+import argparse
+import json
+import random
+import time
+
+import snapshotcodec
+
+# Grid sizes offered by the client (config.GAME_DIMENSIONS_OPTIONS)
+GRID_SIZES = [(20, 25), (25, 32), (30, 40)]
+
+ENCODINGS = [('original', None, None),
+             ('format 1', 1, None),
+             ('format 2', 2, None),
+             ('format 2 zlib', 2, 'z')]
+
+
+def original_compress(cols, cells, moving_piece_indexes):
+    cells = "".join(["1" if (c or idx in moving_piece_indexes)
+                     else "0"
+                     for idx, c in enumerate(cells)])
+    return str(cols) + "," + cells
+
+
+def original_decompress(compressed):
+    row_length_str, data = compressed.split(",")
+    row_length = int(row_length_str)
+    return [[int(x) for x in data[idx * row_length:(idx + 1) * row_length]]
+            for idx in range(len(data) // row_length)]
+
+
+class MovingPiece(object):
+    """
+    Stands in for the client's game, whose moving piece indexes are
+    a property computed on every access
+    """
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+    @property
+    def moving_piece_indexes(self):
+        return list(self.indexes)
+
+
+def make_board(cols, rows, rng):
+    height = rng.randint(0, rows * 3 // 4)
+    cells = [0] * (cols * (rows - height))
+    cells += [(100, 100, 255) if rng.random() < 0.8 else 0 for _ in range(cols * height)]
+    left = rng.randrange(cols - 2)
+    return cells, MovingPiece([left, left + 1, left + cols + 1, left + cols + 2])
+
+
+def measure(function, args_list):
+    start = time.perf_counter()
+    results = [function(*args) for args in args_list]
+    return (time.perf_counter() - start) / len(args_list), results
+
+
+def bench(size, boards, name, format, codec, rng):
+    cols, rows = size
+    games = [make_board(cols, rows, rng) for _ in range(boards)]
+
+    if format is None:
+        encode = lambda cells, piece: original_compress(cols, cells, piece.moving_piece_indexes)
+        decode = original_decompress
+    else:
+        encode = lambda cells, piece: snapshotcodec.encode(
+            cols, snapshotcodec.cells_to_flags(cells, piece.moving_piece_indexes), format, codec)
+        decode = snapshotcodec.rows
+
+    encode_time, snapshots = measure(encode, games)
+    decode_time, decoded = measure(decode, [(snapshot,) for snapshot in snapshots])
+    reference = [original_decompress(original_compress(cols, cells, piece.moving_piece_indexes))
+                 for cells, piece in games]
+    assert decoded == reference, "%s decodes differently" % name
+
+    return {'grid': "%sx%s" % size,
+            'encoding': name,
+            'chars_per_snapshot': round(sum(map(len, snapshots)) / float(boards), 1),
+            'encode_us': round(encode_time * 1e6, 1),
+            'decode_us': round(decode_time * 1e6, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--boards', type=int, default=200,
+                        help='boards per grid size and encoding')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    for size in GRID_SIZES:
+        for name, format, codec in ENCODINGS:
+            print(json.dumps(bench(size, args.boards, name, format, codec,
+                                   random.Random(args.seed))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmark of /sync traffic and server CPU time, JSON vs. binary.
+
+Plays a number of seconds of a game with P players on each grid size:
+every second, each player changes a few rows of its board, sends a
+line clear now and then and syncs. Requests are dispatched to the
+application directly, so the numbers don't include any network or
+HTTP overhead. Prints one JSON line per players, grid size and
+encoding:
+
+    python bench_wire.py --players 2 6 --seconds 60
+"""
+
+import argparse
+import json
+import logging
+import random
+import time
+import urllib.parse
+
+import server
+import wire
+from httpserver import Request
+from timerwheel import TimerWheel
+
+# Grid sizes offered by the client
+GRID_SIZES = [(20, 25), (25, 32), (30, 40)]
+
+FORM_HEADERS = {'content-type': 'application/x-www-form-urlencoded'}
+JSON_HEADERS = dict(FORM_HEADERS, accept='application/json')
+BINARY_HEADERS = {'content-type': wire.CONTENT_TYPE, 'accept': wire.CONTENT_TYPE}
+
+
+def call(method, path, params):
+    body = urllib.parse.urlencode(params).encode()
+    response = server.application.dispatch(Request(method, path, FORM_HEADERS, body))
+    return json.loads(response.out.getvalue())
+
+
+def create_game(players):
+    game_id = call('POST', '/new', {'size': players})['game_id']
+    player_ids = [call('GET', '/register', {'game_id': game_id})['player_id']
+                  for _ in range(players)]
+    return game_id, player_ids
+
+
+def sync(args, binary):
+    """
+    Returns request bytes, response bytes and the reply
+    """
+    if binary:
+        request = Request('POST', '/sync', BINARY_HEADERS, wire.encode_sync_request(args))
+    else:
+        params = dict(args, lines=",".join(str(n) for n in args['lines']))
+        if params['game_snapshot'] is None:
+            del params['game_snapshot']
+        request = Request('POST', '/sync', JSON_HEADERS,
+                          urllib.parse.urlencode(params).encode())
+
+    response = server.application.dispatch(request)
+    if binary:
+        body = response.body
+        reply = wire.decode_sync_response(body)
+    else:
+        body = response.out.getvalue().encode()
+        reply = json.loads(body.decode())
+    return len(request.body), len(body), reply
+
+
+def play(players, size, seconds, binary, rng):
+    server.games.clear()
+    server.timers = TimerWheel()
+    game_id, player_ids = create_game(players)
+    cols, rows = size
+
+    boards = {pid: ['0' * cols] * rows for pid in player_ids}
+    state = {pid: {'game_id': game_id, 'player_id': pid, 'lines': [], 'lines_seq': 0,
+                   'since': 0, 'parts_offset': 0, 'parts': 20}
+             for pid in player_ids}
+    sent = received = 0
+    cpu = 0.0
+
+    for second in range(seconds):
+        for pid in player_ids:
+            board = boards[pid]
+            for _ in range(rng.randint(1, 3)):
+                row = rng.randrange(rows)
+                board[row] = "".join(rng.choice('01') for _ in range(cols))
+            args = state[pid]
+            if rng.random() < 0.1:
+                args['lines'].append(rng.randint(1, 4))
+            args['game_snapshot'] = "%d,%s" % (cols, "".join(board))
+
+            start = time.process_time()
+            request_bytes, response_bytes, reply = sync(args, binary)
+            cpu += time.process_time() - start
+            sent += request_bytes
+            received += response_bytes
+
+            del args['lines'][:reply['lines_seq'] - args['lines_seq']]
+            args['lines_seq'] = reply['lines_seq']
+            args['since'] = reply['snapshot_version']
+            args['parts_offset'] += len(reply['parts'])
+            args['parts'] = 20 if second % 10 == 9 else 0
+
+    requests = players * seconds
+    return {'players': players,
+            'grid': "%sx%s" % size,
+            'encoding': 'binary' if binary else 'json',
+            'request_bytes_per_player_second': round(sent / float(requests), 1),
+            'response_bytes_per_player_second': round(received / float(requests), 1),
+            'server_cpu_us_per_request': round(cpu / requests * 1e6, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--players', type=int, nargs='+', default=[2, 6])
+    parser.add_argument('--seconds', type=int, default=60,
+                        help='seconds of game play to simulate')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    for players in args.players:
+        for size in GRID_SIZES:
+            for binary in (False, True):
+                print(json.dumps(play(players, size, args.seconds, binary,
+                                      random.Random(args.seed))))
+
+
+if __name__ == '__main__':
+    main()
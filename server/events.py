@@ -0,0 +1,21 @@
+
+class Event(object):
+    pass
+
+class PenaltyEvent(Event):
+    """
+    Penalty lines have been queued for all players but the sender
+    """
+    def __init__(self, sender_id):
+        self.sender_id = sender_id
+
+class SnapshotEvent(Event):
+    def __init__(self, player_id, snapshot):
+        self.player_id = player_id
+        self.snapshot = snapshot
+
+class PlayersChangedEvent(Event):
+    """
+    A player joined, left or was kicked, or the game started
+    """
+    pass
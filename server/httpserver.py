@@ -0,0 +1,314 @@
+"""
+A small asyncio based HTTP/1.1 server for the Entris request handlers.
+
+It mimics the tiny subset of the old webapp API the handlers rely on
+(self.request.get, self.response.out.write, self.response.headers),
+so the handlers in server.py don't need to know about sockets at all.
+Connections are kept alive between requests, so a single process can
+serve thousands of polling clients at once.
+"""
+
+import asyncio
+import inspect
+import io
+import logging
+import threading
+import time
+import urllib.parse
+from http import HTTPStatus
+
+logger = logging.getLogger('Server')
+
+# Limits protecting us from clients sending garbage
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+
+# Idle keep-alive connections are closed after this many seconds
+KEEP_ALIVE_TIMEOUT = 75
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Request(object):
+    """
+    A parsed HTTP request. Query string and urlencoded
+    form parameters are merged into one parameter mapping.
+    """
+
+    def __init__(self, method, target, headers, body=b'', version='HTTP/1.1'):
+        self.method = method
+        self.path, _, self.query_string = target.partition('?')
+        self.headers = headers
+        self.body = body
+        self.version = version
+
+        self.params = urllib.parse.parse_qs(self.query_string, keep_blank_values=True)
+        if body and headers.get('content-type', '').startswith(FORM_CONTENT_TYPE):
+            form = urllib.parse.parse_qs(body.decode('utf-8', 'replace'),
+                                         keep_blank_values=True)
+            for name, values in form.items():
+                self.params.setdefault(name, []).extend(values)
+
+    def get(self, argument_name, default_value=''):
+        values = self.params.get(argument_name)
+        return values[0] if values else default_value
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+
+class Response(object):
+    def __init__(self):
+        self.status = 200
+        self.headers = {'Content-Type': 'text/plain; charset=utf-8'}
+        self.out = io.StringIO()
+
+        # Raw body bytes, sent instead of what has been written to 'out'
+        self.body = None
+
+        # Coroutine function taking over the connection after a
+        # '101 Switching Protocols' response, called with the
+        # connection's (reader, writer) pair.
+        self.upgrade = None
+
+    def set_status(self, code):
+        self.status = code
+
+    def clear(self):
+        self.out = io.StringIO()
+        self.body = None
+
+    def encode(self, keep_alive=True):
+        lines = ['HTTP/1.1 %d %s' % (self.status, HTTPStatus(self.status).phrase)]
+        lines.extend('%s: %s' % item for item in self.headers.items())
+
+        if self.status == 101:
+            # The connection is handed over to the upgrade coroutine
+            head = '\r\n'.join(lines) + '\r\n\r\n'
+            return head.encode('latin-1')
+
+        body = self.body if self.body is not None else self.out.getvalue().encode('utf-8')
+        lines.append('Content-Length: %d' % len(body))
+        lines.append('Connection: %s' % ('keep-alive' if keep_alive else 'close'))
+        head = '\r\n'.join(lines) + '\r\n\r\n'
+        return head.encode('latin-1') + body
+
+
+class RequestHandler(object):
+    """
+    Base class for request handlers. Subclasses implement
+    get() and/or post().
+    """
+
+    def __init__(self, request, response):
+        self.request = request
+        self.response = response
+
+    def error(self, code):
+        self.response.set_status(code)
+        self.response.clear()
+
+
+class Application(object):
+    """
+    Maps paths to handler classes and dispatches requests to them.
+    """
+
+    def __init__(self, url_mapping):
+        self.routes = dict(url_mapping)
+
+        # Coroutine functions run as tasks while the application is served
+        self.background_tasks = []
+
+        # If set, metrics.observe(path, seconds) is called with the
+        # time it took to handle each request to a known route
+        self.metrics = None
+
+    def dispatch(self, request):
+        response = Response()
+
+        handler_class = self.routes.get(request.path)
+        if handler_class is None:
+            response.set_status(404)
+            return response
+
+        method = getattr(handler_class, request.method.lower(), None)
+        if method is None:
+            response.set_status(405)
+            return response
+
+        start = time.perf_counter()
+        try:
+            method(handler_class(request, response))
+        except Exception:
+            logger.exception("Error handling %s %s", request.method, request.path)
+            response = Response()
+            response.set_status(500)
+
+        if self.metrics is not None:
+            self.metrics.observe(request.path, time.perf_counter() - start)
+        return response
+
+
+async def read_request(reader):
+    """
+    Reads one request from the stream. Returns None if the
+    client closed the connection between two requests.
+    """
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as err:
+        if not err.partial:
+            return None
+        raise BadRequest("Incomplete request head")
+    except asyncio.LimitOverrunError:
+        raise BadRequest("Request head too large")
+
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise BadRequest("Malformed request line: %r" % lines[0])
+
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise BadRequest("Invalid content length")
+    if length < 0 or length > MAX_BODY_BYTES:
+        raise BadRequest("Invalid content length %s" % length)
+
+    body = await reader.readexactly(length) if length else b''
+    return Request(method, target, headers, body, version)
+
+
+class HTTPServer(object):
+    """
+    Serves an application, i.e. any object with a dispatch(request)
+    method returning a Response (or an awaitable yielding one).
+    """
+
+    def __init__(self, application, host='0.0.0.0', port=8090, reuse_port=False):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.server = None
+        self.tasks = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection,
+                                                 self.host, self.port,
+                                                 limit=MAX_HEADER_BYTES,
+                                                 backlog=4096,
+                                                 reuse_port=self.reuse_port or None)
+        # Port 0 means 'pick any free port', so look up what we got
+        self.port = self.server.sockets[0].getsockname()[1]
+
+        for task in getattr(self.application, 'background_tasks', ()):
+            self.tasks.append(asyncio.ensure_future(task()))
+        logger.info("Serving on %s:%s", self.host, self.port)
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await asyncio.wait_for(read_request(reader),
+                                                 KEEP_ALIVE_TIMEOUT)
+                if request is None:
+                    break
+
+                keep_alive = request.keep_alive
+                response = self.application.dispatch(request)
+                if inspect.isawaitable(response):
+                    response = await response
+                writer.write(response.encode(keep_alive))
+                await writer.drain()
+
+                if response.upgrade is not None:
+                    await response.upgrade(reader, writer)
+                    break
+
+                if not keep_alive:
+                    break
+        except BadRequest as err:
+            logger.info("Bad request: %s", err)
+            response = Response()
+            response.set_status(400)
+            writer.write(response.encode(keep_alive=False))
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class BackgroundServer(threading.Thread):
+    """
+    Runs an HTTPServer with its own event loop in a daemon thread.
+    Handy for tests and benchmarks that need a local server.
+    """
+
+    def __init__(self, application, host='127.0.0.1', port=0):
+        threading.Thread.__init__(self, daemon=True)
+        self.http_server = HTTPServer(application, host, port)
+        self.loop = None
+        self.ready = threading.Event()
+
+    @property
+    def address(self):
+        return '%s:%s' % (self.http_server.host, self.http_server.port)
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.http_server.start())
+        self.ready.set()
+        self.loop.run_forever()
+
+        for task in self.http_server.tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*self.http_server.tasks,
+                                                    return_exceptions=True))
+        self.http_server.server.close()
+        self.loop.run_until_complete(self.http_server.server.wait_closed())
+        self.loop.close()
+
+    def start(self):
+        threading.Thread.start(self)
+        self.ready.wait()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.join()
+
+    def call(self, func, *args):
+        """
+        Calls func(*args) in the server's thread and returns its result
+        """
+        future = asyncio.run_coroutine_threadsafe(self._call(func, *args), self.loop)
+        return future.result()
+
+    @staticmethod
+    async def _call(func, *args):
+        return func(*args)
+
+
+def run(application, host, port, reuse_port=False):
+    asyncio.run(HTTPServer(application, host, port, reuse_port).serve_forever())
@@ -0,0 +1,138 @@
+"""
+Append-only journal of the game registry, so a restarted server
+continues the running games.
+
+Every change of the registry that must survive a restart (games
+created and removed, players joining, leaving and timing out,
+penalties sent and taken, line clear numbers and part offsets) is
+appended as a compact JSON array, one per line. Now and then the
+whole registry is written to a checkpoint, and the journal starts
+over. On startup, the checkpoint is loaded and the journal written
+after it replayed.
+
+Journals and checkpoints carry a generation number:
+
+    <path>.checkpoint   {"generation": n, "games": [...]}
+    <path>.<n>          the records written after that checkpoint
+
+A new checkpoint is written to a temporary file and renamed, before
+journal n + 1 is started and journal n is deleted, so a crash at any
+point leaves a checkpoint and the one journal belonging to it.
+
+Records are buffered and written by flush(), which the server calls
+periodically, so a crash loses at most the last fraction of a second.
+"""
+
+import json
+import logging
+import os
+
+logger = logging.getLogger('Server')
+
+
+class Journal(object):
+    def __init__(self, path=None):
+        """
+        Without a path, records are dropped.
+        """
+        self.path = path
+        self.generation = 0
+        self.file = None
+        self.pending = []
+        # Length of the journal up to the last complete record
+        self.valid_length = 0
+        # Records written since the last checkpoint
+        self.records = 0
+
+    @property
+    def enabled(self):
+        return self.file is not None
+
+    def journal_path(self, generation):
+        return '%s.%d' % (self.path, generation)
+
+    @property
+    def checkpoint_path(self):
+        return self.path + '.checkpoint'
+
+    def load(self):
+        """
+        Returns the games of the last checkpoint and the records
+        journaled after it. Call open() after applying them.
+        """
+        games = []
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+            self.generation = checkpoint['generation']
+            games = checkpoint['games']
+        except FileNotFoundError:
+            pass
+
+        records = []
+        self.valid_length = 0
+        try:
+            with open(self.journal_path(self.generation), 'rb') as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError("Incomplete record")
+                        records.append(json.loads(line.decode()))
+                    except ValueError:
+                        # Torn write at the end of the journal
+                        logger.warning("Ignoring broken journal record %r", line)
+                        break
+                    self.valid_length += len(line)
+        except FileNotFoundError:
+            pass
+
+        self.records = len(records)
+        return games, records
+
+    def open(self):
+        self.file = open(self.journal_path(self.generation), 'a')
+        # Drop what remains of a torn write
+        self.file.truncate(self.valid_length)
+
+    def append(self, record):
+        if self.file is not None:
+            self.pending.append(record)
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.file.write(''.join(json.dumps(record, separators=(',', ':')) + '\n'
+                                for record in self.pending))
+        self.file.flush()
+        self.records += len(self.pending)
+        del self.pending[:]
+
+    def checkpoint(self, games):
+        """
+        Writes the given list of game states as the new checkpoint
+        and starts an empty journal.
+        """
+        self.flush()
+        generation = self.generation + 1
+
+        temporary = self.checkpoint_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'generation': generation, 'games': games}, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.checkpoint_path)
+
+        self.file.close()
+        self.file = open(self.journal_path(generation), 'a')
+        try:
+            os.remove(self.journal_path(self.generation))
+        except FileNotFoundError:
+            pass
+        self.generation = generation
+        self.records = 0
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
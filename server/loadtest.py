@@ -0,0 +1,267 @@
+"""
+Load test simulating many concurrent players against a local server.
+
+Every synthetic player follows the request pattern of the polling
+client: the first player of a game creates it, then all players
+register, poll /status until the game has started and then, once per
+interval, send their snapshot with /receive, poll /status, send line
+clears with /sendlines now and then and fetch /getparts whenever their
+parts run low. Each player uses its own keep-alive connection.
+
+Prints a JSON report with throughput, error rates and p50/p95/p99
+latencies per route:
+
+    python loadtest.py --players 300 --seconds 30 --output result.json
+
+Given the report of an earlier run as --baseline, the run fails with
+exit status 1 if throughput dropped or a p95 latency rose by more than
+--tolerance, so it can be used as a regression benchmark. Use --server
+to load an already running server instead of starting one.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+import urllib.parse
+
+from httpserver import Request
+from serverprocess import free_port, start_server
+from sharding import encode_request, read_response
+
+# Parts a client takes from its buffer per second, and the number
+# of parts left at which it asks for more
+PARTS_PER_SECOND = 0.5
+PARTS_LOW_WATER = 3
+
+FORM_HEADERS = {'Host': 'loadtest', 'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an ascending list of values
+    """
+    if not sorted_values:
+        return None
+    rank = min(max(int(math.ceil(fraction * len(sorted_values))), 1), len(sorted_values))
+    return sorted_values[rank - 1]
+
+
+class Stats(object):
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, route, seconds, ok):
+        self.latencies.setdefault(route, []).append(seconds)
+        if not ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self, seconds):
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            errors = self.errors.get(route, 0)
+            routes[route] = {'requests': len(latencies),
+                             'errors': errors,
+                             'error_rate': round(errors / float(len(latencies)), 4),
+                             'requests_per_second': round(len(latencies) / seconds, 1),
+                             'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+                             'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+                             'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+                             'max_ms': round(latencies[-1] * 1000, 2)}
+
+        requests = sum(route['requests'] for route in routes.values())
+        errors = sum(route['errors'] for route in routes.values())
+        return {'requests': requests,
+                'errors': errors,
+                'error_rate': round(errors / float(requests), 4) if requests else 0,
+                'requests_per_second': round(requests / seconds, 1),
+                'routes': routes}
+
+
+class Player(object):
+    def __init__(self, host, port, stats, rng):
+        self.host = host
+        self.port = port
+        self.stats = stats
+        self.rng = rng
+        self.reader = self.writer = None
+        self.game_id = self.player_id = None
+
+    async def request(self, method, route, params):
+        """
+        Returns the decoded JSON reply, or None on errors
+        """
+        query = urllib.parse.urlencode(params)
+        if method == 'GET':
+            request = Request('GET', '%s?%s' % (route, query), {'Host': 'loadtest'})
+        else:
+            request = Request('POST', route, FORM_HEADERS, query.encode())
+
+        start = time.perf_counter()
+        reply = None
+        try:
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            self.writer.write(encode_request(request))
+            response = await read_response(self.reader)
+            if response.status == 200:
+                reply = json.loads(response.body.decode())
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            self.close()
+
+        ok = reply is not None and not (isinstance(reply, dict) and 'error' in reply)
+        self.stats.record(route, time.perf_counter() - start, ok)
+        return reply if ok else None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def create_game(self, size):
+        reply = await self.request('POST', '/new', {'size': size})
+        return reply and reply['game_id']
+
+    async def play(self, game_id, seconds, interval, cols, rows):
+        self.game_id = game_id
+        # Don't let all players poll in lockstep
+        await asyncio.sleep(self.rng.uniform(0, interval))
+
+        reply = await self.request('GET', '/register', {'game_id': game_id})
+        if reply is None:
+            return
+        self.player_id = reply['player_id']
+        ids = {'game_id': game_id, 'player_id': self.player_id}
+
+        deadline = time.time() + seconds
+        started = False
+        while not started and time.time() < deadline:
+            status = await self.request('GET', '/status', {'game_id': game_id})
+            started = bool(status and status['started'])
+            await asyncio.sleep(interval)
+
+        parts = 0
+        board = ['0' * cols] * rows
+        while time.time() < deadline:
+            board[self.rng.randrange(rows)] = "".join(self.rng.choice('01') for _ in range(cols))
+            await self.request('GET', '/receive',
+                               dict(ids, game_snapshot="%d,%s" % (cols, "".join(board))))
+            await self.request('GET', '/status', {'game_id': game_id})
+
+            if self.rng.random() < 0.1:
+                await self.request('POST', '/sendlines',
+                                   dict(ids, num_lines=self.rng.randint(1, 4)))
+
+            parts -= PARTS_PER_SECOND * interval
+            if parts < PARTS_LOW_WATER:
+                reply = await self.request('GET', '/getparts', ids)
+                parts += len(reply or [])
+
+            await asyncio.sleep(interval)
+
+        await self.request('POST', '/unregister', ids)
+        self.close()
+
+
+async def run_load(host, port, players, game_size, seconds, interval,
+                   cols=20, rows=25, seed=1):
+    """
+    Plays games of game_size with the given number of players for
+    the given number of seconds and returns the report.
+    """
+    rng = random.Random(seed)
+    stats = Stats()
+    tasks = []
+    start = time.perf_counter()
+
+    for first in range(0, players, game_size):
+        members = [Player(host, port, stats, random.Random(rng.random()))
+                   for _ in range(min(game_size, players - first))]
+        game_id = await members[0].create_game(len(members))
+        if game_id is None:
+            continue
+        tasks.extend(asyncio.ensure_future(player.play(game_id, seconds, interval, cols, rows))
+                     for player in members)
+
+    await asyncio.gather(*tasks)
+    report = stats.report(time.perf_counter() - start)
+    report.update({'players': players, 'game_size': game_size,
+                   'seconds': seconds, 'interval': interval})
+    return report
+
+
+def regressions(report, baseline, tolerance):
+    """
+    Returns descriptions of everything that got worse than
+    the baseline by more than the tolerated fraction.
+    """
+    found = []
+    if report['requests_per_second'] < baseline['requests_per_second'] * (1 - tolerance):
+        found.append("throughput %s req/s, baseline %s"
+                     % (report['requests_per_second'], baseline['requests_per_second']))
+    if report['error_rate'] > baseline['error_rate'] + tolerance / 100.0:
+        found.append("error rate %s, baseline %s" % (report['error_rate'], baseline['error_rate']))
+
+    for route, stats in sorted(report['routes'].items()):
+        before = baseline['routes'].get(route)
+        if before and stats['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            found.append("%s p95 %s ms, baseline %s ms" % (route, stats['p95_ms'], before['p95_ms']))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--players', type=int, default=200)
+    parser.add_argument('--game-size', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between the polls of a player')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--server', help='host:port of a running server')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes of the server started')
+    parser.add_argument('--output', help='file to write the report to')
+    parser.add_argument('--baseline', help='report of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction by which results may be worse than the baseline')
+    args = parser.parse_args()
+
+    process = None
+    if args.server:
+        host, _, port = args.server.partition(':')
+        port = int(port or 8090)
+    else:
+        host, port = '127.0.0.1', free_port(args.workers + 1)
+        process = start_server(port, args.workers)
+
+    try:
+        report = asyncio.run(run_load(host, port, args.players, args.game_size,
+                                      args.seconds, args.interval, seed=args.seed))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report['workers'] = None if args.server else args.workers
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for regression in found:
+            print("Regression: %s" % regression, file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
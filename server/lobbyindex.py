@@ -0,0 +1,214 @@
+"""
+Indexes over the games open for joining, answering filtered, sorted
+and paged /list requests without looking at every game.
+
+For each field in FIELDS, the index maps the field's values to the
+sorted ids of the open games having that value. A query walks the
+games with the most selective of its filter values (or all open
+games) in the order of the sort field, starting after the cursor,
+until a page is full.
+
+Games are ordered by (value of the sort field, numeric game id), where
+the value for 'created' is the creation timestamp. A worker hands out
+game ids in increasing order, so its games are in creation order when
+ordered by id; the ids of different workers are not (see
+server.IdAllocator). A cursor is the ordering key of the last game on
+a page, so pages stay consistent while games come and go, and pages
+of several shards can be merged (see merge_pages).
+"""
+
+import base64
+import json
+from bisect import bisect_right, insort
+
+# Functions returning the indexed values from a game's /list entry
+FIELDS = {'free_slots': lambda game: game['free_slots'],
+          'players': lambda game: len(game['screen_names']),
+          'size': lambda game: game['size'],
+          'dimensions': lambda game: '%dx%d' % tuple(game['dimensions']),
+          'duck_prob': lambda game: game['duck_prob']}
+
+# Parsers of filter values given as query parameters
+FILTER_TYPES = {'free_slots': int,
+                'players': int,
+                'size': int,
+                'dimensions': str,
+                'duck_prob': float}
+
+SORTS = ('created',) + tuple(sorted(FIELDS))
+
+MAX_PAGE_SIZE = 100
+
+
+def sort_key(game, sort):
+    value = game['timestamp'] if sort == 'created' else FIELDS[sort](game)
+    return value, int(game['game_id'])
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Raises ValueError for invalid cursors
+    """
+    try:
+        value, game_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return value, int(game_id)
+    except (TypeError, UnicodeDecodeError, base64.binascii.Error) as err:
+        raise ValueError("Invalid cursor: %s" % err)
+
+
+def parse_query(request):
+    """
+    Returns filters, sort, cursor key and page size (None for no
+    limit) from the query parameters of a request. Raises ValueError
+    for invalid values.
+    """
+    filters = dict((name, FILTER_TYPES[name](request.get(name)))
+                   for name in FILTER_TYPES if request.get(name))
+
+    sort = request.get('sort') or 'created'
+    if sort not in SORTS:
+        raise ValueError("Unknown sort order %s" % sort)
+
+    cursor = request.get('cursor')
+    if cursor:
+        value, game_id = decode_cursor(cursor)
+        try:
+            cursor = (float(value) if sort == 'created' else FILTER_TYPES[sort](value)), game_id
+        except TypeError:
+            raise ValueError("Cursor doesn't match sort order %s" % sort)
+    else:
+        cursor = None
+
+    limit = request.get('limit')
+    limit = min(max(int(limit), 1), MAX_PAGE_SIZE) if limit else None
+    return filters, sort, cursor, limit
+
+
+def merge_pages(pages, sort, limit):
+    """
+    Merges pages of games ordered by sort, each holding up to limit
+    games, to the first limit games of all. Returns the games and
+    the cursor of the page following them, if any.
+    """
+    games = sorted((game for page in pages for game in page['games']),
+                   key=lambda game: sort_key(game, sort))
+    more = len(games) > limit or any(page['next_cursor'] for page in pages)
+    games = games[:limit]
+    next_cursor = encode_cursor(sort_key(games[-1], sort)) if more and games else None
+    return games, next_cursor
+
+
+class LobbyIndex(object):
+    def __init__(self):
+        # /list entries of the open games by numeric id
+        self.entries = {}
+        self.ids = []
+        # Mapping from field names to mappings from values to ids
+        self.index = dict((field, {}) for field in FIELDS)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, game_id, entry):
+        """
+        Sets the /list entry of an open game, or removes
+        the game from the index if entry is None
+        """
+        game_id = int(game_id)
+        self.remove(game_id)
+        if entry is None:
+            return
+
+        self.entries[game_id] = entry
+        insort(self.ids, game_id)
+        for field, value_of in FIELDS.items():
+            insort(self.index[field].setdefault(value_of(entry), []), game_id)
+
+    def remove(self, game_id):
+        try:
+            game_id = int(game_id)
+        except ValueError:
+            return
+        entry = self.entries.pop(game_id, None)
+        if entry is None:
+            return
+
+        self.ids.pop(bisect_right(self.ids, game_id) - 1)
+        for field, value_of in FIELDS.items():
+            by_value = self.index[field]
+            value = value_of(entry)
+            ids = by_value[value]
+            ids.pop(bisect_right(ids, game_id) - 1)
+            if not ids:
+                del by_value[value]
+
+    def clear(self):
+        self.__init__()
+
+    def bisect_created(self, ids, cursor):
+        """
+        Returns the position of the first of ids created after the
+        cursor key, which may come from a game of another worker
+        """
+        low, high = 0, len(ids)
+        while low < high:
+            middle = (low + high) // 2
+            if sort_key(self.entries[ids[middle]], 'created') <= cursor:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, filters=None, sort='created', cursor=None, limit=None):
+        """
+        Returns the /list entries of the open games matching all
+        filters (a mapping from field names to values), ordered by
+        sort and following the cursor key, up to limit games. Also
+        returns the cursor of the next page, or None if this is the
+        last one.
+        """
+        filters = filters or {}
+        candidates = self.ids
+        for field, value in filters.items():
+            ids = self.index[field].get(value, [])
+            if len(ids) < len(candidates):
+                candidates = ids
+        if not candidates:
+            return [], None
+
+        if sort == 'created':
+            # In id order, which is creation order within this worker
+            groups = [(None, candidates)]
+        else:
+            # The ids of the candidates grouped by the sort field's value
+            groups = self.index[sort]
+            if candidates is not self.ids:
+                value_of = FIELDS[sort]
+                groups = {}
+                for game_id in candidates:
+                    groups.setdefault(value_of(self.entries[game_id]), []).append(game_id)
+            groups = sorted(groups.items())
+
+        games = []
+        for value, ids in groups:
+            start = 0
+            if cursor is not None and sort == 'created':
+                start = self.bisect_created(ids, cursor)
+            elif cursor is not None:
+                if value < cursor[0]:
+                    continue
+                if value == cursor[0]:
+                    start = bisect_right(ids, cursor[1])
+
+            for position in range(start, len(ids)):
+                entry = self.entries[ids[position]]
+                if all(FIELDS[field](entry) == wanted for field, wanted in filters.items()):
+                    if limit is not None and len(games) == limit:
+                        return games, encode_cursor(sort_key(games[-1], sort))
+                    games.append(entry)
+
+        return games, None
@@ -0,0 +1,127 @@
+"""
+Matchmaking queue, placing players in games without them picking
+one from /list.
+
+A player asks for a game of some size, dimensions and duck probability
+and gets a ticket. All tickets are matched in batches every
+MATCH_INTERVAL seconds: per wanted game configuration, the waiting
+players first fill the open games of that configuration, fullest
+first so they start soonest, and then get new games of their own.
+If too few players wait for a new game, one is created anyway once
+the first of them has waited MAX_WAIT seconds; the others join it
+from the queue or the lobby later.
+
+The player is registered with the game when matched and learns its
+game and player id by polling the ticket. Tickets not polled for
+TICKET_TIMEOUT seconds are dropped.
+"""
+
+import itertools
+from collections import OrderedDict
+
+# Seconds between matching rounds
+MATCH_INTERVAL = 0.5
+
+# Seconds a player waits for enough others before getting
+# a game that isn't full yet
+MAX_WAIT = 10
+
+TICKET_TIMEOUT = 30
+
+# Upper bounds of the buckets of the time-to-match histogram
+WAIT_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60)
+
+
+class Ticket(object):
+    __slots__ = ('key', 'screen_name', 'enqueued', 'last_seen', 'game_id', 'player_id')
+
+    def __init__(self, key, screen_name, now):
+        # The wanted (size, dimensions, duck_prob)
+        self.key = key
+        self.screen_name = screen_name
+        self.enqueued = now
+        self.last_seen = now
+        # Set once matched
+        self.game_id = None
+        self.player_id = None
+
+    def as_dict(self):
+        if self.game_id is None:
+            return {'status': 'waiting'}
+        return {'status': 'matched', 'game_id': self.game_id, 'player_id': self.player_id}
+
+
+class MatchQueue(object):
+    def __init__(self, shard=0, shards=1):
+        # Ticket ids are unique across the workers' queues
+        self.ticket_ids = ('%d' % (n * shards + shard) for n in itertools.count(1))
+        self.tickets = {}
+        # Mapping from game configurations to waiting tickets, oldest first
+        self.waiting = {}
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.waiting.values())
+
+    def enqueue(self, key, screen_name, now):
+        ticket_id = next(self.ticket_ids)
+        ticket = self.tickets[ticket_id] = Ticket(key, screen_name, now)
+        self.waiting.setdefault(key, OrderedDict())[ticket_id] = ticket
+        return ticket_id
+
+    def poll(self, ticket_id, now):
+        """
+        Returns the ticket, or None if it's unknown
+        """
+        ticket = self.tickets.get(ticket_id)
+        if ticket is not None:
+            ticket.last_seen = now
+        return ticket
+
+    def cancel(self, ticket_id):
+        ticket = self.tickets.pop(ticket_id, None)
+        if ticket is not None and ticket.game_id is None:
+            queue = self.waiting[ticket.key]
+            del queue[ticket_id]
+            if not queue:
+                del self.waiting[ticket.key]
+
+    def depth(self, key):
+        return len(self.waiting.get(key, ()))
+
+    def match(self, now, open_games, create_game):
+        """
+        Places the waiting players in games. open_games(key) returns
+        the open games of a configuration, fullest first, and
+        create_game(key) a new one (or None if no games can be
+        created). Returns the seconds the matched players waited.
+        """
+        for ticket_id, ticket in list(self.tickets.items()):
+            if now - ticket.last_seen > TICKET_TIMEOUT:
+                self.cancel(ticket_id)
+
+        waited = []
+        for key, queue in list(self.waiting.items()):
+            size = key[0]
+            for game in open_games(key):
+                self.fill(game, queue, now, waited)
+                if not queue:
+                    break
+
+            while len(queue) >= size or \
+                    (queue and now - next(iter(queue.values())).enqueued >= MAX_WAIT):
+                game = create_game(key)
+                if game is None:
+                    break
+                self.fill(game, queue, now, waited)
+
+            if not queue:
+                del self.waiting[key]
+        return waited
+
+    @staticmethod
+    def fill(game, queue, now, waited):
+        while queue and game.free_slots > 0 and not game.started:
+            ticket_id, ticket = queue.popitem(last=False)
+            ticket.player_id = game.add_player(ticket.screen_name)
+            ticket.game_id = game.game_id
+            waited.append(now - ticket.enqueued)
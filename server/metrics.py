@@ -0,0 +1,165 @@
+"""
+Counters, gauges and latency histograms, exported in the Prometheus
+text format.
+
+Each worker process records into its own Metrics instance. Since a
+worker handles all requests on one thread, recording is nothing but
+an increment of plain Python numbers, without any locking. Gauges are
+functions only evaluated on scrape. When sharded, the acceptor asks
+every worker for a snapshot() and merges them before rendering.
+"""
+
+from bisect import bisect_left
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+PREFIX = 'entris_'
+
+TEXT_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HELP = {'request_duration_seconds': 'Time spent handling requests, by route',
+        'penalties_total': 'Penalties queued for the opponents of a player',
+        'penalty_lines_total': 'Lines sent to opponents by clearing them',
+        'player_timeouts_total': 'Players kicked for not polling in time',
+        'games_expired_total': 'Games removed before enough players joined',
+        'spectator_frames_total': 'Game frames sent to spectators',
+        'spectator_frames_dropped_total': 'Game frames skipped for slow spectators',
+        'games': 'Games currently held by the server',
+        'players': 'Players currently in a game',
+        'spectators': 'Open spectator channels',
+        'free_slots': 'Free slots in games waiting for players',
+        'matchmaking_wait_seconds': 'Time players waited in the matchmaking queue',
+        'matchmaking_queue': 'Players waiting in the matchmaking queue',
+        'matchmaking_games_total': 'Games created for matched players'}
+
+
+class Histogram(object):
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket plus the +Inf bucket, not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metrics(object):
+    def __init__(self, counters=()):
+        # Counters named here are exported even before being incremented
+        self.counters = dict.fromkeys(counters, 0)
+        self.gauges = {}
+        self.latencies = {}
+        self.histograms = {}
+
+    def inc(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, route, seconds):
+        """
+        Records the time it took to handle a request to route
+        """
+        histogram = self.latencies.get(route)
+        if histogram is None:
+            histogram = self.latencies[route] = Histogram()
+        histogram.observe(seconds)
+
+    def histogram(self, name, buckets):
+        """
+        Registers a histogram of values other than request latencies,
+        with the given bucket upper bounds
+        """
+        self.histograms[name] = Histogram(buckets)
+
+    def record(self, name, value):
+        self.histograms[name].observe(value)
+
+    def gauge(self, name, func):
+        """
+        Registers func to be called for the value of a gauge on scrape
+        """
+        self.gauges[name] = func
+
+    def snapshot(self):
+        """
+        Returns the current values as a JSON serializable dictionary
+        """
+        return {'counters': dict(self.counters),
+                'gauges': dict((name, func()) for name, func in self.gauges.items()),
+                'latencies': dict((route, {'counts': list(histogram.counts),
+                                           'sum': histogram.sum})
+                                  for route, histogram in self.latencies.items()),
+                'histograms': dict((name, {'buckets': list(histogram.buckets),
+                                           'counts': list(histogram.counts),
+                                           'sum': histogram.sum})
+                                   for name, histogram in self.histograms.items())}
+
+
+def merge(snapshots):
+    """
+    Adds up the snapshots of several workers
+    """
+    merged = {'counters': {}, 'gauges': {}, 'latencies': {}, 'histograms': {}}
+    for snapshot in snapshots:
+        for kind in ('counters', 'gauges'):
+            for name, value in snapshot[kind].items():
+                merged[kind][name] = merged[kind].get(name, 0) + value
+        for route, histogram in snapshot['latencies'].items():
+            total = merged['latencies'].setdefault(
+                route, {'counts': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0})
+            total['counts'] = [a + b for a, b in zip(total['counts'], histogram['counts'])]
+            total['sum'] += histogram['sum']
+        for name, histogram in snapshot['histograms'].items():
+            total = merged['histograms'].setdefault(
+                name, {'buckets': histogram['buckets'],
+                       'counts': [0] * len(histogram['counts']), 'sum': 0.0})
+            total['counts'] = [a + b for a, b in zip(total['counts'], histogram['counts'])]
+            total['sum'] += histogram['sum']
+    return merged
+
+
+def render(snapshot):
+    """
+    Formats a snapshot in the Prometheus text exposition format
+    """
+    lines = []
+
+    def header(name, metric_type):
+        if name in HELP:
+            lines.append('# HELP %s%s %s' % (PREFIX, name, HELP[name]))
+        lines.append('# TYPE %s%s %s' % (PREFIX, name, metric_type))
+
+    name = 'request_duration_seconds'
+    if snapshot['latencies']:
+        header(name, 'histogram')
+    for route, histogram in sorted(snapshot['latencies'].items()):
+        cumulative = 0
+        bounds = ['%g' % bound for bound in LATENCY_BUCKETS] + ['+Inf']
+        for bound, count in zip(bounds, histogram['counts']):
+            cumulative += count
+            lines.append('%s%s_bucket{route="%s",le="%s"} %d'
+                         % (PREFIX, name, route, bound, cumulative))
+        lines.append('%s%s_sum{route="%s"} %r' % (PREFIX, name, route, histogram['sum']))
+        lines.append('%s%s_count{route="%s"} %d' % (PREFIX, name, route, cumulative))
+
+    for name, histogram in sorted(snapshot['histograms'].items()):
+        header(name, 'histogram')
+        cumulative = 0
+        bounds = ['%g' % bound for bound in histogram['buckets']] + ['+Inf']
+        for bound, count in zip(bounds, histogram['counts']):
+            cumulative += count
+            lines.append('%s%s_bucket{le="%s"} %d' % (PREFIX, name, bound, cumulative))
+        lines.append('%s%s_sum %r' % (PREFIX, name, histogram['sum']))
+        lines.append('%s%s_count %d' % (PREFIX, name, cumulative))
+
+    for kind, metric_type in (('counters', 'counter'), ('gauges', 'gauge')):
+        for name, value in sorted(snapshot[kind].items()):
+            header(name, metric_type)
+            lines.append('%s%s %s' % (PREFIX, name, value))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,142 @@
+"""
+Push channel for penalties and opponent snapshots.
+
+A client upgrades a 'GET /push?game_id=<id>&player_id=<id>' request
+carrying the header 'Upgrade: entris-push'. Afterwards both sides
+exchange JSON frames, one per line.
+
+Client to server:
+    {"type": "lines", "num_lines": <n>}          lines cleared by the player
+    {"type": "snapshot", "snapshot": "<board>"}  the player's board, doubles as heartbeat;
+                                                 without "snapshot" if unchanged
+
+Server to client:
+    {"type": "status", "started": <bool>, "size": <n>,
+     "players": [{"player_id": .., "screen_name": .., "alive": <bool>}, ...]}
+    {"type": "snapshot", "player_id": <id>, "snapshot": "<board>"}
+    {"type": "penalty", "penalty": <n>}
+
+Penalties and snapshots are pushed as soon as they reach the game,
+instead of waiting for the next poll of the player. In large games,
+only the snapshots of the opponents given by Game.shown_opponents
+are pushed.
+"""
+
+import asyncio
+import json
+import logging
+
+from events import PenaltyEvent, SnapshotEvent, PlayersChangedEvent
+
+logger = logging.getLogger('Server')
+
+PUSH_PROTOCOL = 'entris-push'
+
+# Clients send a snapshot every second, so a silent
+# channel for this long is considered dead.
+IDLE_TIMEOUT = 30
+
+# A client not reading its frames is disconnected once this
+# many bytes are waiting to be sent to it.
+MAX_PENDING_BYTES = 256 * 1024
+
+
+class PushSession(object):
+    """
+    One player's push channel. Registered as an observer of
+    the game for the lifetime of the connection.
+    """
+
+    def __init__(self, game, player_id):
+        self.game = game
+        self.player_id = player_id
+        self.writer = None
+        # Opponents whose snapshots are pushed, None for all
+        self.shown = None
+        self.update_shown()
+
+    async def run(self, reader, writer):
+        self.writer = writer
+        self.game.add_observer(self)
+        try:
+            self.send_status()
+            for pid, snapshot in self.game.game_snapshot.items():
+                if pid != self.player_id and snapshot and \
+                        (self.shown is None or pid in self.shown):
+                    self.send_snapshot(pid, snapshot)
+            self.send_penalties()
+
+            while True:
+                line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                if not line:
+                    break
+                self.handle_frame(json.loads(line.decode()))
+        except (ValueError, KeyError, TypeError) as err:
+            logger.info("Closing push channel of %s: %s", self.player_id, err)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self.game.remove_observer(self)
+
+    def handle_frame(self, frame):
+        kind = frame['type']
+        if kind == 'lines':
+            self.game.add_penalty(self.player_id, int(frame['num_lines']))
+        elif kind == 'snapshot':
+            if 'snapshot' in frame:
+                self.game.store_snapshot(self.player_id, frame['snapshot'])
+        else:
+            logger.info("Unknown frame type %s from %s", kind, self.player_id)
+
+        # Any frame is a sign of life, just like polling for penalties
+        self.game.get_penalties(self.player_id)
+        self.send_penalties()
+
+    def notify(self, event):
+        if isinstance(event, PenaltyEvent):
+            if event.sender_id != self.player_id:
+                self.send_penalties()
+        elif isinstance(event, SnapshotEvent):
+            if event.player_id != self.player_id and \
+                    (self.shown is None or event.player_id in self.shown):
+                self.send_snapshot(event.player_id, event.snapshot)
+        elif isinstance(event, PlayersChangedEvent):
+            self.update_shown()
+            self.send_status()
+
+    def update_shown(self):
+        shown = self.game.shown_opponents(self.player_id)
+        self.shown = None if shown is None else set(shown)
+
+    def send_status(self):
+        players = [{'player_id': pid,
+                    'screen_name': player.screen_name,
+                    'alive': player.alive}
+                   for pid, player in self.game.players.items()]
+        self.send({'type': 'status',
+                   'started': self.game.started,
+                   'size': self.game.size,
+                   'players': players})
+
+    def send_snapshot(self, player_id, snapshot):
+        self.send({'type': 'snapshot',
+                   'player_id': player_id,
+                   'snapshot': snapshot})
+
+    def send_penalties(self):
+        if self.writer.is_closing():
+            return
+        for penalty in self.game.take_penalties(self.player_id):
+            self.send({'type': 'penalty', 'penalty': penalty})
+
+    def send(self, frame):
+        if self.writer.is_closing():
+            return
+
+        if self.writer.transport.get_write_buffer_size() > MAX_PENDING_BYTES:
+            logger.info("Push channel of %s is not reading, disconnecting", self.player_id)
+            self.writer.close()
+            return
+
+        data = json.dumps(frame, separators=(',', ':')) + '\n'
+        self.writer.write(data.encode())
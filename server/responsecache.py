@@ -0,0 +1,53 @@
+"""
+Cache of encoded response bodies, invalidated by version numbers.
+
+Every cached object (a game, the game list) carries a version that
+is incremented on each change. As long as the version hasn't changed,
+identical polls are answered with the bytes encoded for the first one.
+"""
+
+# Variants (e.g. different 'since' parameters) kept per key and
+# version, unless the caller expects more
+MAX_VARIANTS = 16
+
+
+class ResponseCache(object):
+    def __init__(self):
+        # Mapping from keys to (version, {variant: body})
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, build, variant=None, max_variants=MAX_VARIANTS):
+        """
+        Returns the cached body for key, version and variant. On a
+        miss, the body is built by calling build(), which must return
+        the bytes to be served. Once there are max_variants bodies
+        for a version, they are all dropped.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != version:
+            entry = self.entries[key] = (version, {})
+
+        bodies = entry[1]
+        body = bodies.get(variant)
+        if body is not None:
+            self.hits += 1
+            return body
+
+        self.misses += 1
+        if len(bodies) >= max_variants:
+            bodies.clear()
+        body = bodies[variant] = build()
+        return body
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries)}
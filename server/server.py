@@ -1,54 +1,248 @@
+import argparse
+import asyncio
+import functools
 import time
-from collections import deque
 import random
+import struct
 import logging
-import itertools
+import json
+
+import httpserver
+from httpserver import RequestHandler
+from events import PenaltyEvent, SnapshotEvent, PlayersChangedEvent
+from pushchannel import PushSession, PUSH_PROTOCOL
+import spectators as spectator_channels
+from spectators import SpectatorHub, WATCH_PROTOCOL
+import sharding
+import wire
+import snapshotcodec
+from timerwheel import TimerWheel
+from responsecache import ResponseCache, MAX_VARIANTS
+from metrics import Metrics, render, TEXT_CONTENT_TYPE
+from admission import LoadMonitor, default_max_memory, DEFAULT_MAX_CPU
+from journal import Journal
+import matchmaking
+from matchmaking import MatchQueue
+import lobbyindex
+from lobbyindex import LobbyIndex
+
+
+class GameRegistry(dict):
+    """
+    Dictionary mapping game ids to games, carrying a version that
+    changes whenever the game list as served by /list changes, and
+    the lobby index of the games open for joining.
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        self.version = 0
+        self.lobby = LobbyIndex()
+
+    def touch(self, game=None):
+        """
+        Call with the game whose listed state changed
+        """
+        self.version += 1
+        if game is not None and dict.get(self, game.game_id) is game:
+            self.lobby.update(game.game_id, game.as_short_dict() if game.joinable else None)
+
+    def __setitem__(self, game_id, game):
+        # Indexed before being stored, so that a game failing
+        # to be listed doesn't break the list of all games
+        self.lobby.update(game_id, game.as_short_dict() if game.joinable else None)
+        dict.__setitem__(self, game_id, game)
+        self.version += 1
+
+    def __delitem__(self, game_id):
+        dict.__delitem__(self, game_id)
+        self.lobby.remove(game_id)
+        self.touch()
 
-try:
-    import json
-except ImportError:
-    import simplejson as json
+    def pop(self, game_id, *default):
+        self.touch()
+        self.lobby.remove(game_id)
+        return dict.pop(self, game_id, *default)
+
+    def clear(self):
+        dict.clear(self)
+        self.lobby.clear()
+        self.touch()
 
-from google.appengine.ext import webapp
-from google.appengine.ext.webapp.util import run_wsgi_app
 
 ######################################################
 # Global dictionary mapping game_ids to Game instances
-games = {}
+games = GameRegistry()
+
+# Encoded /list and /status responses, see Game.version
+response_cache = ResponseCache()
+
+# Read-only channels of clients watching games
+spectators = SpectatorHub()
+
+# Scheduler shared by all games, expiring idle players
+# and games that never got started.
+timers = TimerWheel()
+
+# Served by /metrics, gauges are registered below the Game class
+metrics = Metrics(counters=('penalties_total', 'penalty_lines_total',
+                            'player_timeouts_total', 'games_expired_total',
+                            'spectator_frames_total', 'spectator_frames_dropped_total',
+                            'matchmaking_games_total'))
+
+# Registry changes to be replayed after a restart, see restore()
+journal = Journal()
+
+# Seconds between writes to the journal, and the number of records
+# after which the journal is compacted into a checkpoint
+JOURNAL_FLUSH_INTERVAL = 0.5
+CHECKPOINT_RECORDS = 100000
+
+# Time given to the players of restored games to show up again
+RESTART_GRACE_SECONDS = 30
+
+# Measured memory and CPU usage, deciding whether new games are admitted
+load = LoadMonitor(default_max_memory())
+
+# Seconds between samples of the load
+LOAD_SAMPLE_INTERVAL = 1.0
+
+# Bounds of the poll interval suggested to polling clients
+# in the X-Poll-Interval header, see poll_interval()
+MIN_POLL_INTERVAL = 0.25
+MAX_POLL_INTERVAL = 2.0
 
 logger = logging.getLogger('Server')
 
 
+def poll_interval():
+    """
+    Returns the seconds polling clients should at least wait between
+    requests: MIN_POLL_INTERVAL while the CPU is at most half busy,
+    then growing up to MAX_POLL_INTERVAL at the CPU limit.
+    """
+    if not load.max_cpu:
+        return MIN_POLL_INTERVAL
+    busy = min(max(2 * load.cpu / load.max_cpu - 1, 0), 1)
+    return round(MIN_POLL_INTERVAL + busy * (MAX_POLL_INTERVAL - MIN_POLL_INTERVAL), 2)
+
+
 class GameFull(Exception):
     pass
 
 
-def next_id(not_available):
+class IdAllocator(object):
     """
-    Returns an unassigned id. not_available is a dictionary
-    of IDs that are already assigned.
+    Hands out ids as strings of consecutive numbers, starting at a
+    random number. Ids never collide, so no lookups are needed. Every
+    id is congruent to 'shard' modulo 'shards'.
     """
-    pid = random.randint(1000, 100000)
-    while str(pid) in not_available:
-        pid = random.randint(1000, 100000)
-    return str(pid)
+
+    def __init__(self, shard=0, shards=1):
+        self.shard = shard
+        self.shards = shards
+        self.counter = random.randint(1000, 100000) // shards
+
+    def next_id(self):
+        self.counter += 1
+        return str(self.counter * self.shards + self.shard)
+
+    def skip(self, used_id):
+        """
+        Makes sure an id in use, e.g. of a restored game,
+        isn't handed out again
+        """
+        self.counter = max(self.counter, int(used_id) // self.shards)
 
 
-def random_part_index_generator(duck_probability=0.1):
+# When running as one of several worker processes (see sharding.py),
+# a worker only creates games with ids belonging to its own shard.
+game_ids = IdAllocator()
+
+# Players waiting to be placed in a game, see matchmaking.py
+matchmaker = MatchQueue()
+
+MASK64 = (1 << 64) - 1
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+
+
+def part_index(seed, n, duck_probability=0.1):
     """
-    Generator to produce an infinite sequence of
-    indexes, ranging from 0 to 7.
-    0 is returned with the probability specified by the
-    argument 'duck_probability', the other parts share
-    the remaining probability evenly.
+    Returns the n-th index of the part sequence given by seed,
+    ranging from 0 to 7. 0 is returned with the probability
+    specified by the argument 'duck_probability', the other parts
+    share the remaining probability evenly.
+
+    Any element of the sequence is computed directly from
+    (seed, n) by the SplitMix64 mixing function, so no state
+    is needed to hand out parts at arbitrary offsets.
     """
+    z = (seed + (n + 1) * GOLDEN_GAMMA) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    z ^= z >> 31
 
-    while True:
-        rand = random.random()
-        if rand <= duck_probability:
-            yield 0
-        else:
-            yield random.randint(1, 7)
+    rand = (z >> 11) / float(1 << 53)
+    if rand <= duck_probability:
+        return 0
+    return (z & 0xFFFFFFFF) % 7 + 1
+
+
+# Number of past snapshots kept per player for computing
+# deltas against the version a client has seen last
+SNAPSHOT_HISTORY = 8
+
+# Largest number of players in a game
+MAX_GAME_SIZE = 100
+
+# Largest number of columns and rows of a game's grid
+MAX_DIMENSION = 100
+
+# Players of larger games get the snapshots of this many opponents only
+MAX_SHOWN_OPPONENTS = 8
+
+# Smallest penalty log length at which read penalties get dropped
+PENALTY_LOG_TRIM = 64
+
+
+def snapshot_row_diff(old, new):
+    """
+    Compares two snapshots in the '<cols>,<bits>' format row by row.
+    Returns a list of [row_index, row_bits] for the rows of 'new'
+    differing from 'old', or None if they can't be compared.
+    """
+    old_cols, _, old_bits = old.partition(',')
+    new_cols, _, new_bits = new.partition(',')
+    if not new_cols.isdigit() or old_cols != new_cols or len(old_bits) != len(new_bits):
+        return None
+
+    cols = int(new_cols)
+    return [[idx, new_bits[start:start + cols]]
+            for idx, start in enumerate(range(0, len(new_bits), cols))
+            if old_bits[start:start + cols] != new_bits[start:start + cols]]
+
+
+SNAPSHOT_HEADER = struct.Struct('>HH')
+
+
+def pack_snapshot(snapshot):
+    """
+    Packs a snapshot in the '<cols>,<bits>' format into the number
+    of columns and bits, followed by the bits packed into bytes.
+    Snapshots in any other format are kept as they are.
+    """
+    cols, _, bits = snapshot.partition(',')
+    if (not cols.isdigit() or int(cols) > 0xFFFF or len(bits) > 0xFFFF
+            or bits.strip('01')):
+        return snapshot
+    return SNAPSHOT_HEADER.pack(int(cols), len(bits)) + snapshotcodec.pack_bits(bits)
+
+
+def unpack_snapshot(packed):
+    if isinstance(packed, str):
+        return packed
+    cols, length = SNAPSHOT_HEADER.unpack_from(packed)
+    return "%d,%s" % (cols, snapshotcodec.unpack_bits(packed[SNAPSHOT_HEADER.size:], length))
 
 
 def json_error(msg):
@@ -63,97 +257,230 @@ def json_dumps(obj):
     return json.dumps(obj, separators=(',', ':'))
 
 
+class Player(object):
+    """
+    Everything a game keeps about one of its players
+    """
+
+    __slots__ = ('screen_name', 'alive', 'penalty_cursor', 'lines_seq', 'snapshot',
+                 'snapshot_version', 'history', 'part_offset')
+
+    def __init__(self, screen_name):
+        self.screen_name = screen_name
+
+        # Cleared when the player has been kicked for timing out
+        self.alive = True
+
+        # Position of the player's next penalty in the game's penalty log
+        self.penalty_cursor = 0
+
+        # Number of the next line clear expected via /sync
+        self.lines_seq = 0
+
+        # Snapshot of the player's game state, packed by pack_snapshot,
+        # and the game's snapshot version when it was stored
+        self.snapshot = ''
+        self.snapshot_version = 0
+
+        # Up to SNAPSHOT_HISTORY recent (version, packed snapshot) pairs
+        self.history = None
+
+        # Offset of the next part for players not keeping
+        # track of the offset themselves
+        self.part_offset = 0
+
+
 class Game(object):
+    __slots__ = ('game_id', 'size', 'dimensions', 'duck_prob',
+                 'seconds_timeout_to_unregister', 'players', 'next_player_id',
+                 'snapshot_version', 'part_seed', 'started', 'creation_timestamp',
+                 'version', 'observers', 'penalty_log', 'penalty_base', 'penalty_trim',
+                 'alive_cache')
+
     def __init__(self, config):
         self.game_id = config['game_id']
-        self.size = max(min(config['size'], 6), 2)
+        self.size = max(min(config['size'], MAX_GAME_SIZE), 2)
         self.dimensions = config['dimensions']
         self.duck_prob = config['duck_prob']
 
         self.seconds_timeout_to_unregister = 5
 
-        # A mapping from player ids to numbers indicating
-        # pending penalty lines
-        self.player_penalties = {}
-
-        # A mapping from player ids to screen names
-        self.screen_names = {}
+        # A mapping from player ids to Player records,
+        # in the order of registration
+        self.players = {}
+        self.next_player_id = random.randint(1000, 100000)
 
-        # A mapping from player ids to timestamps 
-        # representing their last GET request for punishment.
-        self.last_get_timestamp = {}
+        # Penalties sent, as (sender id, number of lines), from
+        # position penalty_base on. Every player reads the log from
+        # its penalty_cursor, skipping its own penalties. Entries all
+        # players have read are dropped once the log reaches
+        # penalty_trim entries.
+        self.penalty_log = []
+        self.penalty_base = 0
+        self.penalty_trim = PENALTY_LOG_TRIM
 
-        # A mapping from the game's player ids
-        # to snapshots of their game states,
-        # in compressed format
-        self.game_snapshot = {}
+        # Ids of the players alive, None when outdated
+        self.alive_cache = None
 
-        # The 'global' part index generator that all players
-        # receive their parts from.
-        self.part_index_generator = random_part_index_generator(self.duck_prob)
+        # Every change of a snapshot increments the game's snapshot
+        # version, see Player.snapshot_version and Player.history.
+        self.snapshot_version = 0
 
-        # A mapping from player id to part index generator.
-        self.part_generator_for_player_id = {}
+        # All players receive the same part sequence, given
+        # by this seed (see part_index).
+        self.part_seed = random.getrandbits(64)
 
         # Game starts when all players have logged on
         self.started = False
 
         self.creation_timestamp = time.time()
 
+        # Incremented on every change visible in /status
+        self.version = 0
+
+        # Observers (e.g. push channel sessions) get notified
+        # about penalties, snapshots and player changes.
+        self.observers = []
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
+
+    def changed(self, listed=False):
+        """
+        Invalidates cached responses for this game. 'listed' changes
+        also show up in the game list.
+        """
+        self.version += 1
+        if listed:
+            self.alive_cache = None
+            games.touch(self)
+
+    def notify_observers(self, event):
+        for obs in list(self.observers):
+            obs.notify(event)
+
     @property
     def free_slots(self):
-        return self.size - len(self.screen_names)
+        return self.size - len(self.players)
+
+    @property
+    def joinable(self):
+        return not self.started and self.free_slots > 0
+
+    @property
+    def screen_names(self):
+        return [{'player_id': pid, 'screen_name': player.screen_name, 'alive': player.alive}
+                for pid, player in self.players.items()]
+
+    @property
+    def game_snapshot(self):
+        return dict((pid, unpack_snapshot(player.snapshot))
+                    for pid, player in self.players.items())
+
+    def alive_players(self):
+        if self.alive_cache is None:
+            self.alive_cache = [pid for pid, player in self.players.items() if player.alive]
+        return self.alive_cache
+
+    def shown_opponents(self, player_id):
+        """
+        Returns the ids of the opponents whose snapshots are sent to
+        the player, or None for all players. In games of more than
+        MAX_SHOWN_OPPONENTS opponents, these are the ones alive next
+        to the player in the order of registration.
+        """
+        if len(self.players) <= MAX_SHOWN_OPPONENTS + 1:
+            return None
+
+        alive = self.alive_players()
+        if player_id in self.players and self.players[player_id].alive:
+            index = alive.index(player_id)
+            alive = alive[index + 1:] + alive[:index]
+        return alive[:MAX_SHOWN_OPPONENTS]
+
+    def is_playing(self, player_id):
+        player = self.players.get(player_id)
+        return player is not None and player.alive
 
     def as_short_dict(self):
         return {'game_id': self.game_id,
                 'screen_names': self.screen_names,
                 'size': self.size,
                 'dimensions': self.dimensions,
+                'width': self.dimensions[0],
+                'height': self.dimensions[1],
                 'duck_prob': self.duck_prob,
                 'started': self.started,
                 'free_slots': self.free_slots,
                 'timestamp': self.creation_timestamp}
 
-    def as_long_dict(self):
+    def as_long_dict(self, shown=None):
+        """
+        Includes the snapshots of the players in shown, or of all,
+        in their screen_names entries
+        """
+        d = self.as_short_dict()
+        for info in d['screen_names']:
+            if shown is None or info['player_id'] in shown:
+                info['snapshot'] = unpack_snapshot(self.players[info['player_id']].snapshot)
+        d['snapshot_version'] = self.snapshot_version
+        return d
+
+    def as_delta_dict(self, since, shown=None):
+        """
+        Like as_long_dict, but instead of all snapshots contains
+        only what changed after snapshot version 'since'.
+        """
         d = self.as_short_dict()
-        d['snapshots'] = self.game_snapshot
+        d['snapshot_deltas'] = self.snapshot_deltas(since, shown)
+        d['snapshot_version'] = self.snapshot_version
         return d
 
     def add_player(self, screen_name):
-        if self.started or len(self.player_penalties) >= self.size:
+        if self.started or len(self.players) >= self.size:
             raise GameFull("Joining no longer possible (Game started: %s)" % self.started)
 
-        player_id = next_id(self.player_penalties)
-        self.player_penalties[player_id] = deque()
+        self.next_player_id += 1
+        player_id = str(self.next_player_id)
 
         # Use default if screen name is missing
-        self.screen_names[player_id] = (self.adjust_name(screen_name)
-                                        if screen_name else "player%s" % player_id)
-        self.game_snapshot[player_id] = ''
+        self.join(player_id, self.adjust_name(screen_name)
+                  if screen_name else "player%s" % player_id)
+        journal.append(['join', self.game_id, player_id, self.players[player_id].screen_name])
 
         if self.is_full():
-            for pid in self.player_penalties:
-                self.last_get_timestamp[pid] = time.time()
-
-            # Now produce as many identical generators from the 
-            # 'master' as there are players in the game.
-            spawned_part_generators = itertools.tee(self.part_index_generator, self.size)
-
-            # Grab a part generator for each player
-            self.part_generator_for_player_id = dict(zip(self.player_penalties.keys(),
-                                                         spawned_part_generators))
+            now = time.time()
+            for pid in self.players:
+                self.touch_player(pid, now)
 
             self.started = True
 
-        # print "Added player %s to game %s" % (player_id, self.game_id)
+        self.changed(listed=True)
+        self.notify_observers(PlayersChangedEvent())
         return player_id
 
+    def join(self, player_id, screen_name):
+        """
+        Adds a player, who gets the penalties sent from now on
+        """
+        player = self.players[player_id] = Player(screen_name)
+        player.penalty_cursor = self.penalty_base + len(self.penalty_log)
+        return player
+
     def delete_player(self, player_id):
-        try:
-            del self.player_penalties[player_id]
-            del self.screen_names[player_id]
-        except KeyError:
+        if not self.is_playing(player_id):
             logger.info("Player %s cannot be deleted (not found)" % player_id)
+            return
+
+        del self.players[player_id]
+        journal.append(['leave', self.game_id, player_id])
+        timers.cancel(('player', self.game_id, player_id))
+        self.changed(listed=True)
+        self.notify_observers(PlayersChangedEvent())
+        self.remove_if_finished()
 
     def adjust_name(self, desired_name):
         """
@@ -162,7 +489,7 @@ class Game(object):
         "eric(2)", "eric(3)" etc.
         """
 
-        not_available = self.screen_names.values()
+        not_available = set(player.screen_name for player in self.players.values())
 
         if desired_name not in not_available:
             return desired_name
@@ -173,14 +500,87 @@ class Game(object):
         return "%s(%s)" % (desired_name, c)
 
     def is_full(self):
-        return len(self.player_penalties) == self.size
+        return len(self.players) == self.size
 
     def is_alive(self):
-        return len(self.player_penalties) > 1
+        return len(self.alive_players()) > 1
 
     def store_snapshot(self, player_id, snapshot):
-        logger.info("Store %s for player id %s" % (snapshot, player_id))
-        self.game_snapshot[player_id] = snapshot
+        logger.debug("Store %s for player id %s", snapshot, player_id)
+        player = self.players.get(player_id)
+        if player is None:
+            return
+
+        # Snapshots are kept and passed on in format 1, which
+        # all clients understand and deltas are computed from
+        try:
+            snapshot = snapshotcodec.to_format_1(snapshot)
+        except ValueError as err:
+            logger.info("Ignoring snapshot of player %s: %s", player_id, err)
+            return
+
+        packed = pack_snapshot(snapshot)
+        if player.snapshot == packed:
+            return
+
+        self.snapshot_version += 1
+        player.snapshot = packed
+        player.snapshot_version = self.snapshot_version
+        if player.history is None:
+            player.history = []
+        elif len(player.history) >= SNAPSHOT_HISTORY:
+            del player.history[0]
+        player.history.append((self.snapshot_version, packed))
+        self.changed()
+        self.notify_observers(SnapshotEvent(player_id, snapshot))
+
+    def snapshot_deltas(self, since, shown=None):
+        """
+        Returns a mapping from player ids (those in shown, or all)
+        to the changes of their snapshots after version 'since'.
+        Each change is either
+        {'version': v, 'rows': [[row_index, row_bits], ...]} listing
+        the changed rows, or {'version': v, 'snapshot': <full snapshot>}
+        if no suitable base version is known anymore.
+        """
+        deltas = {}
+        players = self.players
+        if shown is not None:
+            players = dict((pid, players[pid]) for pid in shown)
+        for player_id, player in players.items():
+            version = player.snapshot_version
+            if version <= since:
+                continue
+
+            snapshot = unpack_snapshot(player.snapshot)
+            base = self.snapshot_at(player_id, since)
+            rows = snapshot_row_diff(base, snapshot) if base else None
+            if rows is not None:
+                deltas[player_id] = {'version': version, 'rows': rows}
+            else:
+                deltas[player_id] = {'version': version, 'snapshot': snapshot}
+        return deltas
+
+    def snapshot_at(self, player_id, version):
+        """
+        Returns the player's snapshot as of the given snapshot version,
+        or None if it's not in the history anymore.
+        """
+        player = self.players.get(player_id)
+        history = (player.history if player else None) or ()
+        base = None
+        for entry_version, snapshot in history:
+            if entry_version > version:
+                break
+            base = snapshot
+
+        if base is None:
+            if len(history) < SNAPSHOT_HISTORY:
+                # Nothing dropped from the history yet, so the
+                # player had no snapshot at that version
+                return ''
+            return None
+        return unpack_snapshot(base)
 
     def get_snapshots(self):
         items = ["%s:%s" % (pid, snapshot)
@@ -188,111 +588,561 @@ class Game(object):
         return ";".join(items)
 
     def get_names(self):
-        items = ["%s:%s" % (pid, name)
-                 for pid, name in self.screen_names.items()
-                 if pid in self.player_penalties]
+        items = ["%s:%s" % (pid, player.screen_name)
+                 for pid, player in self.players.items()
+                 if player.alive]
         return ",".join(items)
 
-    def get_parts(self, player_id):
+    def get_parts(self, player_id, offset=None, count=10):
         """
-        Returns the next 10 parts for the requesting player
+        Returns 'count' parts of the game's part sequence, starting
+        at the given offset. Without an offset, the parts following
+        the ones last requested by the player are returned.
         """
-        part_gen = self.part_generator_for_player_id[player_id]
-        return [part_gen.next() for _ in range(10)]
+        player = self.players.get(player_id)
+        if offset is None:
+            offset = player.part_offset if player else 0
+        if player is not None:
+            player.part_offset = offset + count
+            journal.append(['parts', self.game_id, player_id, player.part_offset])
 
-    def get_penalties(self, player_id):
-        stamp = time.time()
+        return [part_index(self.part_seed, n, self.duck_prob)
+                for n in range(offset, offset + count)]
+
+    def add_penalty(self, sender_id, num_lines):
+        """
+        Queues a penalty of num_lines for all players but the sender
+        """
+        self.log_penalty(sender_id, num_lines)
+        journal.append(['lines', self.game_id, sender_id, num_lines])
+        receivers = len(self.alive_players())
+        if self.is_playing(sender_id):
+            receivers -= 1
+        metrics.inc('penalties_total', receivers)
+        metrics.inc('penalty_lines_total', num_lines)
+
+        if self.observers:
+            self.notify_observers(PenaltyEvent(sender_id))
+
+    def log_penalty(self, sender_id, num_lines):
+        self.penalty_log.append((sender_id, num_lines))
+        if len(self.penalty_log) < self.penalty_trim:
+            return
 
-        self.kick_timed_out_players(stamp)
+        # Drop the penalties read by all players alive. Waiting for
+        # the log to double keeps this at O(1) per penalty.
+        cursors = [player.penalty_cursor for player in self.players.values() if player.alive]
+        end = self.penalty_base + len(self.penalty_log)
+        trimmed = min(cursors or [end]) - self.penalty_base
+        del self.penalty_log[:trimmed]
+        self.penalty_base += trimmed
+        self.penalty_trim = max(PENALTY_LOG_TRIM, len(self.players), 2 * len(self.penalty_log))
 
-        if player_id not in self.player_penalties:
+    def pending_penalties(self, player_id):
+        """
+        Returns the player's pending penalties without taking them
+        """
+        player = self.players.get(player_id)
+        if player is None or not player.alive:
+            return []
+        return [num_lines for sender_id, num_lines
+                in self.penalty_log[player.penalty_cursor - self.penalty_base:]
+                if sender_id != player_id]
+
+    def add_numbered_penalties(self, sender_id, lines, first_seq):
+        """
+        Queues the penalties for the sender's line clears numbered
+        first_seq, first_seq + 1, ..., skipping those received before.
+        This makes resending them after a lost response harmless.
+        Returns the number of the next line clear expected.
+        """
+        sender = self.players.get(sender_id)
+        expected = sender.lines_seq if sender else 0
+        for seq, num_lines in enumerate(lines, first_seq):
+            if seq >= expected:
+                self.add_penalty(sender_id, num_lines)
+
+        expected = max(expected, first_seq + len(lines))
+        if sender is not None and sender.lines_seq != expected:
+            sender.lines_seq = expected
+            journal.append(['seq', self.game_id, sender_id, expected])
+        return expected
+
+    def take_penalties(self, player_id, limit=None):
+        """
+        Removes up to 'limit' (default: all) of the player's
+        pending penalties and returns them
+        """
+        player = self.players.get(player_id)
+        if player is None or not player.alive:
+            return []
+
+        log = self.penalty_log
+        position = player.penalty_cursor - self.penalty_base
+        taken = []
+        while position < len(log) and (limit is None or len(taken) < limit):
+            sender_id, num_lines = log[position]
+            position += 1
+            if sender_id != player_id:
+                taken.append(num_lines)
+        player.penalty_cursor = self.penalty_base + position
+
+        if taken:
+            journal.append(['take', self.game_id, player_id, len(taken)])
+        return taken
+
+    def get_penalties(self, player_id):
+        """
+        Returns the list of the player's pending penalties,
+        or 0 if the player isn't playing.
+        """
+        if not self.is_playing(player_id):
             return 0
 
-        self.last_get_timestamp[player_id] = stamp
+        if self.started:
+            self.touch_player(player_id, time.time())
 
-        return self.player_penalties[player_id]
+        return self.pending_penalties(player_id)
 
-    def kick_timed_out_players(self, stamp):
-        kickable_players = []
+    def touch_player(self, player_id, stamp):
+        """
+        Postpones kicking the player until the given timestamp
+        plus the unregistration timeout.
+        """
+        timers.schedule(('player', self.game_id, player_id),
+                        stamp + self.seconds_timeout_to_unregister,
+                        self.kick_timed_out_player)
+
+    def kick_timed_out_player(self, timer_key):
+        player = self.players.get(timer_key[2])
+        if player is not None and player.alive:
+            player.alive = False
+            journal.append(['kick', self.game_id, timer_key[2]])
+            metrics.inc('player_timeouts_total')
+            self.changed(listed=True)
+            self.notify_observers(PlayersChangedEvent())
+            self.remove_if_finished()
+
+    def remove_if_finished(self):
+        if self.started and not self.alive_players():
+            remove_game(self.game_id)
+
+
+metrics.gauge('games', lambda: len(games))
+metrics.gauge('players', lambda: sum(len(game.alive_players()) for game in games.values()))
+metrics.gauge('resident_memory_bytes', lambda: load.memory or 0)
+metrics.gauge('cpu_utilization', lambda: round(load.cpu, 3))
+metrics.gauge('spectators', lambda: len(spectators))
+metrics.gauge('matchmaking_queue', lambda: len(matchmaker))
+metrics.histogram('matchmaking_wait_seconds', matchmaking.WAIT_BUCKETS)
+metrics.gauge('free_slots', lambda: sum(game.free_slots for game in games.values()
+                                        if not game.started))
 
-        # find timed out players
-        for player, last_stamp in self.last_get_timestamp.items():
-            if stamp - last_stamp > self.seconds_timeout_to_unregister:
-                kickable_players.append(player)
+GAME_TIMEOUT_IN_SECONDS = 180
 
-        # remove them both from the penalty and
-        # timestamp dictionaries
-        for kickable in kickable_players:
-            del self.last_get_timestamp[kickable]
-            try:
-                del self.player_penalties[kickable]
-            except KeyError, err:
-                pass
 
+def add_game(game):
+    games[game.game_id] = game
+    journal.append(['new', game.game_id, game.size, game.dimensions, game.duck_prob,
+                    game.part_seed, game.creation_timestamp])
+    timers.schedule(('game', game.game_id),
+                    game.creation_timestamp + GAME_TIMEOUT_IN_SECONDS,
+                    expire_game)
 
-GAME_TIMEOUT_IN_SECONDS = 180
 
+def expire_game(timer_key):
+    """
+    Removes a game that didn't get enough players in time
+    """
+    game = games.get(timer_key[1])
+    if game is not None and not game.started:
+        metrics.inc('games_expired_total')
+        remove_game(game.game_id)
 
-def delete_finished_and_empty_games():
-    removable = []
-    now = time.time()
 
-    for game_id, game in games.items():
-        if not game.is_alive():
-            # Started but no more players in it => remove it
-            removable.append(game_id)
+def remove_game(game_id):
+    game = games.pop(game_id, None)
+    if game is None:
+        return
 
-        # Not started but too old => remove it            
-        if not game.started and now - game.creation_timestamp > GAME_TIMEOUT_IN_SECONDS:
-            removable.append(game_id)
+    journal.append(['end', game_id])
+    timers.cancel(('game', game_id))
+    response_cache.discard(('status', game_id))
+    for player_id in game.players:
+        timers.cancel(('player', game_id, player_id))
 
-    for game_id in removable:
+
+async def run_timers():
+    while True:
+        await asyncio.sleep(timers.tick)
+        timers.advance(time.time())
+
+
+async def monitor_load():
+    while True:
+        await asyncio.sleep(LOAD_SAMPLE_INTERVAL)
+        load.sample()
+
+
+def game_state(game):
+    """
+    Returns what a checkpoint keeps of a game, see restore_game
+    """
+    return {'game_id': game.game_id,
+            'size': game.size,
+            'dimensions': game.dimensions,
+            'duck_prob': game.duck_prob,
+            'part_seed': game.part_seed,
+            'created': game.creation_timestamp,
+            'started': game.started,
+            'next_player_id': game.next_player_id,
+            'penalty_base': game.penalty_base,
+            'penalty_log': game.penalty_log,
+            'players': [[pid, player.screen_name, player.alive, player.penalty_cursor,
+                         player.lines_seq, player.part_offset,
+                         unpack_snapshot(player.snapshot)]
+                        for pid, player in game.players.items()]}
+
+
+def restore_game(state):
+    game = Game(state)
+    game.part_seed = state['part_seed']
+    game.creation_timestamp = state['created']
+    game.started = state['started']
+    game.next_player_id = state['next_player_id']
+    game.penalty_base = state['penalty_base']
+    game.penalty_log = [tuple(penalty) for penalty in state['penalty_log']]
+    for pid, name, alive, penalty_cursor, lines_seq, part_offset, snapshot in state['players']:
+        player = game.players[pid] = Player(name)
+        player.alive = alive
+        player.penalty_cursor = penalty_cursor
+        player.lines_seq = lines_seq
+        player.part_offset = part_offset
+        if snapshot:
+            game.store_snapshot(pid, snapshot)
+    return game
+
+
+def replay(record):
+    """
+    Applies a journal record to the registry, without journaling,
+    timers or notifications
+    """
+    kind, game_id = record[0], record[1]
+    if kind == 'new':
+        size, dimensions, duck_prob, part_seed, created = record[2:]
+        game = Game(dict(game_id=game_id, size=size, dimensions=dimensions,
+                         duck_prob=duck_prob))
+        game.part_seed = part_seed
+        game.creation_timestamp = created
+        games[game_id] = game
+        return
+
+    game = games.get(game_id)
+    if game is None:
+        return
+
+    if kind == 'end':
         del games[game_id]
+        return
+
+    player_id = record[2]
+    if kind == 'join':
+        game.join(player_id, record[3])
+        game.next_player_id = max(game.next_player_id, int(player_id))
+        game.started = game.is_full()
+        game.changed(listed=True)
+        return
+
+    player = game.players.get(player_id)
+    if kind == 'lines':
+        game.log_penalty(player_id, record[3])
+    elif player is None:
+        return
+    elif kind == 'leave':
+        del game.players[player_id]
+        game.changed(listed=True)
+    elif kind == 'kick':
+        player.alive = False
+        game.changed(listed=True)
+    elif kind == 'take':
+        game.take_penalties(player_id, record[3])
+    elif kind == 'seq':
+        player.lines_seq = record[3]
+    elif kind == 'parts':
+        player.part_offset = record[3]
+
+
+def restore(path):
+    """
+    Loads the games from the journal at path, which is
+    continued from then on.
+    """
+    global journal
+    started = time.time()
+    journal = Journal(path)
+    checkpoint, records = journal.load()
+
+    for state in checkpoint:
+        games[state['game_id']] = restore_game(state)
+    for record in records:
+        replay(record)
+    journal.open()
+
+    now = time.time()
+    for game in games.values():
+        game_ids.skip(game.game_id)
+        if game.started:
+            for pid in game.alive_players():
+                game.touch_player(pid, now + RESTART_GRACE_SECONDS)
+        else:
+            timers.schedule(('game', game.game_id),
+                            max(game.creation_timestamp + GAME_TIMEOUT_IN_SECONDS,
+                                now + RESTART_GRACE_SECONDS),
+                            expire_game)
 
+    logger.info("Restored %d games from %d checkpointed games and %d journal records in %.3fs",
+                len(games), len(checkpoint), len(records), time.time() - started)
 
-MAX_GAME_NUMBER = 100
 
+async def run_spectators():
+    while True:
+        await asyncio.sleep(spectator_channels.TICK)
+        sent, dropped = spectators.broadcast(games)
+        metrics.inc('spectator_frames_total', sent)
+        metrics.inc('spectator_frames_dropped_total', dropped)
 
-class NewGameRequest(webapp.RequestHandler):
-    def post(self):
-        # To avoid a separate job periodically deleting old (i.e. finished)
-        # games, do the cleaning up here.
-        delete_finished_and_empty_games()
 
+def open_games(key):
+    """
+    Returns the open games of a (size, dimensions, duck_prob)
+    configuration, fullest first
+    """
+    size, dimensions, duck_prob = key
+    entries, _ = games.lobby.query({'size': size,
+                                    'dimensions': '%dx%d' % dimensions,
+                                    'duck_prob': duck_prob}, sort='free_slots')
+    return [games[entry['game_id']] for entry in entries]
+
+
+def create_matched_game(key):
+    if load.overloaded():
+        return None
+    metrics.inc('matchmaking_games_total')
+    size, dimensions, duck_prob = key
+    return create_game(size, list(dimensions), duck_prob)
+
+
+def match_players():
+    for seconds in matchmaker.match(time.time(), open_games, create_matched_game):
+        metrics.record('matchmaking_wait_seconds', seconds)
+
+
+async def run_matchmaking():
+    while True:
+        await asyncio.sleep(matchmaking.MATCH_INTERVAL)
+        # A failing round must not stop matchmaking altogether
+        try:
+            match_players()
+        except Exception:
+            logger.exception("Matchmaking failed")
+
+
+async def run_journal():
+    while True:
+        await asyncio.sleep(JOURNAL_FLUSH_INTERVAL)
+        if not journal.enabled:
+            continue
+        journal.flush()
+        if journal.records >= CHECKPOINT_RECORDS:
+            journal.checkpoint([game_state(game) for game in games.values()])
+
+
+class NewGameRequest(RequestHandler):
+    def post(self):
         self.response.headers['Content-Type'] = 'application/json'
 
-        if len(games) >= MAX_GAME_NUMBER:
+        overloaded = load.overloaded()
+        if overloaded:
+            logger.warning("Refusing new game, %s limit exceeded", overloaded)
             self.response.out.write(json_error('Server full!'))
             return
 
-        size = int(self.request.get('size', default_value="2"))
-        duck_prob = float(self.request.get('duck_prob', default_value="0.01"))
-        dimensions_str = self.request.get('dimensions', default_value="20x25")
-        dimensions = [int(x) for x in dimensions_str.split('x')]
-        game_id = next_id(games)
+        try:
+            config = game_config_args(self.request)
+        except ValueError as err:
+            self.response.set_status(400)
+            self.response.out.write(json_error(str(err)))
+            return
 
-        game_config = dict(game_id=game_id,
-                           size=size,
-                           dimensions=dimensions,
-                           duck_prob=duck_prob)
+        game = create_game(*config)
+        self.response.out.write(json_dumps(dict(game_id=game.game_id,
+                                                size=game.size,
+                                                dimensions=game.dimensions,
+                                                duck_prob=game.duck_prob)))
 
-        game = Game(game_config)
-        games[game_id] = game
 
-        self.response.out.write(json_dumps(game_config))
+def game_config_args(request):
+    """
+    Returns size, dimensions and duck probability as requested.
+    Raises ValueError for invalid values.
+    """
+    size = int(request.get('size', default_value="2"))
+    duck_prob = float(request.get('duck_prob', default_value="0.01"))
+    if not 0 <= duck_prob <= 1:
+        raise ValueError("Invalid duck probability %s" % duck_prob)
+
+    dimensions_str = request.get('dimensions', default_value="20x25")
+    dimensions = [int(x) for x in dimensions_str.split('x')]
+    if len(dimensions) != 2 or not all(0 < x <= MAX_DIMENSION for x in dimensions):
+        raise ValueError("Invalid dimensions %s" % dimensions_str)
+    return size, dimensions, duck_prob
+
 
+def create_game(size, dimensions, duck_prob):
+    game = Game(dict(game_id=game_ids.next_id(),
+                     size=size,
+                     dimensions=dimensions,
+                     duck_prob=duck_prob))
+    add_game(game)
+    return game
 
-class ListGamesRequest(webapp.RequestHandler):
+
+class MatchmakeRequest(RequestHandler):
+    def post(self):
+        """
+        Queues a player (screen_name) for a game with the given size,
+        dimensions and duck_prob, see matchmaking.py. Returns the
+        ticket to poll. With 'cancel', cancels that ticket instead.
+        """
+        self.response.headers['Content-Type'] = 'application/json'
+        cancel = self.request.get('cancel')
+        if cancel:
+            matchmaker.cancel(cancel)
+            self.response.out.write(json_info('Ticket %s cancelled' % cancel))
+            return
+
+        try:
+            size, dimensions, duck_prob = game_config_args(self.request)
+        except ValueError as err:
+            self.response.set_status(400)
+            self.response.out.write(json_error(str(err)))
+            return
+
+        # The configuration as the game will have it
+        key = (max(min(size, MAX_GAME_SIZE), 2), tuple(dimensions), duck_prob)
+        ticket_id = matchmaker.enqueue(key, self.request.get('screen_name', None), time.time())
+        self.response.out.write(json_dumps({'ticket': ticket_id,
+                                            'status': 'waiting',
+                                            'queue_depth': matchmaker.depth(key)}))
+
+    def get(self):
+        """
+        Returns the state of a ticket: 'waiting', along with the number
+        of players waiting for the same kind of game, or 'matched' along
+        with the ids of the game and the player, who has been registered
+        already. Matched players should start polling the game right away.
+        """
+        self.response.headers['Content-Type'] = 'application/json'
+        ticket_id = self.request.get('ticket')
+        ticket = matchmaker.poll(ticket_id, time.time())
+        if ticket is None:
+            self.response.set_status(404)
+            self.response.out.write(json_error('No ticket %s' % ticket_id))
+            return
+
+        reply = ticket.as_dict()
+        if ticket.game_id is None:
+            reply['queue_depth'] = matchmaker.depth(ticket.key)
+        self.response.out.write(json_dumps(reply))
+
+
+class ListGamesRequest(RequestHandler):
     def get(self):
+        """
+        Returns the games as a dict keyed by game id, or with
+        'joinable=1' only the games waiting for players. Answers 304 Not Modified if the
+        list hasn't changed since the ETag given in If-None-Match.
+
+        The joinable games can also be filtered by the values of the
+        fields in lobbyindex.FIELDS (e.g. 'free_slots=1' or
+        'dimensions=20x25'), sorted by one of them with 'sort', and
+        paged with 'limit' and the 'next_cursor' of the previous page
+        given as 'cursor', in which case the page comes as the list
+        'games' along with 'next_cursor'.
+        """
+        etag = list_etag()
+        self.response.headers['ETag'] = etag
+        if self.request.headers.get('if-none-match') == etag:
+            self.response.set_status(304)
+            return
+
         self.response.headers['Content-Type'] = 'application/json'
-        games_list = [game.as_short_dict() for game in games.values()]
-        games_json = json_dumps(games_list)
-        self.response.out.write(games_json)
+        if any(name in self.request.params for name in LOBBY_QUERY_PARAMS):
+            try:
+                query = lobbyindex.parse_query(self.request)
+            except ValueError as err:
+                self.response.set_status(400)
+                self.response.body = json_error(str(err)).encode()
+                return
+            build = lambda: self.encode_page(*query)
+            variant = self.request.query_string
+        else:
+            variant = self.request.get('joinable') == '1'
+            build = lambda: self.encode_list(variant)
+
+        self.response.body = response_cache.get('list', games.version, build,
+                                                variant=variant)
+
+    @staticmethod
+    def encode_list(joinable=False):
+        games_dict = dict((game_id, game.as_short_dict()) for game_id, game in games.items()
+                          if not joinable or game.joinable)
+        return json_dumps(games_dict).encode()
+
+    @staticmethod
+    def encode_page(filters, sort, cursor, limit):
+        """
+        Returns the joinable games matching the filters from the lobby
+        index. With a limit, returns a page of the games along with
+        the cursor of the next one.
+        """
+        games_list, next_cursor = games.lobby.query(filters, sort, cursor, limit)
+        if limit is None:
+            return json_dumps(games_by_id(games_list)).encode()
+        return json_dumps({'games': games_list, 'next_cursor': next_cursor}).encode()
+
+
+def games_by_id(games_list):
+    """
+    Returns the /list entries as a dict keyed by game id, which keeps
+    the order of the list
+    """
+    return dict((game['game_id'], game) for game in games_list)
+
+
+# Parameters of /list answered from the lobby index
+LOBBY_QUERY_PARAMS = tuple(lobbyindex.FILTER_TYPES) + ('sort', 'cursor', 'limit')
 
 
-class RegistrationRequest(webapp.RequestHandler):
+# Distinguishes the registry versions of different server runs
+REGISTRY_EPOCH = '%08x' % random.getrandbits(32)
+
+
+def list_etag():
+    return '"%s-%d"' % (REGISTRY_EPOCH, games.version)
+
+
+class RegistrationRequest(RequestHandler):
     def get(self):
+        """
+        Adds a player to a game. The X-Snapshot-Format header tells
+        the client the newest snapshot format it may send. Clients
+        getting it may also omit unchanged snapshots from /receive
+        and push channel frames, as they always could from /sync.
+        """
         self.response.headers['Content-Type'] = 'application/json'
+        self.response.headers['X-Snapshot-Format'] = str(snapshotcodec.FORMAT)
         game_id = self.request.get('game_id')
 
         # screen name may not be given
@@ -307,13 +1157,17 @@ class RegistrationRequest(webapp.RequestHandler):
             self.response.out.write(json_error('Game already full'))
 
 
-class StatusReport(webapp.RequestHandler):
+class StatusReport(RequestHandler):
     def get(self):
         """
-        Returns the status of the game as a string
-        <started>|<player_ids>|<player_penalties>|<game_size>
+        Returns the status of the game as JSON. If the parameter
+        'since' holds a snapshot version, only the snapshot changes
+        after that version are included, see Game.snapshot_deltas.
+        In large games, a player given by 'player_id' only gets the
+        snapshots of the opponents from Game.shown_opponents.
         """
         self.response.headers['Content-Type'] = 'application/json'
+        self.response.headers['X-Poll-Interval'] = str(poll_interval())
         game_id = self.request.get('game_id')
 
         game = games.get(game_id)
@@ -321,75 +1175,247 @@ class StatusReport(webapp.RequestHandler):
         if game is None:
             error_msg = json_error('No game with ID %s' % game_id)
             self.response.out.write(error_msg)
+            return
+
+        player_id = self.request.get('player_id')
+        shown = game.shown_opponents(player_id) if player_id else None
+
+        # Clients knowing a snapshot version only need the changes
+        since = self.request.get('since')
+        if since.isdigit():
+            since = int(since)
+            build = lambda: json_dumps(game.as_delta_dict(since, shown)).encode()
         else:
-            game_json = json_dumps(game.as_long_dict())
-            self.response.out.write(game_json)
+            since = None
+            build = lambda: json_dumps(game.as_long_dict(shown)).encode()
+
+        # Players with the same opponents shown share the response. In
+        # large games, most players see opponents of their own, and
+        # there is a variant per player and 'since' they poll with.
+        variant = (since, tuple(shown) if shown is not None else None)
+        self.response.body = response_cache.get(('status', game_id), game.version, build,
+                                                variant=variant,
+                                                max_variants=max(MAX_VARIANTS, 2 * game.size))
 
 
-class UpdateRequest(webapp.RequestHandler):
+class UpdateRequest(RequestHandler):
     def get(self):
         self.response.headers['Content-Type'] = 'application/json'
+        self.response.headers['X-Poll-Interval'] = str(poll_interval())
         game_id = self.request.get('game_id')
         game = games[game_id]
         player_id = self.request.get('player_id')
-        penalties = game.get_penalties(player_id)
+        # Polling counts as a sign of life
+        game.get_penalties(player_id)
+        taken = game.take_penalties(player_id, 1)
+        pen = taken[0] if taken else 0
 
-        if penalties:
-            pen = penalties.popleft()
-        else:
-            pen = 0
-
-        # Store the snapshot of the player's game
-        snapshot = self.request.get('game_snapshot', '')
-        game.store_snapshot(player_id, snapshot)
+        # Store the snapshot of the player's game, unless
+        # it's omitted since it didn't change
+        snapshot = self.request.get('game_snapshot', None)
+        if snapshot is not None:
+            game.store_snapshot(player_id, snapshot)
 
         self.response.out.write(json_dumps({'penalty': pen}))
 
 
-class PartRequest(webapp.RequestHandler):
+class SyncRequest(RequestHandler):
+    def post(self):
+        """
+        Does the work of /sendlines, /receive, /status and /getparts
+        in one round trip. Parameters besides game_id and player_id:
+
+        lines          comma separated line clears to send ...
+        lines_seq      ... the first of which has this number
+        game_snapshot  the player's snapshot, unchanged if omitted
+        since          the snapshot version known to the player
+        parts_offset   offset of the parts wanted ...
+        parts          ... and their number (default 0)
+
+        Returns all pending penalties, the snapshot changes after
+        'since' (of the opponents shown to the player in large games),
+        the ids of the players alive and the parts wanted.
+
+        Requests and responses may use the binary encoding of wire.py
+        instead of form parameters and JSON. Like /receive and /status,
+        the response suggests the interval of the next request in the
+        X-Poll-Interval header.
+        """
+        self.response.headers['X-Poll-Interval'] = str(poll_interval())
+        if self.request.headers.get('content-type', '').startswith(wire.CONTENT_TYPE):
+            try:
+                args = wire.decode_sync_request(self.request.body)
+            except wire.WireError as err:
+                self.response.set_status(400)
+                self.response.out.write(json_error(str(err)))
+                return
+        else:
+            args = self.form_args()
+
+        self.response.headers['Content-Type'] = 'application/json'
+        game = games.get(args['game_id'])
+
+        if game is None:
+            self.response.out.write(json_error('No game with ID %s' % args['game_id']))
+            return
+
+        reply = self.sync(game, args)
+        if wire.CONTENT_TYPE in self.request.headers.get('accept', ''):
+            self.response.headers['Content-Type'] = wire.CONTENT_TYPE
+            self.response.body = wire.encode_sync_response(reply)
+        else:
+            self.response.out.write(json_dumps(reply))
+
+    def form_args(self):
+        return {'game_id': self.request.get('game_id'),
+                'player_id': self.request.get('player_id'),
+                'lines': [int(n) for n in self.request.get('lines').split(',') if n],
+                'lines_seq': int(self.request.get('lines_seq', '0')),
+                'game_snapshot': self.request.get('game_snapshot', None),
+                'since': int(self.request.get('since', '0')),
+                'parts_offset': int(self.request.get('parts_offset', '0')),
+                'parts': int(self.request.get('parts', '0'))}
+
+    @staticmethod
+    def sync(game, args):
+        player_id = args['player_id']
+        lines_seq = game.add_numbered_penalties(player_id, args['lines'], args['lines_seq'])
+
+        if args['game_snapshot'] is not None:
+            game.store_snapshot(player_id, args['game_snapshot'])
+
+        game.get_penalties(player_id)
+        pending = game.take_penalties(player_id)
+
+        parts_offset, number_of_parts = args['parts_offset'], args['parts']
+
+        return {'penalties': pending,
+                'lines_seq': lines_seq,
+                'snapshot_deltas': game.snapshot_deltas(args['since'],
+                                                        game.shown_opponents(player_id)),
+                'snapshot_version': game.snapshot_version,
+                'players_alive': game.alive_players(),
+                'parts_offset': parts_offset,
+                'parts': (game.get_parts(player_id, parts_offset, number_of_parts)
+                          if number_of_parts > 0 else [])}
+
+
+class PartRequest(RequestHandler):
     def get(self):
         self.response.headers['Content-Type'] = 'application/json'
         game_id = self.request.get('game_id')
         game = games[game_id]
         player_id = self.request.get('player_id')
-        parts = game.get_parts(player_id)
+        offset = self.request.get('offset')
+        parts = game.get_parts(player_id, int(offset) if offset.isdigit() else None)
         self.response.out.write(json_dumps(parts))
 
 
-class UnregistrationRequest(webapp.RequestHandler):
+class UnregistrationRequest(RequestHandler):
     def post(self):
         self.response.headers['Content-Type'] = 'application/json'
         game_id = self.request.get('game_id')
         game = games[game_id]
         player_id = self.request.get('player_id')
 
-        if player_id in game.player_penalties:
+        if game.is_playing(player_id):
             game.delete_player(player_id)
             self.response.out.write(json_info("Player %s deleted" % player_id))
         else:
             self.response.out.write(json_info("Player %s not found" % player_id))
 
 
-class SendRequest(webapp.RequestHandler):
+class SendRequest(RequestHandler):
     def post(self):
         game_id = self.request.get('game_id')
         game = games[game_id]
         player_id = self.request.get('player_id')
         num_lines = self.request.get('num_lines')
 
-        for player_key in game.player_penalties:
-            if player_key != player_id:
-                game.player_penalties[player_key].append(int(num_lines))
+        game.add_penalty(player_id, int(num_lines))
 
         info = json_info("Added a penalty of %s to all but %s"
                          % (num_lines, player_id))
         self.response.out.write(info)
 
 
-class MainPage(webapp.RequestHandler):
+class PushChannelRequest(RequestHandler):
+    def get(self):
+        """
+        Upgrades the connection to a push channel for one player,
+        see pushchannel.py for the protocol.
+        """
+        self.response.headers['Content-Type'] = 'application/json'
+        game_id = self.request.get('game_id')
+        player_id = self.request.get('player_id')
+        game = games.get(game_id)
+
+        if game is None or not game.is_playing(player_id):
+            self.response.set_status(404)
+            self.response.out.write(json_error('No player %s in game %s' % (player_id, game_id)))
+            return
+
+        if self.request.headers.get('upgrade', '').lower() != PUSH_PROTOCOL:
+            self.response.set_status(426)
+            self.response.out.write(json_error('Upgrade to %s required' % PUSH_PROTOCOL))
+            return
+
+        self.response.set_status(101)
+        self.response.headers = {'Connection': 'Upgrade', 'Upgrade': PUSH_PROTOCOL}
+        self.response.upgrade = PushSession(game, player_id).run
+
+
+class WatchRequest(RequestHandler):
+    def get(self):
+        """
+        Upgrades the connection to a read-only spectator channel
+        of a game, see spectators.py for the protocol.
+        """
+        self.response.headers['Content-Type'] = 'application/json'
+        game_id = self.request.get('game_id')
+        game = games.get(game_id)
+
+        if game is None:
+            self.response.set_status(404)
+            self.response.out.write(json_error('No game %s' % game_id))
+            return
+
+        if self.request.headers.get('upgrade', '').lower() != WATCH_PROTOCOL:
+            self.response.set_status(426)
+            self.response.out.write(json_error('Upgrade to %s required' % WATCH_PROTOCOL))
+            return
+
+        self.response.set_status(101)
+        self.response.headers = {'Connection': 'Upgrade', 'Upgrade': WATCH_PROTOCOL}
+        self.response.upgrade = spectators.watch(game)
+
+
+class StatsRequest(RequestHandler):
+    def get(self):
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json_dumps({'games': len(games),
+                                            'response_cache': response_cache.stats()}))
+
+
+class MetricsRequest(RequestHandler):
+    """
+    Serves the metrics in the Prometheus text format,
+    or with 'format=json' as the snapshot merged by sharding.py
+    """
+
+    def get(self):
+        if self.request.get('format') == 'json':
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.out.write(json_dumps(metrics.snapshot()))
+        else:
+            self.response.headers['Content-Type'] = TEXT_CONTENT_TYPE
+            self.response.out.write(render(metrics.snapshot()))
+
+
+class MainPage(RequestHandler):
     def get(self):
         self.response.headers['Content-Type'] = 'text/plain'
-        self.response.out.write('Welcome to the Entris server - hosted by Google App Engine')
+        self.response.out.write('Welcome to the Entris server')
 
 
 URLS = [('/', MainPage),
@@ -398,14 +1424,68 @@ URLS = [('/', MainPage),
         ('/receive', UpdateRequest),
         ('/getparts', PartRequest),
         ('/sendlines', SendRequest),
+        ('/sync', SyncRequest),
         ('/unregister', UnregistrationRequest),
         ('/status', StatusReport),
-        ('/list', ListGamesRequest)]
+        ('/list', ListGamesRequest),
+        ('/push', PushChannelRequest),
+        ('/watch', WatchRequest),
+        ('/matchmake', MatchmakeRequest),
+        ('/stats', StatsRequest),
+        ('/metrics', MetricsRequest)]
+
+
+application = httpserver.Application(URLS)
+application.background_tasks.append(run_timers)
+application.background_tasks.append(monitor_load)
+application.background_tasks.append(run_journal)
+application.background_tasks.append(run_spectators)
+application.background_tasks.append(run_matchmaking)
+application.metrics = metrics
+
+
+def run_worker(index, count, host, port, log_level='INFO',
+               max_memory=None, max_cpu=DEFAULT_MAX_CPU, journal_path=None):
+    """
+    Runs the server as the worker for shard 'index' of 'count'.
+    New games are refused above max_memory bytes, by default a share
+    of the physical memory, or max_cpu utilization of a core.
+    Given a journal path, games survive restarts.
+    """
+    global game_ids, load, matchmaker
+    game_ids = IdAllocator(index, count)
+    matchmaker = MatchQueue(index, count)
+    load = LoadMonitor(max_memory or default_max_memory(count), max_cpu)
+
+    logging.basicConfig(level=log_level)
+    if journal_path:
+        restore(journal_path if count == 1 else '%s.worker%d' % (journal_path, index))
+
+    httpserver.run(application, host, port)
 
 
 def main():
-    application = webapp.WSGIApplication(URLS)
-    run_wsgi_app(application)
+    parser = argparse.ArgumentParser(description='Entris game server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes to shard the games across')
+    parser.add_argument('--log-level', default='INFO')
+    parser.add_argument('--max-memory-mb', type=int,
+                        help='memory per worker above which new games are refused')
+    parser.add_argument('--max-cpu', type=float, default=DEFAULT_MAX_CPU,
+                        help='CPU utilization of a worker above which new games are refused')
+    parser.add_argument('--journal',
+                        help='path of the journal keeping the games across restarts')
+    args = parser.parse_args()
+
+    worker_main = functools.partial(run_worker, log_level=args.log_level,
+                                    max_memory=args.max_memory_mb and args.max_memory_mb << 20,
+                                    max_cpu=args.max_cpu, journal_path=args.journal)
+    if args.workers > 1:
+        sharding.run_sharded(worker_main, args.host, args.port, args.workers)
+    else:
+        worker_main(0, 1, args.host, args.port)
 
 
 if __name__ == '__main__':
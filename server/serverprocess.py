@@ -0,0 +1,63 @@
+"""
+Runs the server in a separate process, for the tests, benchmarks
+and load tests that need it on a real port.
+"""
+
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import time
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+
+def free_port(count=1):
+    """
+    Returns a port such that it and the count - 1 ports following it
+    are free, as needed by a server with count - 1 workers (see
+    sharding.py)
+    """
+    while True:
+        sockets = [socket.socket()]
+        try:
+            sockets[0].bind(('127.0.0.1', 0))
+            port = sockets[0].getsockname()[1]
+            for offset in range(1, count):
+                sockets.append(socket.socket())
+                sockets[-1].bind(('127.0.0.1', port + offset))
+            return port
+        except OSError:
+            continue
+        finally:
+            for sock in sockets:
+                sock.close()
+
+
+def start_server(port, workers=1, timeout=10):
+    """
+    Starts the server with the given number of worker processes
+    and returns the process once it answers requests. With workers,
+    the ports following port must be free as well, see free_port.
+    """
+    process = subprocess.Popen([sys.executable, SERVER_SCRIPT,
+                                '--host', '127.0.0.1', '--port', str(port),
+                                '--workers', str(workers),
+                                '--log-level', 'WARNING'])
+
+    # Wait until acceptors and workers are up
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request("GET", "/list")
+            status = conn.getresponse().status
+            conn.close()
+            if status == 200:
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    process.wait()
+    raise RuntimeError("Server did not start")
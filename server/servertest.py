@@ -0,0 +1,87 @@
+"""
+Base class of the tests talking to the server over HTTP.
+"""
+
+import http.client
+import json
+import unittest
+import urllib.parse
+
+import server
+from admission import LoadMonitor
+from httpserver import BackgroundServer
+from journal import Journal
+from matchmaking import MatchQueue
+from spectators import SpectatorHub
+from timerwheel import TimerWheel
+
+
+def reset_server():
+    """
+    Drops all games and everything else the server module keeps,
+    as if it had just been started. Call in the server's thread.
+    """
+    server.journal.close()
+    server.journal = Journal()
+    server.games.clear()
+    server.response_cache.clear()
+    server.spectators = SpectatorHub()
+    server.timers = TimerWheel()
+    server.load = LoadMonitor()
+    server.game_ids = server.IdAllocator()
+    server.matchmaker = MatchQueue()
+    for name in server.metrics.counters:
+        server.metrics.counters[name] = 0
+
+
+class ServerTestCase(unittest.TestCase):
+    """
+    Runs the server in a background thread for the test class, and
+    resets its state before every test.
+    """
+
+    headers = {"Content-type": "application/x-www-form-urlencoded",
+               "Accept": "application/json"}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server_thread = BackgroundServer(server.application)
+        cls.server_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server_thread.stop()
+
+    def setUp(self):
+        self.server_thread.call(reset_server)
+        self.conn = http.client.HTTPConnection(self.server_thread.address)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def request(self, method, url, params=None):
+        """
+        Returns the response and its body decoded from JSON
+        """
+        if params is None:
+            self.conn.request(method, url)
+        else:
+            self.conn.request(method, url, urllib.parse.urlencode(params), self.headers)
+        response = self.conn.getresponse()
+        return response, json.loads(response.read().decode())
+
+    def get(self, url):
+        return self.request("GET", url)[1]
+
+    def post(self, url, params):
+        return self.request("POST", url, params)[1]
+
+    def start_game(self, size=2):
+        """
+        Creates a game and fills it with players named p0, p1, ...
+        Returns the game id and the player ids.
+        """
+        game_id = self.post("/new", {'size': size})['game_id']
+        player_ids = [self.get("/register?game_id=%s&screen_name=p%d" % (game_id, idx))['player_id']
+                      for idx in range(size)]
+        return game_id, player_ids
@@ -0,0 +1,353 @@
+"""
+Multi-process mode: games are partitioned across worker processes.
+
+Every worker is a complete game server owning the games whose id
+satisfies int(game_id) % shard_count == shard_index. In front of the
+workers, one or more acceptor processes share the public port
+(SO_REUSEPORT) and route each request to the worker owning its
+game_id. '/new' is handed to the workers in turns, '/matchmake'
+goes to the worker queueing that kind of game, '/list' merges the
+game lists (or pages, see lobbyindex.merge_pages), '/metrics' the
+metrics and '/stats' the statistics of all workers.
+
+    client --> acceptor(s) on <port> --> worker i on 127.0.0.1:<port+1+i>
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import signal
+import sys
+import zlib
+from http import HTTPStatus
+
+from httpserver import HTTPServer, Request, Response, BadRequest, MAX_HEADER_BYTES
+import metrics
+import lobbyindex
+import wire
+
+logger = logging.getLogger('Server')
+
+# Headers managed per connection, which must not be passed through
+HOP_BY_HOP_HEADERS = ('connection', 'content-length', 'keep-alive')
+
+
+def shard_for(game_id, shard_count):
+    """
+    Returns the index of the worker owning the given game id.
+    Invalid ids end up at the first worker, which will complain.
+    """
+    try:
+        return int(game_id) % shard_count
+    except (TypeError, ValueError):
+        return 0
+
+
+def request_game_id(request):
+    """
+    Returns the game id a request is about. Binary /sync requests
+    carry it only in their body.
+    """
+    if request.path == '/sync' and \
+            request.headers.get('content-type', '').startswith(wire.CONTENT_TYPE):
+        try:
+            return wire.decode_sync_request(request.body)['game_id']
+        except wire.WireError:
+            return None
+    return request.get('game_id', None)
+
+
+def encode_request(request):
+    target = request.path
+    if request.query_string:
+        target += '?' + request.query_string
+
+    lines = ['%s %s HTTP/1.1' % (request.method, target)]
+    lines.extend('%s: %s' % (name, value)
+                 for name, value in request.headers.items()
+                 if name not in HOP_BY_HOP_HEADERS)
+    if request.headers.get('upgrade'):
+        lines.append('Connection: Upgrade')
+    lines.append('Content-Length: %d' % len(request.body))
+    head = '\r\n'.join(lines) + '\r\n\r\n'
+    return head.encode('latin-1') + request.body
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        status = int(lines[0].split(' ')[1])
+    except (IndexError, ValueError):
+        raise BadRequest("Malformed response line: %r" % lines[0])
+
+    response = Response()
+    response.set_status(status)
+    response.headers = {}
+    length = 0
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _, value = line.partition(':')
+        name, value = name.strip(), value.strip()
+        if name.lower() == 'content-length':
+            length = int(value)
+        elif name.lower() not in HOP_BY_HOP_HEADERS:
+            response.headers[name] = value
+
+    response.body = await reader.readexactly(length) if length else b''
+    return response
+
+
+async def pipe(source, destination):
+    try:
+        while True:
+            data = await source.read(64 * 1024)
+            if not data:
+                break
+            destination.write(data)
+            await destination.drain()
+    except ConnectionError:
+        pass
+    finally:
+        destination.close()
+
+
+class Upstream(object):
+    """
+    Keep-alive connections from an acceptor to one worker.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.idle = []
+
+    async def request(self, request):
+        # A pooled connection may have been closed by the worker
+        # in the meantime, so retry once on a fresh one.
+        for attempt in range(2):
+            fresh = not self.idle
+            if fresh:
+                connection = await asyncio.open_connection(self.host, self.port,
+                                                           limit=MAX_HEADER_BYTES)
+            else:
+                connection = self.idle.pop()
+
+            reader, writer = connection
+            try:
+                writer.write(encode_request(request))
+                await writer.drain()
+                response = await read_response(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if fresh or attempt:
+                    raise
+                continue
+
+            if response.status == 101:
+                # Hand the connection over to the client, it is
+                # no longer usable for other requests.
+                response.headers['Connection'] = 'Upgrade'
+                response.upgrade = self.tunnel(reader, writer)
+            else:
+                self.idle.append(connection)
+            return response
+
+    @staticmethod
+    def tunnel(upstream_reader, upstream_writer):
+        async def run(reader, writer):
+            await asyncio.gather(pipe(reader, upstream_writer),
+                                 pipe(upstream_reader, writer))
+        return run
+
+
+def matchmaking_shard(request, shard_count):
+    """
+    Tickets are polled at the worker that issued them. New tickets
+    for the same kind of game all go to one worker, so its queue
+    sees all the players that could be matched.
+    """
+    ticket = request.get('ticket') or request.get('cancel')
+    if ticket:
+        return shard_for(ticket, shard_count)
+    key = '%s|%s|%s' % (request.get('size'), request.get('dimensions'), request.get('duck_prob'))
+    return zlib.crc32(key.encode()) % shard_count
+
+
+def list_request(request, etag):
+    """
+    Returns a copy of the /list request for a worker,
+    conditional on the worker's ETag if given
+    """
+    headers = dict((name, value) for name, value in request.headers.items()
+                   if name != 'if-none-match')
+    if etag:
+        headers['if-none-match'] = '"%s"' % etag
+    target = request.path + ('?' + request.query_string if request.query_string else '')
+    return Request('GET', target, headers)
+
+
+def add_stats(stats_list):
+    """
+    Adds up the /stats of several workers, which are numbers
+    or dicts of numbers
+    """
+    total = {}
+    for stats in stats_list:
+        for name, value in stats.items():
+            if isinstance(value, dict):
+                total[name] = add_stats([total.get(name, {}), value])
+            else:
+                total[name] = total.get(name, 0) + value
+    return total
+
+
+class ShardRouter(object):
+    """
+    Application dispatching requests to the workers' upstreams.
+    """
+
+    def __init__(self, worker_addresses):
+        self.upstreams = [Upstream(host, port) for host, port in worker_addresses]
+        self.new_game_shards = itertools.cycle(range(len(self.upstreams)))
+
+    async def dispatch(self, request):
+        try:
+            if request.path == '/list':
+                return await self.merge_lists(request)
+            if request.path == '/metrics':
+                return await self.merge_metrics(request)
+            if request.path == '/stats':
+                return await self.merge_stats(request)
+
+            if request.path == '/new':
+                shard = next(self.new_game_shards)
+            elif request.path == '/matchmake':
+                shard = matchmaking_shard(request, len(self.upstreams))
+            else:
+                shard = shard_for(request_game_id(request), len(self.upstreams))
+            return await self.upstreams[shard].request(request)
+        except (OSError, asyncio.IncompleteReadError, BadRequest) as err:
+            logger.warning("Worker failed on %s: %s", request.path, err)
+            response = Response()
+            response.set_status(HTTPStatus.BAD_GATEWAY)
+            return response
+
+    async def merge_lists(self, request):
+        """
+        The merged list's ETag is made up of the workers' ETags, so a
+        conditional request is passed on to every worker with its part.
+        """
+        worker_tags = request.headers.get('if-none-match', '').strip('"').split('.')
+        if len(worker_tags) != len(self.upstreams):
+            worker_tags = [None] * len(self.upstreams)
+
+        responses = await asyncio.gather(*[
+            upstream.request(list_request(request, tag))
+            for upstream, tag in zip(self.upstreams, worker_tags)])
+
+        response = Response()
+        response.headers['ETag'] = '"%s"' % '.'.join(
+            shard_response.headers.get('ETag', '').strip('"') for shard_response in responses)
+        if all(shard_response.status == 304 for shard_response in responses):
+            response.set_status(304)
+            return response
+
+        lists = []
+        for upstream, shard_response in zip(self.upstreams, responses):
+            if shard_response.status == 304:
+                # Unchanged here, but the list as a whole has changed
+                shard_response = await upstream.request(list_request(request, None))
+            if shard_response.status == 400:
+                # An invalid query, which every worker rejects alike
+                return shard_response
+            if shard_response.status == 200:
+                lists.append(json.loads(shard_response.body.decode()))
+
+        if request.get('limit'):
+            # Each worker returned the first page of its own games
+            filters, sort, cursor, limit = lobbyindex.parse_query(request)
+            games_list, next_cursor = lobbyindex.merge_pages(lists, sort, limit)
+            merged = {'games': games_list, 'next_cursor': next_cursor}
+        else:
+            merged = [game for games_dict in lists for game in games_dict.values()]
+            if request.get('sort'):
+                sort = request.get('sort')
+                merged.sort(key=lambda game: lobbyindex.sort_key(game, sort))
+            merged = dict((game['game_id'], game) for game in merged)
+
+        response.headers['Content-Type'] = 'application/json'
+        response.body = json.dumps(merged, separators=(',', ':')).encode()
+        return response
+
+    async def merge_stats(self, request):
+        responses = await asyncio.gather(*[upstream.request(request)
+                                           for upstream in self.upstreams])
+        merged = add_stats([json.loads(shard_response.body.decode())
+                            for shard_response in responses
+                            if shard_response.status == 200])
+
+        response = Response()
+        response.headers['Content-Type'] = 'application/json'
+        response.body = json.dumps(merged, separators=(',', ':')).encode()
+        return response
+
+    async def merge_metrics(self, request):
+        worker_request = Request('GET', '/metrics?format=json', request.headers)
+        responses = await asyncio.gather(*[upstream.request(worker_request)
+                                           for upstream in self.upstreams])
+        snapshot = metrics.merge([json.loads(shard_response.body.decode())
+                                  for shard_response in responses
+                                  if shard_response.status == 200])
+
+        response = Response()
+        if request.get('format') == 'json':
+            response.headers['Content-Type'] = 'application/json'
+            response.body = json.dumps(snapshot, separators=(',', ':')).encode()
+        else:
+            response.headers['Content-Type'] = metrics.TEXT_CONTENT_TYPE
+            response.body = metrics.render(snapshot).encode()
+        return response
+
+
+def run_acceptor(host, port, worker_addresses):
+    logging.basicConfig(level=logging.WARNING)
+    router = ShardRouter(worker_addresses)
+    asyncio.run(HTTPServer(router, host, port, reuse_port=True).serve_forever())
+
+
+def run_sharded(worker_main, host, port, workers, acceptors=None):
+    """
+    Starts 'workers' worker processes, each calling
+    worker_main(shard_index, shard_count, host, port), and
+    'acceptors' acceptor processes (default: one per worker)
+    sharing the public port. Blocks until interrupted.
+    """
+    worker_addresses = [('127.0.0.1', port + 1 + idx) for idx in range(workers)]
+
+    processes = [multiprocessing.Process(target=worker_main,
+                                         args=(idx, workers, worker_host, worker_port),
+                                         daemon=True)
+                 for idx, (worker_host, worker_port) in enumerate(worker_addresses)]
+    processes += [multiprocessing.Process(target=run_acceptor,
+                                          args=(host, port, worker_addresses),
+                                          daemon=True)
+                  for _ in range(acceptors or workers)]
+
+    for process in processes:
+        process.start()
+
+    # Take the children down with us when being terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        for process in processes:
+            process.join()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
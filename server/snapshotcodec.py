@@ -0,0 +1,219 @@
+"""
+Encoding of board snapshots, as sent by the clients and shown in
+their opponent monitors.
+
+The same module lives in client/snapshotcodec.py and
+server/snapshotcodec.py, since client and server are deployed
+separately. Keep both copies identical, test_snapshotcodec.py
+checks that they are.
+
+Format 1 is the original one: '<cols>,<bits>' with a '0' or '1' per
+cell, row by row from the top. Format 2 packs the cells into bits:
+
+    2.<cols>.<rows>.<codec>.<payload>
+
+where the payload is the base64url encoding (without padding) of
+
+    p   the cells packed into bytes, 8 per byte, first cell in the
+        most significant bit
+    r   the lengths of the alternating runs of empty and filled
+        cells, starting with empty ones, as LEB128 varints
+    z   the packed cells compressed with zlib
+
+The encoder picks the shorter of 'p' and 'r' unless told otherwise.
+Boards are mostly empty at the top and filled at the bottom, so runs
+usually win; a 30x40 board takes some 165 characters instead of 1200
+in the benchmark (server/bench_snapshots.py).
+
+Internally, boards are handled as 'flags': bytes with 0 or 1 per
+cell, which the conversions below turn into strings, bits and rows
+without looping over the cells in Python.
+"""
+
+import base64
+import re
+import zlib
+
+FORMAT = 2
+
+CODECS = ('p', 'r', 'z')
+
+# Larger boards are refused when decoding, as the server
+# decodes whatever clients send
+MAX_CELLS = 0xFFFF
+
+# Translations between flags and '0'/'1' strings
+TO_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+FROM_DIGITS = bytes.maketrans(b'01', b'\x00\x01')
+
+RUN = re.compile(b'\x00+|\x01+')
+
+
+def cells_to_flags(cells, filled=()):
+    """
+    Returns the flags of a list of cells, any true value counting as
+    filled, with the cells at the indexes in 'filled' filled as well
+    """
+    flags = bytearray(map(bool, cells))
+    for idx in filled:
+        if 0 <= idx < len(flags):
+            flags[idx] = 1
+    return flags
+
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def pack_bits(bits):
+    """
+    Packs a string of '0'/'1' characters (str or bytes) into bytes,
+    padding the last byte with zeros. This is the one bit packer of
+    client and server, wire.py uses it as well.
+    """
+    if not bits:
+        return b''
+    padding = -len(bits) % 8
+    return (int(bits, 2) << padding).to_bytes((len(bits) + padding) // 8, 'big')
+
+
+def unpack_bits(data, length):
+    if not length:
+        return ''
+    return bin(int.from_bytes(data, 'big'))[2:].zfill(len(data) * 8)[:length]
+
+
+def pack_flags(flags):
+    return pack_bits(bytes(flags).translate(TO_DIGITS))
+
+
+def unpack_flags(data, length):
+    return unpack_bits(data, length).encode('ascii').translate(FROM_DIGITS)
+
+
+def encode_runs(flags):
+    runs = [len(run) for run in RUN.findall(bytes(flags))]
+    if flags and flags[0]:
+        # Empty run of empty cells first
+        runs.insert(0, 0)
+    if not runs or max(runs) < 0x80:
+        # Every run fits into a single byte
+        return bytes(runs)
+
+    out = bytearray()
+    for value in runs:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def decode_runs(data, length):
+    if max(data, default=0) < 0x80:
+        runs = data
+    else:
+        runs = []
+        value = shift = 0
+        for byte in data:
+            value |= (byte & 0x7F) << shift
+            if byte >= 0x80:
+                shift += 7
+                continue
+            runs.append(value)
+            value = shift = 0
+
+    if sum(runs) != length:
+        raise ValueError("Runs of %d cells instead of %d" % (sum(runs), length))
+    return b''.join((b'\x01' if idx & 1 else b'\x00') * value
+                    for idx, value in enumerate(runs))
+
+
+def encode(cols, flags, format=FORMAT, codec=None):
+    """
+    Returns the snapshot of a board with 'cols' columns and the
+    given flags in the given format. In format 2, codec is one of
+    CODECS, or None for the shorter of 'p' and 'r'.
+    """
+    if format == 1:
+        return "%d,%s" % (cols, bytes(flags).translate(TO_DIGITS).decode('ascii'))
+
+    rows = len(flags) // cols if cols else 0
+    if codec is None:
+        runs = encode_runs(flags)
+        if len(runs) < (len(flags) + 7) // 8:
+            codec, payload = 'r', runs
+        else:
+            codec, payload = 'p', pack_flags(flags)
+    elif codec == 'p':
+        payload = pack_flags(flags)
+    elif codec == 'r':
+        payload = encode_runs(flags)
+    elif codec == 'z':
+        payload = zlib.compress(pack_flags(flags))
+    else:
+        raise ValueError("Unknown codec %r" % codec)
+    return "2.%d.%d.%s.%s" % (cols, rows, codec, b64encode(payload))
+
+
+def decode(snapshot):
+    """
+    Returns the number of columns and the flags of a snapshot in
+    either format, or None for an empty one. Raises ValueError if
+    the snapshot is malformed.
+    """
+    if not snapshot:
+        return None
+
+    if snapshot.startswith('2.'):
+        try:
+            _, cols, rows, codec, payload = snapshot.split('.')
+            cols, length = int(cols), int(cols) * int(rows)
+            if not 0 <= length <= MAX_CELLS:
+                raise ValueError("Board of %d cells" % length)
+            data = b64decode(payload)
+            if codec == 'p':
+                flags = unpack_flags(data, length)
+            elif codec == 'r':
+                flags = decode_runs(data, length)
+            elif codec == 'z':
+                packed = zlib.decompressobj().decompress(data, (length + 7) // 8)
+                flags = unpack_flags(packed, length)
+            else:
+                raise ValueError("Unknown codec %r" % codec)
+        except (TypeError, zlib.error) as err:
+            raise ValueError(str(err))
+        if len(flags) != length:
+            raise ValueError("Expected %d cells, got %d" % (length, len(flags)))
+        return cols, flags
+
+    cols, sep, bits = snapshot.partition(',')
+    if not sep or not cols.isdigit() or bits.strip('01'):
+        raise ValueError("Malformed snapshot %r" % snapshot[:20])
+    return int(cols), bits.encode('ascii').translate(FROM_DIGITS)
+
+
+def to_format_1(snapshot):
+    """
+    Returns a snapshot in format 1, converting it if necessary
+    """
+    if not snapshot.startswith('2.'):
+        return snapshot
+    cols, flags = decode(snapshot)
+    return encode(cols, flags, format=1)
+
+
+def rows(snapshot):
+    """
+    Returns the board of a snapshot as a list of rows of 0 and 1,
+    or None for an empty snapshot
+    """
+    decoded = decode(snapshot)
+    if decoded is None or not decoded[0]:
+        return None
+    cols, flags = decoded
+    return [list(flags[start:start + cols]) for start in range(0, len(flags), cols)]
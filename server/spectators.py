@@ -0,0 +1,130 @@
+"""
+Spectator channels for watching a game without joining it.
+
+A client upgrades a 'GET /watch?game_id=<id>' request carrying the
+header 'Upgrade: entris-watch'. Afterwards the server sends JSON
+frames, one per line; spectators send nothing.
+
+    {"type": "game", "game_id": .., "started": <bool>, "size": <n>,
+     "players": [{"player_id": .., "screen_name": .., "alive": <bool>,
+                  "snapshot": "<board>"}, ...]}
+    {"type": "end"}    the game is over and the channel closed
+
+Every TICK seconds, each watched game that changed since its last
+frame gets a new frame. The frame is encoded once and the same bytes
+are written to all of the game's spectators, so another spectator
+costs a write per tick and nothing else. A spectator whose connection
+still has MAX_PENDING_BYTES waiting misses the frame instead of
+buffering it; as every frame holds the whole game, the next one
+makes up for it.
+"""
+
+import json
+
+WATCH_PROTOCOL = 'entris-watch'
+
+# Seconds between frames of a changing game
+TICK = 0.25
+
+# Frames are skipped for spectators with this many bytes still
+# waiting to be sent, i.e. a few frames of a large game
+MAX_PENDING_BYTES = 64 * 1024
+
+END_FRAME = b'{"type":"end"}\n'
+
+
+def encode_frame(game):
+    snapshots = game.game_snapshot
+    players = [{'player_id': pid,
+                'screen_name': player.screen_name,
+                'alive': player.alive,
+                'snapshot': snapshots[pid]}
+               for pid, player in game.players.items()]
+    frame = {'type': 'game',
+             'game_id': game.game_id,
+             'started': game.started,
+             'size': game.size,
+             'players': players}
+    return (json.dumps(frame, separators=(',', ':')) + '\n').encode()
+
+
+class Audience(object):
+    """
+    The spectators of one game and the last frame sent to them
+    """
+    __slots__ = ('writers', 'version', 'frame')
+
+    def __init__(self):
+        self.writers = []
+        self.version = None
+        self.frame = None
+
+    def current_frame(self, game):
+        if self.version != game.version:
+            self.frame = encode_frame(game)
+            self.version = game.version
+            return self.frame, True
+        return self.frame, False
+
+
+class SpectatorHub(object):
+    def __init__(self):
+        # Mapping from game ids to audiences
+        self.audiences = {}
+
+    def __len__(self):
+        return sum(len(audience.writers) for audience in self.audiences.values())
+
+    def watch(self, game):
+        """
+        Returns the upgrade coroutine of a new spectator of game
+        """
+        async def run(reader, writer):
+            audience = self.audiences.get(game.game_id)
+            if audience is None:
+                audience = self.audiences[game.game_id] = Audience()
+            audience.writers.append(writer)
+            try:
+                writer.write(audience.current_frame(game)[0])
+                # Wait for the spectator (or broadcast()) to close the channel
+                while await reader.read(1024):
+                    pass
+            except ConnectionError:
+                pass
+            finally:
+                if writer in audience.writers:
+                    audience.writers.remove(writer)
+                if not audience.writers and self.audiences.get(game.game_id) is audience:
+                    del self.audiences[game.game_id]
+        return run
+
+    def broadcast(self, games):
+        """
+        Sends the frames of the watched games that changed. Returns
+        the numbers of frames sent and dropped.
+        """
+        sent = dropped = 0
+        for game_id, audience in list(self.audiences.items()):
+            game = games.get(game_id)
+            if game is None:
+                # Game over, let the spectators know
+                del self.audiences[game_id]
+                for writer in audience.writers:
+                    if not writer.is_closing():
+                        writer.write(END_FRAME)
+                        writer.close()
+                continue
+
+            frame, changed = audience.current_frame(game)
+            if not changed:
+                continue
+
+            for writer in audience.writers:
+                if writer.is_closing():
+                    continue
+                if writer.transport.get_write_buffer_size() > MAX_PENDING_BYTES:
+                    dropped += 1
+                else:
+                    writer.write(frame)
+                    sent += 1
+        return sent, dropped
@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import server
+from servertest import ServerTestCase, reset_server
+from timerwheel import TimerWheel
+
+
+class JournalTest(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'games')
+        self.restart()
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        self.server_thread.call(reset_server)
+        shutil.rmtree(self.directory)
+
+    def restart(self):
+        """
+        Drops all games and restores them from the journal
+        """
+        def restore():
+            server.journal.close()
+            server.games.clear()
+            server.timers = TimerWheel()
+            server.restore(self.path)
+        self.server_thread.call(restore)
+
+    def test_restart_keeps_games(self):
+        game_id, (p0, p1, p2) = self.start_game(size=3)
+        waiting = self.post("/new", {'size': 2})['game_id']
+        self.get("/register?game_id=%s" % waiting)
+
+        self.post("/sync", {'game_id': game_id, 'player_id': p0, 'lines': '2,3', 'lines_seq': 0,
+                            'game_snapshot': '1,01'})
+        self.get("/receive?game_id=%s&player_id=%s" % (game_id, p1))
+        self.get("/getparts?game_id=%s&player_id=%s" % (game_id, p2))
+        self.post("/unregister", {'game_id': game_id, 'player_id': p2})
+        status = self.get("/status?game_id=%s" % game_id)
+        parts = self.get("/getparts?game_id=%s&player_id=%s&offset=0" % (game_id, p0))
+
+        self.restart()
+
+        restored = self.get("/status?game_id=%s" % game_id)
+        for key in ('size', 'started', 'dimensions', 'timestamp'):
+            assert restored[key] == status[key], "Bad %s: %s" % (key, restored)
+        # Snapshots are sent again by the players rather than journaled
+        players = lambda status: [(p['player_id'], p['screen_name'], p['alive'])
+                                  for p in status['screen_names']]
+        assert players(restored) == players(status), "Bad players: %s" % restored
+        assert self.get("/getparts?game_id=%s&player_id=%s&offset=0" % (game_id, p1)) == parts, \
+            "Part sequence changed"
+        assert not self.get("/status?game_id=%s" % waiting)['started'], "Waiting game lost"
+
+        # p1 took one of its penalties before the restart
+        resp = self.post("/sync", {'game_id': game_id, 'player_id': p1})
+        assert resp['penalties'] == [3], "Bad penalties %s" % resp
+        resp = self.post("/sync", {'game_id': game_id, 'player_id': p0,
+                                   'lines': '2,3', 'lines_seq': 0})
+        assert resp['lines_seq'] == 2, "Line clears applied twice: %s" % resp
+        resp = self.get("/getparts?game_id=%s&player_id=%s" % (game_id, p2))
+        assert 'error' not in resp, resp
+
+        new_game = self.post("/new", {'size': 2})['game_id']
+        assert new_game not in (game_id, waiting), "Game id reused"
+
+    def test_checkpoint(self):
+        game_id, (p0, p1, p2) = self.start_game(size=3)
+        self.post("/sendlines", {'game_id': game_id, 'player_id': p0, 'num_lines': 4})
+        self.server_thread.call(lambda: server.journal.checkpoint(
+            [server.game_state(game) for game in server.games.values()]))
+        assert not os.path.exists(self.path + '.0'), "Old journal not removed"
+
+        self.post("/sendlines", {'game_id': game_id, 'player_id': p1, 'num_lines': 1})
+        self.server_thread.call(server.games[game_id].kick_timed_out_player,
+                                ('player', game_id, p2))
+        self.restart()
+
+        game = server.games[game_id]
+        assert game.pending_penalties(p1) == [4], "Bad penalties %s" % game.pending_penalties(p1)
+        assert game.pending_penalties(p0) == [1], "Bad penalties %s" % game.pending_penalties(p0)
+        assert not game.is_playing(p2), "Kicked player is back"
+
+        # Restored players get some time to come back
+        self.server_thread.call(server.timers.advance, time.time() + 10)
+        assert game.is_playing(p0), "Player kicked right after the restart"
+
+    def test_torn_write(self):
+        game_id, player_ids = self.start_game(size=2)
+        self.server_thread.call(server.journal.flush)
+        with open(self.path + '.0', 'a') as f:
+            f.write('["lines","%s"' % game_id)
+
+        self.restart()
+        assert game_id in server.games, "Game lost"
+        self.post("/sendlines", {'game_id': game_id, 'player_id': player_ids[0], 'num_lines': 2})
+        self.restart()
+        assert server.games[game_id].pending_penalties(player_ids[1]) == [2], "Record lost"
+
+    def test_replay_time(self):
+        def create_games():
+            for _ in range(5000):
+                game = server.Game(dict(game_id=server.game_ids.next_id(), size=4,
+                                        dimensions=[20, 25], duck_prob=0.1))
+                server.add_game(game)
+                for _ in range(4):
+                    pid = game.add_player(None)
+                    game.add_numbered_penalties(pid, [1, 2], 0)
+                    game.get_parts(pid)
+        self.server_thread.call(create_games)
+
+        # The target is well under a second, the bound leaves
+        # headroom for slower machines
+        started = time.perf_counter()
+        self.restart()
+        elapsed = time.perf_counter() - started
+        assert len(server.games) == 5000, "Games lost"
+        assert elapsed < 1.0, "Replay too slow: %.3f seconds" % elapsed
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import asyncio
+import unittest
+
+import server
+from loadtest import percentile, regressions, run_load
+from servertest import ServerTestCase
+
+
+class LoadTestTest(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert percentile(values, 0.5) == 50, percentile(values, 0.5)
+        assert percentile(values, 0.99) == 99, percentile(values, 0.99)
+        assert percentile([7], 0.95) == 7
+        assert percentile([], 0.5) is None
+
+    def test_regressions(self):
+        baseline = {'requests_per_second': 100, 'error_rate': 0,
+                    'routes': {'/status': {'p95_ms': 1.0}}}
+        report = {'requests_per_second': 90, 'error_rate': 0,
+                  'routes': {'/status': {'p95_ms': 1.1}, '/new': {'p95_ms': 5}}}
+        assert regressions(report, baseline, 0.2) == [], "Unexpected regressions"
+
+        report['routes']['/status']['p95_ms'] = 2
+        report['requests_per_second'] = 50
+        assert len(regressions(report, baseline, 0.2)) == 2, regressions(report, baseline, 0.2)
+
+
+class RunLoadTest(ServerTestCase):
+    def test_run_load(self):
+        host, port = self.server_thread.address.split(':')
+        report = asyncio.run(run_load(host, int(port), players=6, game_size=3,
+                                      seconds=0.5, interval=0.05))
+
+        assert report['errors'] == 0, "Errors during load: %s" % report
+        for route in ['/new', '/register', '/status', '/receive', '/getparts', '/unregister']:
+            assert report['routes'][route]['requests'] > 0, "No requests to %s" % route
+        assert report['routes']['/register']['requests'] == 6, report['routes']['/register']
+        assert not server.games, "Games left after all players unregistered"
+
+
+if __name__ == '__main__':
+    unittest.main()
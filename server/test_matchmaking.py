@@ -0,0 +1,83 @@
+import unittest
+
+from matchmaking import MatchQueue, MAX_WAIT, TICKET_TIMEOUT
+
+KEY = (3, (20, 25), 0.1)
+
+
+class FakeGame(object):
+    def __init__(self, game_id, size, players=0):
+        self.game_id = game_id
+        self.size = size
+        self.players = ['x'] * players
+        self.started = False
+
+    @property
+    def free_slots(self):
+        return self.size - len(self.players)
+
+    def add_player(self, screen_name):
+        self.players.append(screen_name)
+        self.started = self.free_slots == 0
+        return str(len(self.players))
+
+
+class MatchQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = MatchQueue()
+        self.open = []
+        self.created = []
+
+    def create_game(self, key):
+        game = FakeGame(str(100 + len(self.created)), key[0])
+        self.created.append(game)
+        return game
+
+    def match(self, now):
+        return self.queue.match(now, lambda key: list(self.open), self.create_game)
+
+    def test_full_batches(self):
+        tickets = [self.queue.enqueue(KEY, 'p%d' % i, 0) for i in range(7)]
+        waited = self.match(1)
+
+        assert len(self.created) == 2 and waited == [1] * 6, "Bad batch %s" % waited
+        matched = [self.queue.poll(ticket, 1).as_dict() for ticket in tickets]
+        assert [m['game_id'] for m in matched[:6]] == ['100'] * 3 + ['101'] * 3, matched
+        assert matched[6] == {'status': 'waiting'} and len(self.queue) == 1, matched
+
+        # The last player gets a game of its own after waiting long enough
+        self.match(MAX_WAIT)
+        assert self.queue.poll(tickets[6], MAX_WAIT).game_id == '102', "Player left waiting"
+        assert len(self.queue) == 0, "Queue not empty"
+
+    def test_fills_open_games_first(self):
+        self.open = [FakeGame('1', 3, players=2), FakeGame('2', 3, players=1)]
+        tickets = [self.queue.enqueue(KEY, None, 0) for _ in range(3)]
+        self.match(1)
+
+        game_ids = [self.queue.poll(ticket, 1).game_id for ticket in tickets]
+        assert game_ids == ['1', '2', '2'] and not self.created, "Bad placement %s" % game_ids
+
+    def test_other_configurations_not_mixed(self):
+        self.queue.enqueue(KEY, None, 0)
+        self.queue.enqueue((3, (30, 40), 0.1), None, 0)
+        self.queue.enqueue(KEY, None, 0)
+        self.match(1)
+        assert not self.created and len(self.queue) == 3, "Players of different games matched"
+
+    def test_abandoned_tickets_dropped(self):
+        ticket = self.queue.enqueue(KEY, None, 0)
+        abandoned = self.queue.enqueue(KEY, None, 0)
+        self.queue.poll(ticket, TICKET_TIMEOUT)
+        self.match(TICKET_TIMEOUT + 1)
+        assert self.queue.poll(abandoned, 0) is None, "Abandoned ticket kept"
+        assert self.created[0].players == [None], "Abandoned ticket matched"
+
+    def test_cancel(self):
+        ticket = self.queue.enqueue(KEY, None, 0)
+        self.queue.cancel(ticket)
+        assert len(self.queue) == 0 and self.queue.poll(ticket, 0) is None, "Ticket not cancelled"
+
+
+if __name__ == '__main__':
+    unittest.main()
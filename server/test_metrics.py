@@ -0,0 +1,59 @@
+import unittest
+
+from metrics import Metrics, merge, render, LATENCY_BUCKETS
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics(counters=('kicked_total',))
+        self.metrics.gauge('games', lambda: 3)
+
+    def test_snapshot(self):
+        self.metrics.observe('/status', 0.0002)
+        self.metrics.observe('/status', 5)
+        self.metrics.inc('sent_total', 2)
+
+        snapshot = self.metrics.snapshot()
+        assert snapshot['counters'] == {'kicked_total': 0, 'sent_total': 2}, snapshot
+        assert snapshot['gauges'] == {'games': 3}, snapshot
+        counts = snapshot['latencies']['/status']['counts']
+        assert counts[1] == 1 and counts[-1] == 1 and sum(counts) == 2, counts
+
+    def test_merge_and_render(self):
+        self.metrics.observe('/new', 0.001)
+        other = Metrics(counters=('kicked_total',))
+        other.inc('kicked_total')
+        other.observe('/new', 0.001)
+        other.observe('/list', 0.02)
+
+        merged = merge([self.metrics.snapshot(), other.snapshot()])
+        assert merged['counters'] == {'kicked_total': 1}, merged
+        assert sum(merged['latencies']['/new']['counts']) == 2, merged
+
+        lines = render(merged).splitlines()
+        assert 'entris_kicked_total 1' in lines, lines
+        assert 'entris_games 3' in lines, lines
+        assert 'entris_request_duration_seconds_bucket{route="/new",le="0.0005"} 0' in lines, lines
+        assert 'entris_request_duration_seconds_bucket{route="/new",le="0.001"} 2' in lines, lines
+        assert 'entris_request_duration_seconds_count{route="/list"} 1' in lines, lines
+        buckets = [line for line in lines if line.startswith('entris_request_duration_seconds_bucket{route="/list"')]
+        assert len(buckets) == len(LATENCY_BUCKETS) + 1, buckets
+
+    def test_histogram(self):
+        self.metrics.histogram('wait_seconds', (1, 10))
+        self.metrics.record('wait_seconds', 0.5)
+        other = Metrics()
+        other.histogram('wait_seconds', (1, 10))
+        other.record('wait_seconds', 5)
+        other.record('wait_seconds', 50)
+
+        merged = merge([self.metrics.snapshot(), other.snapshot()])
+        assert merged['histograms']['wait_seconds']['counts'] == [1, 1, 1], merged
+
+        lines = render(merged).splitlines()
+        assert 'entris_wait_seconds_bucket{le="10"} 2' in lines, lines
+        assert 'entris_wait_seconds_count 3' in lines, lines
+
+
+if __name__ == '__main__':
+    unittest.main()
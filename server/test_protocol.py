@@ -0,0 +1,129 @@
+"""
+Contract tests of the protocol the client speaks: every response is
+checked for the fields client/networking.py and client/lobby.py read,
+in the shapes they expect them, so the server can stand in for the
+real one when running the whole game locally.
+"""
+
+import unittest
+
+import snapshotcodec
+from servertest import ServerTestCase
+
+
+class ProtocolTest(ServerTestCase):
+    def create_game(self, size=2, dimensions='25x32', duck_prob=0.05):
+        # The config the client's menu builds (gamemodel.create_game)
+        config = {'game_type': 'create', 'server_name': self.server_thread.address,
+                  'size': size, 'dimensions': dimensions, 'duck_prob': duck_prob}
+        resp = self.post("/new", config)
+        assert isinstance(resp['game_id'], str), "Bad game %s" % resp
+        return resp['game_id']
+
+    def register(self, game_id, screen_name):
+        response, resp = self.request("GET", "/register?game_id=%s&screen_name=%s"
+                                      % (game_id, screen_name))
+        assert int(response.getheader('X-Snapshot-Format')) >= 1, "No snapshot format"
+        assert isinstance(resp['player_id'], str), "Bad registration %s" % resp
+        return resp['player_id']
+
+    def test_list(self):
+        game_id = self.create_game(size=3)
+        player_id = self.register(game_id, 'p0')
+
+        # Without paging, the lobby takes the values of a dict
+        games = self.get("/list")
+        assert list(games) == [game_id], "Bad list %s" % games
+        game = games[game_id]
+        assert game['game_id'] == game_id and not game['started'], "Bad game %s" % game
+        assert (game['width'], game['height']) == (25, 32), "Bad dimensions %s" % game
+        assert game['duck_prob'] == 0.05 and game['size'] == 3, "Bad config %s" % game
+        assert [p['player_id'] for p in game['screen_names']] == [player_id], \
+            "Bad players %s" % game
+
+        page = self.get("/list?joinable=1&limit=10")
+        assert page['next_cursor'] is None, "Bad cursor %s" % page
+        assert page['games'] == [game], "Bad page %s" % page
+
+    def test_status(self):
+        game_id = self.create_game()
+        player_ids = [self.register(game_id, 'p%d' % i) for i in range(2)]
+        snapshot = snapshotcodec.encode(2, b'\x00\x01\x01\x01')
+
+        response, resp = self.request("GET", "/status?game_id=%s" % game_id)
+        assert resp['started'] and resp['size'] == 2, "Bad status %s" % resp
+        assert float(response.getheader('X-Poll-Interval')) > 0, "No poll interval"
+
+        self.get("/receive?game_id=%s&player_id=%s&game_snapshot=%s"
+                 % (game_id, player_ids[0], snapshot))
+        resp = self.get("/status?game_id=%s&player_id=%s" % (game_id, player_ids[1]))
+        infos = dict((info['player_id'], info) for info in resp['screen_names'])
+        assert sorted(infos) == sorted(player_ids), "Bad players %s" % resp
+        assert all(info['alive'] is True for info in infos.values()), "Bad players %s" % resp
+        assert infos[player_ids[0]]['snapshot'] == "2,0111", "Bad snapshot %s" % resp
+        version = resp['snapshot_version']
+
+        # Once the client knows a version, the snapshots come as deltas
+        self.get("/receive?game_id=%s&player_id=%s&game_snapshot=2,1111"
+                 % (game_id, player_ids[0]))
+        resp = self.get("/status?game_id=%s&player_id=%s&since=%s"
+                        % (game_id, player_ids[1], version))
+        assert all('snapshot' not in info for info in resp['screen_names']), "Bad status %s" % resp
+        assert resp['snapshot_deltas'] == {player_ids[0]: {'version': version + 1,
+                                                           'rows': [[0, "11"]]}}, \
+            "Bad deltas %s" % resp
+        assert resp['snapshot_version'] == version + 1, "Bad version %s" % resp
+
+        resp = self.get("/status?game_id=nothing")
+        assert 'error' in resp, "Unknown game found %s" % resp
+
+    def test_lines_and_parts(self):
+        game_id = self.create_game()
+        player_ids = [self.register(game_id, 'p%d' % i) for i in range(2)]
+
+        resp = self.post("/sendlines", {'game_id': game_id, 'player_id': player_ids[0],
+                                        'num_lines': 2})
+        assert resp['info'].startswith("Added"), "Lines not added %s" % resp
+        resp = self.get("/receive?game_id=%s&player_id=%s" % (game_id, player_ids[1]))
+        assert resp['penalty'] == 2, "Bad penalty %s" % resp
+
+        parts = self.get("/getparts?game_id=%s&player_id=%s&offset=0" % (game_id, player_ids[0]))
+        assert len(parts) > 0 and all(isinstance(part, int) for part in parts), \
+            "Bad parts %s" % parts
+        assert self.get("/getparts?game_id=%s&player_id=%s&offset=0"
+                        % (game_id, player_ids[1])) == parts, "Parts differ between players"
+
+    def test_sync(self):
+        game_id = self.create_game()
+        player_ids = [self.register(game_id, 'p%d' % i) for i in range(2)]
+
+        response, resp = self.request("POST", "/sync", {
+            'game_id': game_id, 'player_id': player_ids[0], 'lines': '1,3', 'lines_seq': 0,
+            'game_snapshot': '2,0011', 'parts_offset': 0, 'parts': 5})
+        assert float(response.getheader('X-Poll-Interval')) > 0, "No poll interval"
+        assert resp['lines_seq'] == 2 and resp['penalties'] == [], "Bad sync %s" % resp
+        assert sorted(resp['players_alive']) == sorted(player_ids), "Bad players %s" % resp
+        assert resp['parts_offset'] == 0 and len(resp['parts']) == 5, "Bad parts %s" % resp
+
+        resp = self.post("/sync", {'game_id': game_id, 'player_id': player_ids[1]})
+        assert resp['penalties'] == [1, 3], "Bad penalties %s" % resp
+        assert resp['snapshot_deltas'][player_ids[0]]['snapshot'] == "2,0011", \
+            "Bad deltas %s" % resp
+        assert isinstance(resp['snapshot_version'], int), "Bad version %s" % resp
+
+        resp = self.post("/sync", {'game_id': 'nothing', 'player_id': player_ids[1]})
+        assert 'error' in resp, "Unknown game synced %s" % resp
+
+    def test_unregister(self):
+        game_id = self.create_game()
+        player_ids = [self.register(game_id, 'p%d' % i) for i in range(2)]
+
+        resp = self.post("/unregister", {'game_id': game_id, 'player_id': player_ids[0]})
+        assert 'error' not in resp, "Unregistering failed %s" % resp
+        resp = self.get("/status?game_id=%s" % game_id)
+        assert [info['player_id'] for info in resp['screen_names'] if info['alive']] \
+            == player_ids[1:], "Bad players %s" % resp
+
+
+if __name__ == '__main__':
+    unittest.main()
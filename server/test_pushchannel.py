@@ -0,0 +1,91 @@
+import json
+import socket
+import unittest
+
+from servertest import ServerTestCase
+
+
+class PushChannelTest(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.game_id, self.player_ids = self.start_game()
+        self.channels = []
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        for sock, _ in self.channels:
+            sock.close()
+
+    def open_channel(self, player_id):
+        sock = socket.create_connection(('127.0.0.1', self.server_thread.http_server.port), timeout=5)
+        sock.sendall(("GET /push?game_id=%s&player_id=%s HTTP/1.1\r\n"
+                      "Host: localhost\r\nConnection: Upgrade\r\nUpgrade: entris-push\r\n\r\n"
+                      % (self.game_id, player_id)).encode())
+        stream = sock.makefile('rb')
+        status_line = stream.readline()
+        assert b' 101 ' in status_line, "Upgrade failed: %s" % status_line
+        while stream.readline() != b'\r\n':
+            pass
+        self.channels.append((sock, stream))
+        return sock, stream
+
+    def read_frame(self, stream, frame_type):
+        while True:
+            frame = json.loads(stream.readline().decode())
+            if frame['type'] == frame_type:
+                return frame
+
+    def send_frame(self, sock, frame):
+        sock.sendall((json.dumps(frame) + '\n').encode())
+
+    def test_initial_status(self):
+        _, stream = self.open_channel(self.player_ids[0])
+        frame = self.read_frame(stream, 'status')
+        assert frame['started'] and frame['size'] == 2, "Bad status %s" % frame
+        assert sorted(p['screen_name'] for p in frame['players']) == ['p0', 'p1'], "Bad players %s" % frame
+
+    def test_lines_are_pushed(self):
+        sock, _ = self.open_channel(self.player_ids[0])
+        _, stream = self.open_channel(self.player_ids[1])
+
+        self.send_frame(sock, {'type': 'lines', 'num_lines': 3})
+        frame = self.read_frame(stream, 'penalty')
+        assert frame['penalty'] == 3, "Bad penalty %s" % frame
+
+        # The penalty has been delivered, so polling must not repeat it
+        resp = self.get("/receive?game_id=%s&player_id=%s" % (self.game_id, self.player_ids[1]))
+        assert resp['penalty'] == 0, "Penalty delivered twice: %s" % resp
+
+    def test_polled_lines_are_pushed(self):
+        _, stream = self.open_channel(self.player_ids[1])
+        self.post("/sendlines", {'game_id': self.game_id,
+                                 'player_id': self.player_ids[0],
+                                 'num_lines': 2})
+
+        frame = self.read_frame(stream, 'penalty')
+        assert frame['penalty'] == 2, "Bad penalty %s" % frame
+
+    def test_snapshots_are_pushed(self):
+        sock, _ = self.open_channel(self.player_ids[0])
+        _, stream = self.open_channel(self.player_ids[1])
+
+        self.send_frame(sock, {'type': 'snapshot', 'snapshot': '2,0110'})
+        frame = self.read_frame(stream, 'snapshot')
+        assert frame == {'type': 'snapshot', 'player_id': self.player_ids[0], 'snapshot': '2,0110'}, \
+            "Bad snapshot %s" % frame
+
+        # Heartbeats without snapshot leave the snapshot unchanged
+        self.send_frame(sock, {'type': 'snapshot'})
+        self.send_frame(sock, {'type': 'snapshot', 'snapshot': '2,1110'})
+        frame = self.read_frame(stream, 'snapshot')
+        assert frame['snapshot'] == '2,1110', "Bad snapshot %s" % frame
+
+    def test_upgrade_required(self):
+        self.conn.request("GET", "/push?game_id=%s&player_id=%s" % (self.game_id, self.player_ids[0]))
+        resp = self.conn.getresponse()
+        resp.read()
+        assert resp.status == 426, "Unexpected status %s" % resp.status
+
+
+if __name__ == '__main__':
+    unittest.main()
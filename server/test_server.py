@@ -1,100 +1,427 @@
-import httplib
-import urllib
+import http.client
+import json
+import urllib.parse
 import unittest
-#import server
 import time
 
-class ServerTest(unittest.TestCase):
-    headers = {"Content-type": "application/x-www-form-urlencoded",
-               "Accept": "text/plain"}
+import server
+import snapshotcodec
+from admission import LoadMonitor
+from servertest import ServerTestCase
 
-    def setUp(self):
-        self.conn = httplib.HTTPConnection('localhost:8090')
-
-        # create a new game
-        self.conn.request("GET", "/new?size=5")
-        self.game_id = int(self.conn.getresponse().read())
 
-        self.player_ids = []
+def snapshots(status):
+    return dict((p['player_id'], p['snapshot']) for p in status['screen_names'] if 'snapshot' in p)
 
-        # add five players
-        for _ in range(5):
-            self.conn.request("GET", "/register?game_id=%s" % self.game_id)
-            player_id = int(self.conn.getresponse().read())
-            self.player_ids.append(player_id)
 
-    def tearDown(self):
-        self.conn.close()
+class ServerTest(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.game_id, self.player_ids = self.start_game(size=5)
 
     def test_too_many_players(self):
-        self.conn.request("GET", "/register?game_id=%s" % self.game_id)
-        resp = self.conn.getresponse().read()
-        assert resp.startswith("Joining no longer possible"), "Joining unexpectedly succeeded: '%s'" % resp
+        resp = self.get("/register?game_id=%s" % self.game_id)
+        assert resp == {'error': 'Game already full'}, "Joining unexpectedly succeeded: '%s'" % resp
 
     def test_get_status(self):
-        self.conn.request("GET", "/status?game_id=%s" % self.game_id)
-        resp = self.conn.getresponse().read()
-        assert resp.startswith("Started: True"), "Status fetching fails"
+        resp = self.get("/status?game_id=%s" % self.game_id)
+        assert resp['started'], "Status fetching fails"
+        assert sorted(p['player_id'] for p in resp['screen_names']) == sorted(self.player_ids), \
+            "Bad players %s" % resp
 
     def test_send_and_get_lines(self):
         for pid in self.player_ids:
-            self.conn.request("GET", "/receive?game_id=%s&player_id=%s" % (self.game_id, pid))
-            resp = int(self.conn.getresponse().read().strip('#'))
-            assert resp == 0, "Penalty found where not expected: %s" % resp
-
-        for num_lines, pid in enumerate(self.player_ids):    
-            params = urllib.urlencode({'game_id': self.game_id, 
-                                       'player_id': pid, 
-                                       'num_lines': num_lines})
-            self.conn.request("POST", "/sendlines", params, self.headers)
-            resp = self.conn.getresponse().read()
-            assert resp == "Added a penalty of %s to all but %s" % (num_lines, pid), "Response was %s" % resp
+            resp = self.get("/receive?game_id=%s&player_id=%s" % (self.game_id, pid))
+            assert resp['penalty'] == 0, "Penalty found where not expected: %s" % resp
+
+        for num_lines, pid in enumerate(self.player_ids):
+            resp = self.post("/sendlines", {'game_id': self.game_id,
+                                            'player_id': pid,
+                                            'num_lines': num_lines})
+            assert resp['info'] == "Added a penalty of %s to all but %s" % (num_lines, pid), "Response was %s" % resp
 
         for pid in self.player_ids:
-            self.conn.request("GET", "/receive?game_id=%s&player_id=%s" % (self.game_id, pid))
-            resp = int(self.conn.getresponse().read().strip('#'))
-            assert resp in range(4), "Invalid penalty found: %s" % resp
+            resp = self.get("/receive?game_id=%s&player_id=%s" % (self.game_id, pid))
+            assert resp['penalty'] in range(4), "Invalid penalty found: %s" % resp
 
     def test_unregistration(self):
-        params = urllib.urlencode({'game_id': self.game_id, 
-                                   'player_id': self.player_ids[0]})
-        self.conn.request("POST", "/unregister", params, self.headers)
-        resp = self.conn.getresponse().read()
-        
-        assert resp == "Player %s deleted" % self.player_ids[0], "Unregistration said %s" % resp
-    
+        resp = self.post("/unregister", {'game_id': self.game_id,
+                                         'player_id': self.player_ids[0]})
+        assert resp['info'] == "Player %s deleted" % self.player_ids[0], "Unregistration said %s" % resp
+
     def test_part_generator(self):
-        self.conn.request("GET", "/getparts?game_id=%s&player_id=%s" % (self.game_id, self.player_ids[0]))
-        parts = [int(x) for x in self.conn.getresponse().read().split(",")]
-        
+        parts = self.get("/getparts?game_id=%s&player_id=%s" % (self.game_id, self.player_ids[0]))
+
         assert len(parts) == 10, "Not enough parts received"
         assert [p for p in parts if p in range(0, 8)] == parts, "Bad range %s" % parts
-    
+
         # Get the other player's parts ... they must be identical!
-        self.conn.request("GET", "/getparts?game_id=%s&player_id=%s" % (self.game_id, self.player_ids[1]))
-        parts_two = [int(x) for x in self.conn.getresponse().read().split(",")]
+        parts_two = self.get("/getparts?game_id=%s&player_id=%s" % (self.game_id, self.player_ids[1]))
         assert parts == parts_two, "Unfair game, received different parts: %s, %s" % (parts, parts_two)
-    
+
+        # Without an offset, the sequence continues ...
+        parts_three = self.get("/getparts?game_id=%s&player_id=%s" % (self.game_id, self.player_ids[0]))
+        # ... but any part can be requested by its offset
+        parts_offset = self.get("/getparts?game_id=%s&player_id=%s&offset=5" % (self.game_id, self.player_ids[2]))
+        assert parts_offset == (parts + parts_three)[5:15], "Bad parts at offset: %s" % parts_offset
+
+    def test_part_sequence(self):
+        sequence = [server.part_index(42, n, 0.1) for n in range(10000)]
+        assert sequence == [server.part_index(42, n, 0.1) for n in range(10000)], "Not deterministic"
+        assert sequence != [server.part_index(43, n, 0.1) for n in range(10000)], "Seed ignored"
+        assert set(sequence) == set(range(8)), "Bad range %s" % set(sequence)
+        assert 800 < sequence.count(0) < 1200, "Bad duck probability: %s" % sequence.count(0)
+
+        no_ducks = [server.part_index(42, n, 0) for n in range(1000)]
+        assert 0 not in no_ducks, "Duck despite zero probability"
+
     def test_timeout(self):
         # Provoke timeout
-        time.sleep(6)
+        server.games[self.game_id].seconds_timeout_to_unregister = 0
 
-        # This request should now cause all players to be kicked ...
-        self.conn.request("GET", "/receive?game_id=%s&player_id=%s" % (self.game_id, self.player_ids[0]))
-        # print self.conn.getresponse().read()
-        
-        self.conn.request("GET", "/status?game_id=%s" % self.game_id)
-        resp = self.conn.getresponse().read()
-        players = resp.split('|')[1]
-        assert players == '', "Status fetching fails: %s" % resp
+        # This request reschedules the player's timeout to now ...
+        self.get("/receive?game_id=%s&player_id=%s" % (self.game_id, self.player_ids[0]))
+        game = server.games[self.game_id]
+        self.server_thread.call(server.timers.advance, time.time() + 1)
+        assert not game.is_playing(self.player_ids[0]), "Player has not been kicked"
+        assert self.game_id in server.games, "Game removed while players are left"
 
+        # ... whereas the others time out regularly
+        self.server_thread.call(server.timers.advance, time.time() + 6)
+        assert self.game_id not in server.games, "Abandoned game has not been removed"
 
-if __name__ == '__main__':
-    # start server outside the test suite
-    #server_thread = threading.Thread(target=server.main)
-    #server_thread.start()
+    def test_unregistration_ends_game(self):
+        for pid in self.player_ids:
+            self.post("/unregister", {'game_id': self.game_id, 'player_id': pid})
+        assert self.game_id not in server.games, "Empty game has not been removed"
+
+    def test_unstarted_game_expires(self):
+        waiting = self.post("/new", {'size': 3})['game_id']
+        self.get("/register?game_id=%s" % waiting)
+
+        self.server_thread.call(server.timers.advance,
+                                time.time() + server.GAME_TIMEOUT_IN_SECONDS + 1)
+        assert waiting not in server.games, "Unstarted game has not expired"
+        assert self.game_id not in server.games, "Idle players of started game not kicked"
+
+    def test_status_deltas(self):
+        p0, p1 = self.player_ids[:2]
+        self.get("/receive?game_id=%s&player_id=%s&game_snapshot=%s" % (self.game_id, p0, "2,0000"))
+        full = self.get("/status?game_id=%s" % self.game_id)
+        assert snapshots(full)[p0] == "2,0000", "Bad snapshots %s" % full
+        version = full['snapshot_version']
+
+        resp = self.get("/status?game_id=%s&since=%s" % (self.game_id, version))
+        assert resp['snapshot_deltas'] == {}, "Unexpected deltas %s" % resp
+        assert snapshots(resp) == {}, "Full snapshots sent in delta mode"
+
+        self.get("/receive?game_id=%s&player_id=%s&game_snapshot=%s" % (self.game_id, p0, "2,0011"))
+        self.get("/receive?game_id=%s&player_id=%s&game_snapshot=%s" % (self.game_id, p1, "2,1111"))
+        resp = self.get("/status?game_id=%s&since=%s" % (self.game_id, version))
+        deltas = resp['snapshot_deltas']
+        assert deltas[p0]['rows'] == [[1, "11"]], "Bad row diff %s" % deltas
+        assert deltas[p1]['snapshot'] == "2,1111", "New snapshot not sent in full: %s" % deltas
+        assert resp['snapshot_version'] == version + 2, "Bad version %s" % resp
+
+    def test_snapshot_format_2(self):
+        self.conn.request("GET", "/register?game_id=%s" % self.post("/new", {'size': 2})['game_id'])
+        response = self.conn.getresponse()
+        response.read()
+        assert response.getheader('X-Snapshot-Format') == '2', "Snapshot format not announced"
+
+        p0 = self.player_ids[0]
+        self.get("/receive?game_id=%s&player_id=%s&game_snapshot=%s"
+                 % (self.game_id, p0, snapshotcodec.encode(2, b'\x00\x00\x01\x01')))
+        full = self.get("/status?game_id=%s" % self.game_id)
+        assert snapshots(full)[p0] == "2,0011", "Snapshot not converted %s" % full
+
+        self.get("/receive?game_id=%s&player_id=%s&game_snapshot=2.2.2.r.AA" % (self.game_id, p0))
+        full = self.get("/status?game_id=%s" % self.game_id)
+        assert snapshots(full)[p0] == "2,0011", "Malformed snapshot stored"
+
+    def test_snapshot_omitted(self):
+        p0 = self.player_ids[0]
+        self.get("/receive?game_id=%s&player_id=%s&game_snapshot=2,0011" % (self.game_id, p0))
+        version = self.get("/status?game_id=%s" % self.game_id)['snapshot_version']
+
+        self.get("/receive?game_id=%s&player_id=%s" % (self.game_id, p0))
+        self.post("/sync", {'game_id': self.game_id, 'player_id': p0})
+        full = self.get("/status?game_id=%s" % self.game_id)
+        assert snapshots(full)[p0] == "2,0011", "Omitted snapshot not kept %s" % full
+        assert full['snapshot_version'] == version, "Omitted snapshot counted as change"
+
+    def test_status_delta_history_exceeded(self):
+        p0 = self.player_ids[0]
+        rows = server.SNAPSHOT_HISTORY + 2
+        for row in range(rows):
+            snapshot = "1," + "".join("1" if idx == row else "0" for idx in range(rows))
+            self.get("/receive?game_id=%s&player_id=%s&game_snapshot=%s"
+                     % (self.game_id, p0, snapshot))
+
+        # Version 1 has been dropped from the history by now
+        resp = self.get("/status?game_id=%s&since=1" % self.game_id)
+        assert resp['snapshot_deltas'][p0] == {'version': rows, 'snapshot': snapshot}, \
+            "Expected full snapshot: %s" % resp
+
+        resp = self.get("/status?game_id=%s&since=%s" % (self.game_id, rows - 1))
+        assert resp['snapshot_deltas'][p0]['rows'] == [[rows - 2, "0"], [rows - 1, "1"]], \
+            "Expected row diff: %s" % resp
+
+    def test_response_cache(self):
+        url = "/status?game_id=%s" % self.game_id
+        first = self.get(url)
+        before = self.get("/stats")['response_cache']
+        assert self.get(url) == first, "Cached status differs"
+        self.get("/list")
+        self.get("/list")
+        after = self.get("/stats")['response_cache']
+        assert after['hits'] == before['hits'] + 2, "Expected hits: %s, %s" % (before, after)
+        assert after['misses'] == before['misses'] + 1, "Expected a miss: %s, %s" % (before, after)
+
+        # Changes must invalidate the cached responses
+        self.get("/receive?game_id=%s&player_id=%s&game_snapshot=1,1" % (self.game_id, self.player_ids[0]))
+        assert snapshots(self.get(url))[self.player_ids[0]] == "1,1", "Stale status served"
+        self.post("/unregister", {'game_id': self.game_id, 'player_id': self.player_ids[0]})
+        listed = self.get("/list")[self.game_id]
+        assert listed['free_slots'] == 1, "Stale list served: %s" % listed
+
+    def test_response_cache_large_game(self):
+        game_id, player_ids = self.start_game(size=30)
+        urls = ["/status?game_id=%s&player_id=%s&since=0" % (game_id, player_id)
+                for player_id in player_ids]
+        for url in urls:
+            self.get(url)
+        before = self.get("/stats")['response_cache']
+        for url in urls:
+            self.get(url)
+        after = self.get("/stats")['response_cache']
+        assert after['hits'] == before['hits'] + len(urls), "Expected hits: %s, %s" % (before, after)
+
+    def test_sync(self):
+        p0, p1 = self.player_ids[:2]
+        resp = self.post("/sync", {'game_id': self.game_id, 'player_id': p0,
+                                   'lines': '2,1', 'lines_seq': 0,
+                                   'game_snapshot': '1,01',
+                                   'parts_offset': 0, 'parts': 20})
+        assert resp['penalties'] == [] and resp['lines_seq'] == 2, "Bad sync %s" % resp
+        assert len(resp['parts']) == 20, "Parts missing %s" % resp
+        assert sorted(resp['players_alive']) == sorted(self.player_ids), "Bad players %s" % resp
+
+        # Resending lines after a lost response must not duplicate them
+        resp = self.post("/sync", {'game_id': self.game_id, 'player_id': p0,
+                                   'lines': '2,1,4', 'lines_seq': 0,
+                                   'since': resp['snapshot_version']})
+        assert resp['lines_seq'] == 3, "Bad sequence %s" % resp
+        assert resp['snapshot_deltas'] == {} and resp['parts'] == [], "Unexpected data %s" % resp
+
+        resp = self.post("/sync", {'game_id': self.game_id, 'player_id': p1,
+                                   'parts_offset': 10, 'parts': 10})
+        assert resp['penalties'] == [2, 1, 4], "Bad penalties %s" % resp
+        assert resp['snapshot_deltas'][p0]['snapshot'] == '1,01', "Snapshot missing %s" % resp
+        assert resp['parts_offset'] == 10, "Bad offset %s" % resp
+        parts = self.get("/getparts?game_id=%s&player_id=%s&offset=10" % (self.game_id, p0))
+        assert resp['parts'] == parts, "Parts differ %s" % resp
+
+        resp = self.post("/sync", {'game_id': self.game_id, 'player_id': p1})
+        assert resp['penalties'] == [], "Penalties delivered twice %s" % resp
+
+    def test_poll_interval(self):
+        def poll_interval():
+            self.conn.request("POST", "/sync", urllib.parse.urlencode(
+                {'game_id': self.game_id, 'player_id': self.player_ids[0]}), self.headers)
+            response = self.conn.getresponse()
+            response.read()
+            return float(response.getheader('X-Poll-Interval'))
+
+        assert poll_interval() == server.MIN_POLL_INTERVAL, "Idle server slows clients down"
+        server.load.cpu = server.load.max_cpu
+        assert poll_interval() == server.MAX_POLL_INTERVAL, "Busy server doesn't slow clients down"
 
-    # wait for the server to get up and running
-    #time.sleep(1)
-        
+    def test_metrics(self):
+        before = self.get("/metrics?format=json")
+        assert before['gauges']['players'] == 5, "Bad gauges %s" % before['gauges']
+
+        self.post("/sendlines", {'game_id': self.game_id, 'player_id': self.player_ids[0],
+                                 'num_lines': 3})
+        server.games[self.game_id].seconds_timeout_to_unregister = 0
+        self.get("/receive?game_id=%s&player_id=%s" % (self.game_id, self.player_ids[1]))
+        self.server_thread.call(server.timers.advance, time.time() + 1)
+
+        after = self.get("/metrics?format=json")
+        counters, before_counters = after['counters'], before['counters']
+        assert counters['penalties_total'] == before_counters['penalties_total'] + 4, counters
+        assert counters['penalty_lines_total'] == before_counters['penalty_lines_total'] + 3, counters
+        assert counters['player_timeouts_total'] == before_counters['player_timeouts_total'] + 1, counters
+        assert after['gauges']['players'] == 4, "Bad gauges %s" % after['gauges']
+        assert sum(after['latencies']['/sendlines']['counts']) >= 1, "Request not timed"
+
+        self.conn.request("GET", "/metrics")
+        text = self.conn.getresponse().read().decode()
+        assert 'entris_request_duration_seconds_bucket{route="/register",le="+Inf"}' in text, text
+        assert '# TYPE entris_games gauge' in text, text
+
+    def test_large_game(self):
+        game_id = self.post("/new", {'size': 60})['game_id']
+        player_ids = [self.get("/register?game_id=%s" % game_id)['player_id'] for _ in range(60)]
+        game = server.games[game_id]
+        for player_id in player_ids:
+            game.store_snapshot(player_id, '2,0110')
+
+        for _ in range(100):
+            self.post("/sendlines", {'game_id': game_id, 'player_id': player_ids[0], 'num_lines': 1})
+        assert len(game.penalty_log) == 100, "Penalty not logged once: %s" % len(game.penalty_log)
+
+        resp = self.post("/sync", {'game_id': game_id, 'player_id': player_ids[1]})
+        assert resp['penalties'] == [1] * 100, "Bad penalties %s" % resp['penalties']
+        shown = sorted(resp['snapshot_deltas'], key=int)
+        assert shown == player_ids[2:2 + server.MAX_SHOWN_OPPONENTS], "Bad opponents %s" % shown
+        resp = self.get("/status?game_id=%s&player_id=%s" % (game_id, player_ids[-1]))
+        assert len(snapshots(resp)) == server.MAX_SHOWN_OPPONENTS, "Bad snapshots %s" % resp
+
+        # Penalties read by everybody are dropped from the log
+        for player_id in player_ids[:1] + player_ids[2:]:
+            self.post("/sync", {'game_id': game_id, 'player_id': player_id})
+        self.post("/sendlines", {'game_id': game_id, 'player_id': player_ids[1], 'num_lines': 2})
+        for _ in range(game.penalty_trim - len(game.penalty_log)):
+            self.post("/sendlines", {'game_id': game_id, 'player_id': player_ids[0], 'num_lines': 1})
+        assert game.penalty_base == 100, "Log not trimmed: %s" % game.penalty_base
+        resp = self.post("/sync", {'game_id': game_id, 'player_id': player_ids[0]})
+        assert resp['penalties'] == [2], "Bad penalties %s" % resp['penalties']
+
+    def test_matchmake(self):
+        config = {'size': 3, 'dimensions': '25x32', 'duck_prob': 0.05}
+        waiting = self.post("/new", config)['game_id']
+        self.get("/register?game_id=%s" % waiting)
+
+        tickets = [self.post("/matchmake", dict(config, screen_name='m%d' % i))['ticket']
+                   for i in range(5)]
+        self.server_thread.call(server.match_players)
+
+        matched = [self.get("/matchmake?ticket=%s" % ticket) for ticket in tickets]
+        assert all(m['status'] == 'matched' for m in matched), "Unmatched %s" % matched
+        game_ids = [m['game_id'] for m in matched]
+        assert game_ids[:2] == [waiting] * 2 and len(set(game_ids[2:])) == 1, "Bad games %s" % game_ids
+
+        status = self.get("/status?game_id=%s" % game_ids[-1])
+        assert status['started'] and status['dimensions'] == [25, 32], "Bad game %s" % status
+        assert matched[-1]['player_id'] in [p['player_id'] for p in status['screen_names']], \
+            "Player not registered"
+
+        metrics = self.get("/metrics?format=json")
+        assert sum(metrics['histograms']['matchmaking_wait_seconds']['counts']) >= 5, metrics
+
+    def test_matchmake_invalid_config(self):
+        response, resp = self.request("POST", "/matchmake", {'size': 2, 'dimensions': '20'})
+        assert response.status == 400 and 'error' in resp, "Bad config queued %s" % resp
+
+        tickets = [self.post("/matchmake", {'size': 2})['ticket'] for _ in range(2)]
+        self.server_thread.call(server.match_players)
+        matched = [self.get("/matchmake?ticket=%s" % ticket) for ticket in tickets]
+        assert all(m['status'] == 'matched' for m in matched), "Unmatched %s" % matched
+
+    def test_snapshot_packing(self):
+        for snapshot in ['', '1,1', '3,011000111', '20,' + '01' * 250, 'garbage', '2,0a']:
+            packed = server.pack_snapshot(snapshot)
+            assert server.unpack_snapshot(packed) == snapshot, "Bad round trip %s" % snapshot
+        assert len(server.pack_snapshot('20,' + '0' * 500)) == 4 + 63, "Snapshot not packed"
+
+    def test_admission(self):
+        server.load = LoadMonitor(max_memory=None, max_cpu=0.5)
+        server.load.cpu = 0.6
+        assert self.post("/new", {'size': 2}) == {'error': 'Server full!'}, "Game admitted"
+
+        server.load.cpu = 0.4
+        assert 'game_id' in self.post("/new", {'size': 2}), "Game refused"
+
+        server.load = LoadMonitor(max_memory=1)
+        if server.load.memory is not None:
+            assert server.load.overloaded() == 'memory', "Memory limit ignored"
+
+    def test_invalid_config(self):
+        for config in [{'dimensions': '20'}, {'dimensions': '20x0'}, {'dimensions': '20x25x3'},
+                       {'dimensions': '1000x1000'}, {'dimensions': 'axb'}, {'duck_prob': '2'}]:
+            response, resp = self.request("POST", "/new", dict(config, size=2))
+            assert response.status == 400 and 'error' in resp, "Config %s accepted" % config
+
+        response, games = self.request("GET", "/list")
+        assert response.status == 200 and list(games) == [self.game_id], "Bad list %s" % games
+
+    def test_list_etag(self):
+        self.conn.request("GET", "/list")
+        resp = self.conn.getresponse()
+        resp.read()
+        etag = resp.getheader("ETag")
+
+        self.conn.request("GET", "/list", headers={"If-None-Match": etag})
+        resp = self.conn.getresponse()
+        assert resp.status == 304 and resp.read() == b'', "Expected 304, got %s" % resp.status
+
+        waiting = self.post("/new", {'size': 3})['game_id']
+        self.conn.request("GET", "/list?joinable=1", headers={"If-None-Match": etag})
+        resp = self.conn.getresponse()
+        assert resp.status == 200, "Stale list: %s" % resp.status
+        assert resp.getheader("ETag") != etag, "ETag unchanged"
+        joinable = list(json.loads(resp.read().decode()))
+        assert joinable == [waiting], "Bad joinable games %s" % joinable
+
+    def test_list_keeps_waiting_games(self):
+        # Creating another game must not clean up games that are
+        # still waiting for players
+        waiting = self.post("/new", {'size': 3})
+        self.post("/new", {'size': 2})
+
+        game_ids = list(self.get("/list"))
+        assert waiting['game_id'] in game_ids, "Waiting game was removed: %s" % game_ids
+
+    def test_list_filter_and_pages(self):
+        small = [self.post("/new", {'size': 3, 'dimensions': '10x20'})['game_id'] for _ in range(3)]
+        large = [self.post("/new", {'size': 4})['game_id'] for _ in range(4)]
+        self.get("/register?game_id=%s" % large[1])
+
+        listed = list(self.get("/list?dimensions=10x20"))
+        assert listed == small, "Bad filtered games %s" % listed
+        listed = list(self.get("/list?size=4&free_slots=4"))
+        assert listed == [large[0]] + large[2:], "Bad filtered games %s" % listed
+        listed = list(self.get("/list?sort=free_slots"))
+        assert listed == small + [large[1], large[0]] + large[2:], "Bad order %s" % listed
+
+        pages, cursor = [], ''
+        while cursor is not None:
+            page = self.get("/list?sort=free_slots&limit=3&cursor=%s" % cursor)
+            pages.append([g['game_id'] for g in page['games']])
+            cursor = page['next_cursor']
+        assert pages == [small, [large[1], large[0], large[2]], [large[3]]], "Bad pages %s" % pages
+
+        # Games that started or filled up leave the index
+        self.get("/register?game_id=%s" % large[1])
+        self.get("/register?game_id=%s" % large[1])
+        self.get("/register?game_id=%s" % large[1])
+        listed = list(self.get("/list?size=4"))
+        assert listed == [large[0]] + large[2:], "Started game listed %s" % listed
+
+        resp = self.get("/list?limit=2&sort=players&cursor=nonsense")
+        assert 'error' in resp, "Invalid cursor accepted: %s" % resp
+
+    def test_unknown_route(self):
+        self.conn.request("GET", "/nothing")
+        resp = self.conn.getresponse()
+        resp.read()
+        assert resp.status == 404, "Unexpected status %s" % resp.status
+
+    def test_many_connections(self):
+        connections = [http.client.HTTPConnection(self.server_thread.address)
+                       for _ in range(50)]
+        try:
+            for _ in range(3):
+                for conn in connections:
+                    conn.request("GET", "/status?game_id=%s" % self.game_id)
+                for conn in connections:
+                    resp = json.loads(conn.getresponse().read().decode())
+                    assert resp['game_id'] == self.game_id, "Bad status %s" % resp
+        finally:
+            for conn in connections:
+                conn.close()
+
+
+if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,189 @@
+import http.client
+import json
+import socket
+import time
+import unittest
+import urllib.parse
+
+import server
+import wire
+from serverprocess import free_port, start_server
+from sharding import shard_for
+
+
+class ShardIdTest(unittest.TestCase):
+    def test_ids_belong_to_shard(self):
+        for shard in range(3):
+            allocator = server.IdAllocator(shard, 3)
+            game_ids = [allocator.next_id() for _ in range(100)]
+            assert len(set(game_ids)) == 100, "Ids not unique: %s" % game_ids
+            for game_id in game_ids:
+                assert shard_for(game_id, 3) == shard, "%s is not in shard %s" % (game_id, shard)
+
+    def test_invalid_id(self):
+        assert shard_for(None, 4) == 0
+        assert shard_for('abc', 4) == 0
+
+
+class ShardedServerTest(unittest.TestCase):
+    headers = {"Content-type": "application/x-www-form-urlencoded",
+               "Accept": "application/json"}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.port = free_port(3)
+        cls.process = start_server(cls.port, workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.process.terminate()
+        cls.process.wait()
+
+    def setUp(self):
+        self.conn = http.client.HTTPConnection('127.0.0.1', self.port)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def get(self, url):
+        self.conn.request("GET", url)
+        return json.loads(self.conn.getresponse().read().decode())
+
+    def post(self, url, params):
+        self.conn.request("POST", url, urllib.parse.urlencode(params), self.headers)
+        return json.loads(self.conn.getresponse().read().decode())
+
+    def test_games_spread_and_listed(self):
+        game_ids = [self.post("/new", {'size': 2})['game_id'] for _ in range(4)]
+        assert {shard_for(gid, 2) for gid in game_ids} == {0, 1}, "Games not spread: %s" % game_ids
+
+        listed = list(self.get("/list"))
+        assert set(game_ids) <= set(listed), "Missing games in %s" % listed
+
+    def test_game_routed_to_owner(self):
+        for _ in range(2):
+            game_id = self.post("/new", {'size': 2})['game_id']
+            p1 = self.get("/register?game_id=%s" % game_id)['player_id']
+            p2 = self.get("/register?game_id=%s" % game_id)['player_id']
+
+            resp = self.post("/sendlines", {'game_id': game_id, 'player_id': p1, 'num_lines': 2})
+            assert resp['info'].startswith("Added"), "Sending failed: %s" % resp
+
+            resp = self.get("/receive?game_id=%s&player_id=%s" % (game_id, p2))
+            assert resp['penalty'] == 2, "Penalty lost: %s" % resp
+
+            assert self.get("/status?game_id=%s" % game_id)['started'], "Game not started"
+
+    def test_stats_merged(self):
+        game_ids = [self.post("/new", {'size': 2})['game_id'] for _ in range(4)]
+        assert {shard_for(gid, 2) for gid in game_ids} == {0, 1}, "Games not spread: %s" % game_ids
+
+        stats = self.get("/stats")
+        assert stats['games'] == len(self.get("/list")), "Games of one worker only: %s" % stats
+        cache = stats['response_cache']
+        assert cache['hits'] + cache['misses'] >= 2, "Bad cache stats %s" % stats
+
+    def test_binary_sync_routed_to_owner(self):
+        game_ids = [self.post("/new", {'size': 2})['game_id'] for _ in range(4)]
+        for game_id in game_ids:
+            p1 = self.get("/register?game_id=%s" % game_id)['player_id']
+            self.get("/register?game_id=%s" % game_id)
+
+            body = wire.encode_sync_request({'game_id': game_id, 'player_id': p1,
+                                             'lines': [], 'lines_seq': 0, 'game_snapshot': None,
+                                             'since': 0, 'parts_offset': 0, 'parts': 2})
+            self.conn.request("POST", "/sync", body, {"Content-type": wire.CONTENT_TYPE,
+                                                      "Accept": wire.CONTENT_TYPE})
+            response = self.conn.getresponse()
+            data = response.read()
+            assert response.getheader('Content-Type') == wire.CONTENT_TYPE, \
+                "Sync of game %s failed: %s" % (game_id, data)
+            assert len(wire.decode_sync_response(data)['parts']) == 2, "Bad sync %s" % data
+
+    def test_push_channel_tunneled(self):
+        game_id = self.post("/new", {'size': 2})['game_id']
+        p1 = self.get("/register?game_id=%s" % game_id)['player_id']
+        self.get("/register?game_id=%s" % game_id)
+
+        sock = socket.create_connection(('127.0.0.1', self.port), timeout=5)
+        try:
+            sock.sendall(("GET /push?game_id=%s&player_id=%s HTTP/1.1\r\n"
+                          "Connection: Upgrade\r\nUpgrade: entris-push\r\n\r\n"
+                          % (game_id, p1)).encode())
+            stream = sock.makefile('rb')
+            assert b' 101 ' in stream.readline(), "Upgrade failed"
+            while stream.readline() != b'\r\n':
+                pass
+            frame = json.loads(stream.readline().decode())
+            assert frame['type'] == 'status' and frame['started'], "Bad frame %s" % frame
+        finally:
+            sock.close()
+
+    def test_list_etag(self):
+        game_id = self.post("/new", {'size': 2})['game_id']
+        self.conn.request("GET", "/list?joinable=1")
+        resp = self.conn.getresponse()
+        assert game_id in json.loads(resp.read().decode())
+        etag = resp.getheader("ETag")
+
+        self.conn.request("GET", "/list?joinable=1", headers={"If-None-Match": etag})
+        resp = self.conn.getresponse()
+        resp.read()
+        assert resp.status == 304, "Expected 304, got %s" % resp.status
+
+        # A change in one worker's games changes the merged list
+        self.get("/register?game_id=%s" % game_id)
+        self.get("/register?game_id=%s" % game_id)
+        self.conn.request("GET", "/list?joinable=1", headers={"If-None-Match": etag})
+        resp = self.conn.getresponse()
+        listed = list(json.loads(resp.read().decode()))
+        assert resp.status == 200 and game_id not in listed, "Stale list %s" % listed
+
+    def test_list_pages_merged(self):
+        game_ids = [self.post("/new", {'size': 2, 'dimensions': '7x9'})['game_id'] for _ in range(5)]
+        pages, cursor = [], ''
+        while cursor is not None:
+            page = self.get("/list?dimensions=7x9&limit=2&cursor=%s" % cursor)
+            pages.append([g['game_id'] for g in page['games']])
+            cursor = page['next_cursor']
+
+        assert [len(page) for page in pages] == [2, 2, 1], "Bad pages %s" % pages
+        listed = sum(pages, [])
+        # In creation order, although the ids of the workers' games interleave differently
+        assert listed == game_ids, "Games missing or out of order: %s" % listed
+
+    def test_matchmake_routed(self):
+        config = {'size': 2, 'dimensions': '30x40', 'duck_prob': 0.07}
+        tickets = [self.post("/matchmake", config)['ticket'] for _ in range(2)]
+
+        deadline = time.time() + 5
+        while True:
+            matched = [self.get("/matchmake?ticket=%s" % ticket) for ticket in tickets]
+            if all(m['status'] == 'matched' for m in matched):
+                break
+            assert time.time() < deadline, "Not matched: %s" % matched
+            time.sleep(0.1)
+
+        assert matched[0]['game_id'] == matched[1]['game_id'], "Bad match %s" % matched
+        status = self.get("/status?game_id=%s" % matched[0]['game_id'])
+        assert status['started'], "Game not started %s" % status
+
+    def test_metrics_merged(self):
+        before = self.get("/metrics?format=json")
+        game_ids = [self.post("/new", {'size': 2})['game_id'] for _ in range(2)]
+        for game_id in game_ids:
+            self.get("/register?game_id=%s" % game_id)
+
+        after = self.get("/metrics?format=json")
+        assert after['gauges']['games'] >= before['gauges']['games'] + 2, "Bad gauges %s" % after
+        new_games = (sum(after['latencies']['/new']['counts'])
+                     - sum(before['latencies'].get('/new', {'counts': [0]})['counts']))
+        assert new_games == 2, "Requests to both workers not counted: %s" % after
+
+        self.conn.request("GET", "/metrics")
+        text = self.conn.getresponse().read().decode()
+        assert 'entris_request_duration_seconds_count{route="/new"}' in text, text
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import random
+import unittest
+
+import snapshotcodec
+
+
+def random_board(cols, rows, rng):
+    # Empty at the top, mostly filled at the bottom
+    height = rng.randint(0, rows)
+    return bytes([0] * cols * (rows - height) +
+                 [rng.random() < 0.8 for _ in range(cols * height)])
+
+
+class SnapshotCodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        rng = random.Random(1)
+        for cols, rows in [(20, 25), (25, 32), (30, 40), (3, 1)]:
+            for _ in range(20):
+                flags = random_board(cols, rows, rng)
+                for codec in (None,) + snapshotcodec.CODECS:
+                    snapshot = snapshotcodec.encode(cols, flags, codec=codec)
+                    assert snapshotcodec.decode(snapshot) == (cols, flags), "Bad %s" % snapshot
+                legacy = snapshotcodec.encode(cols, flags, format=1)
+                assert snapshotcodec.decode(legacy) == (cols, flags), "Bad %s" % legacy
+                assert snapshotcodec.to_format_1(snapshot) == legacy, "Bad conversion"
+
+    def test_format_1_compatible(self):
+        flags = snapshotcodec.cells_to_flags([0, (1, 1, 1), 0, 0, 0, 0], filled=[3, -1])
+        assert snapshotcodec.encode(3, flags, format=1) == "3,010100", "Bad cells"
+        assert snapshotcodec.rows("3,010100") == [[0, 1, 0], [1, 0, 0]], "Bad rows"
+        assert snapshotcodec.rows("") is None, "Empty snapshot decoded"
+        assert snapshotcodec.to_format_1("3,010100") == "3,010100", "Format 1 converted"
+
+    def test_compact(self):
+        empty = snapshotcodec.encode(30, bytes(1200))
+        assert len(empty) < 20, "Empty board takes %s" % empty
+        assert snapshotcodec.encode(30, bytes(1200), codec='z').startswith('2.30.40.z.')
+
+    def test_malformed(self):
+        for snapshot in ["2.3.2.r.AQ", "2.3.2.x.AA", "2.3.2.p", "2.300.300.p.AA",
+                         "2.3.2.r.BwE", "2.3.2.z.AAAA", "3,01x", "no board"]:
+            self.assertRaises(ValueError, snapshotcodec.decode, snapshot)
+
+    def test_client_copy(self):
+        # The client's copy must not drift from ours
+        client_copy = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   os.pardir, 'client', 'snapshotcodec.py')
+        with open(client_copy, 'rb') as client_file, open(snapshotcodec.__file__, 'rb') as own_file:
+            assert client_file.read() == own_file.read(), "client/snapshotcodec.py differs"
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import socket
+import unittest
+
+import server
+from servertest import ServerTestCase
+from spectators import SpectatorHub, MAX_PENDING_BYTES
+
+
+class SpectatorTest(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.game_id, self.player_ids = self.start_game()
+        self.sockets = []
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        for sock in self.sockets:
+            sock.close()
+
+    def watch(self, upgrade='entris-watch'):
+        sock = socket.create_connection(('127.0.0.1', self.server_thread.http_server.port), timeout=5)
+        self.sockets.append(sock)
+        sock.sendall(("GET /watch?game_id=%s HTTP/1.1\r\n"
+                      "Host: localhost\r\nConnection: Upgrade\r\nUpgrade: %s\r\n\r\n"
+                      % (self.game_id, upgrade)).encode())
+        stream = sock.makefile('rb')
+        status_line = stream.readline()
+        while stream.readline() != b'\r\n':
+            pass
+        return status_line, stream
+
+    def test_upgrade_required(self):
+        status_line, _ = self.watch(upgrade='websocket')
+        assert b' 426 ' in status_line, "Unexpected status %s" % status_line
+
+    def test_frames_shared_by_spectators(self):
+        streams = [self.watch()[1] for _ in range(3)]
+        for stream in streams:
+            frame = json.loads(stream.readline().decode())
+            assert frame['type'] == 'game' and frame['started'], "Bad frame %s" % frame
+            assert [p['screen_name'] for p in frame['players']] == ['p0', 'p1'], "Bad players %s" % frame
+
+        self.get("/receive?game_id=%s&player_id=%s&game_snapshot=2,0110"
+                 % (self.game_id, self.player_ids[0]))
+        lines = [stream.readline() for stream in streams]
+        assert len(set(lines)) == 1, "Spectators got different frames %s" % lines
+        frame = json.loads(lines[0].decode())
+        expected = server.games[self.game_id].game_snapshot[self.player_ids[0]]
+        assert frame['players'][0]['snapshot'] == expected, "Snapshot missing from %s" % frame
+
+    def test_game_end(self):
+        _, stream = self.watch()
+        stream.readline()
+        for player_id in self.player_ids:
+            self.post("/unregister", {'game_id': self.game_id, 'player_id': player_id})
+
+        # The first player leaving changes the game, the second ends it
+        frames = [json.loads(line.decode()) for line in iter(stream.readline, b'')]
+        assert frames[-1] == {'type': 'end'}, "Expected end of game, got %s" % frames
+
+
+class FakeTransport(object):
+    def __init__(self, pending):
+        self.pending = pending
+
+    def get_write_buffer_size(self):
+        return self.pending
+
+
+class FakeWriter(object):
+    def __init__(self, pending=0):
+        self.transport = FakeTransport(pending)
+        self.written = []
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.written.append(data)
+
+
+class BroadcastTest(unittest.TestCase):
+    def test_slow_spectators_skip_frames(self):
+        game = server.Game(dict(game_id='10', size=2, dimensions=[20, 25], duck_prob=0.1))
+        hub = SpectatorHub()
+        audience = hub.audiences['10'] = server.spectator_channels.Audience()
+        fast, slow = FakeWriter(), FakeWriter(MAX_PENDING_BYTES + 1)
+        audience.writers.extend([fast, slow])
+
+        assert hub.broadcast({'10': game}) == (1, 1), "Slow spectator not skipped"
+        assert hub.broadcast({'10': game}) == (0, 0), "Unchanged game sent again"
+
+        game.add_player('p0')
+        slow.transport.pending = 0
+        assert hub.broadcast({'10': game}) == (2, 0), "Changed game not sent"
+        assert fast.written[-1] is slow.written[-1], "Frame encoded per spectator"
@@ -0,0 +1,66 @@
+import unittest
+
+from timerwheel import TimerWheel
+
+
+class TimerWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.fired = []
+        self.wheel = TimerWheel(tick=1, slots=8, now=100)
+
+    def fire(self, key):
+        self.fired.append(key)
+
+    def test_fires_when_due(self):
+        self.wheel.schedule('a', 103, self.fire)
+        self.wheel.schedule('b', 105, self.fire)
+
+        self.wheel.advance(102.5)
+        assert self.fired == [], "Fired too early: %s" % self.fired
+        self.wheel.advance(103)
+        assert self.fired == ['a'], "Unexpected timers fired: %s" % self.fired
+        self.wheel.advance(110)
+        assert self.fired == ['a', 'b'], "Unexpected timers fired: %s" % self.fired
+        assert len(self.wheel) == 0
+
+    def test_postponed(self):
+        self.wheel.schedule('a', 103, self.fire)
+        for now in range(101, 110):
+            self.wheel.schedule('a', now + 3, self.fire)
+            self.wheel.advance(now)
+        assert self.fired == [], "Postponed timer fired: %s" % self.fired
+
+        self.wheel.advance(112)
+        assert self.fired == ['a'], "Postponed timer did not fire: %s" % self.fired
+
+    def test_brought_forward(self):
+        self.wheel.schedule('a', 106, self.fire)
+        self.wheel.schedule('a', 102, self.fire)
+        self.wheel.advance(102)
+        assert self.fired == ['a'], "Timer did not fire early: %s" % self.fired
+        self.wheel.advance(110)
+        assert self.fired == ['a'], "Timer fired twice: %s" % self.fired
+
+    def test_cancel(self):
+        self.wheel.schedule('a', 102, self.fire)
+        self.wheel.cancel('a')
+        self.wheel.advance(110)
+        assert self.fired == [], "Cancelled timer fired"
+        assert 'a' not in self.wheel
+
+    def test_longer_than_revolution(self):
+        self.wheel.schedule('a', 120, self.fire)
+        self.wheel.advance(110)
+        assert self.fired == [], "Fired a revolution too early"
+        self.wheel.advance(121)
+        assert self.fired == ['a'], "Long timer did not fire"
+
+    def test_large_jump(self):
+        for idx in range(20):
+            self.wheel.schedule(idx, 101 + idx, self.fire)
+        assert self.wheel.advance(1000) == 20
+        assert sorted(self.fired) == list(range(20))
+
+
+if __name__ == '__main__':
+    unittest.main()
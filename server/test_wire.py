@@ -0,0 +1,99 @@
+import json
+import os
+import urllib.parse
+import unittest
+
+import wire
+from servertest import ServerTestCase
+
+
+class WireTest(unittest.TestCase):
+    def test_bits(self):
+        for bits in ['', '1', '0', '10000000', '011', '1' * 9, '01' * 250]:
+            packed = wire.pack_bits(bits)
+            assert len(packed) == (len(bits) + 7) // 8, "Bad length for %s" % bits
+            assert wire.unpack_bits(packed, len(bits)) == bits, "Bad bits for %s" % bits
+
+    def test_client_copy(self):
+        # The client's copy must not drift from ours
+        client_copy = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   os.pardir, 'client', 'wire.py')
+        with open(client_copy, 'rb') as client_file, open(wire.__file__, 'rb') as own_file:
+            assert client_file.read() == own_file.read(), "client/wire.py differs"
+
+    def test_sync_request(self):
+        request = {'game_id': '17', 'player_id': '300', 'lines': [2, 1, 4],
+                   'lines_seq': 1000, 'game_snapshot': '3,011000111',
+                   'since': 5, 'parts_offset': 20, 'parts': 10}
+        assert wire.decode_sync_request(wire.encode_sync_request(request)) == request
+
+        request['game_snapshot'] = None
+        assert wire.decode_sync_request(wire.encode_sync_request(request)) == request
+
+    def test_sync_response(self):
+        response = {'penalties': [1, 3], 'lines_seq': 7,
+                    'snapshot_deltas': {'1': {'version': 3, 'snapshot': '2,0110'},
+                                        '2': {'version': 4, 'rows': [[0, '11'], [9, '01']]},
+                                        '3': {'version': 5, 'snapshot': ''}},
+                    'snapshot_version': 5, 'players_alive': ['1', '2', '3'],
+                    'parts_offset': 10, 'parts': [0, 7, 3]}
+        assert wire.decode_sync_response(wire.encode_sync_response(response)) == response
+
+    def test_bad_messages(self):
+        valid = wire.encode_sync_response({'penalties': [], 'lines_seq': 0,
+                                           'snapshot_deltas': {}, 'snapshot_version': 0,
+                                           'players_alive': ['1'], 'parts_offset': 0,
+                                           'parts': [1, 2]})
+        for data in [b'', b'XX\x01\x02', valid[:-1], valid]:
+            self.assertRaises(wire.WireError, wire.decode_sync_request, data)
+
+
+class BinarySyncTest(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.game_id, self.player_ids = self.start_game()
+
+    def sync(self, body, headers):
+        self.conn.request("POST", "/sync", body, headers)
+        resp = self.conn.getresponse()
+        return resp.status, resp.getheader("Content-Type"), resp.read()
+
+    def test_negotiation(self):
+        p0, p1 = self.player_ids
+        params = {'game_id': self.game_id, 'player_id': p0, 'lines': '3',
+                  'game_snapshot': '2,0110', 'parts': 5}
+        status, content_type, body = self.sync(
+            urllib.parse.urlencode(params),
+            {"Content-type": "application/x-www-form-urlencoded",
+             "Accept": "%s, application/json" % wire.CONTENT_TYPE})
+        assert content_type == wire.CONTENT_TYPE, "Expected binary reply: %s" % content_type
+        resp = wire.decode_sync_response(body)
+        assert resp['lines_seq'] == 1 and len(resp['parts']) == 5, "Bad sync %s" % resp
+        parts = resp['parts']
+
+        request = {'game_id': self.game_id, 'player_id': p1, 'lines': [],
+                   'lines_seq': 0, 'game_snapshot': None, 'since': 0,
+                   'parts_offset': 0, 'parts': 5}
+        status, content_type, body = self.sync(wire.encode_sync_request(request),
+                                               {"Content-type": wire.CONTENT_TYPE,
+                                                "Accept": wire.CONTENT_TYPE})
+        resp = wire.decode_sync_response(body)
+        assert resp['penalties'] == [3], "Bad penalties %s" % resp
+        assert resp['snapshot_deltas'][p0]['snapshot'] == '2,0110', "Bad deltas %s" % resp
+        assert resp['parts'] == parts, "Parts differ %s" % resp
+
+        # Without the Accept header, binary requests are answered in JSON
+        request['since'] = resp['snapshot_version']
+        status, content_type, body = self.sync(wire.encode_sync_request(request),
+                                               {"Content-type": wire.CONTENT_TYPE})
+        assert content_type == 'application/json', "Expected JSON: %s" % content_type
+        assert json.loads(body.decode())['snapshot_deltas'] == {}, "Bad reply %s" % body
+
+    def test_malformed_request(self):
+        status, _, body = self.sync(b'EW\x01\x01\x05', {"Content-type": wire.CONTENT_TYPE})
+        assert status == 400, "Unexpected status %s" % status
+        assert 'error' in json.loads(body.decode()), "No error message: %s" % body
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+A hashed timer wheel for expiring idle players and games.
+
+Timers are kept in a ring of slots, one slot per tick. Scheduling,
+rescheduling and cancelling a timer is O(1), and advancing the wheel
+only looks at the slots of the ticks that have passed.
+
+Pushing a deadline further into the future (e.g. every time a player
+polls) doesn't move the timer: it is lazily moved to its new slot
+when its old slot comes up, so a player polling every second costs a
+single reinsertion per timeout period.
+"""
+
+import time
+
+
+class _Timer(object):
+    __slots__ = ('deadline', 'callback', 'tick')
+
+    def __init__(self, deadline, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.tick = None
+
+
+class TimerWheel(object):
+    def __init__(self, tick=0.5, slots=512, now=None):
+        """
+        tick is the resolution in seconds. Timeouts longer than
+        tick * slots are supported, but cost an extra look at
+        the timer on every revolution of the wheel.
+        """
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.timers = {}
+        self.current_tick = int((time.time() if now is None else now) / tick)
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    def schedule(self, key, deadline, callback):
+        """
+        Calls callback(key) once the wheel has been advanced past the
+        deadline. Replaces any timer previously scheduled for key.
+        """
+        timer = self.timers.get(key)
+        if timer is None:
+            timer = self.timers[key] = _Timer(deadline, callback)
+            self._insert(key, timer)
+        else:
+            timer.callback = callback
+            moved_forward = deadline < timer.deadline
+            timer.deadline = deadline
+            if moved_forward:
+                # The timer's current slot is too late now
+                self._insert(key, timer)
+
+    def cancel(self, key):
+        self.timers.pop(key, None)
+
+    def advance(self, now=None):
+        """
+        Fires all timers whose deadline is not later than now.
+        Returns the number of timers fired.
+        """
+        if now is None:
+            now = time.time()
+
+        target = int(now / self.tick)
+        # After a full revolution all slots have been looked at
+        first = max(self.current_tick + 1, target - len(self.slots) + 1)
+        fired = 0
+
+        for tick in range(first, target + 1):
+            self.current_tick = tick
+            idx = tick % len(self.slots)
+            entries, self.slots[idx] = self.slots[idx], []
+
+            for entry_tick, key in entries:
+                timer = self.timers.get(key)
+                if timer is None or timer.tick != entry_tick:
+                    # Cancelled, or superseded by a later insertion
+                    continue
+
+                if entry_tick > target:
+                    # Due in a later revolution of the wheel
+                    self.slots[idx].append((entry_tick, key))
+                elif timer.deadline > now:
+                    # Deadline has been pushed back in the meantime
+                    self._insert(key, timer)
+                else:
+                    del self.timers[key]
+                    timer.callback(key)
+                    fired += 1
+
+        self.current_tick = max(self.current_tick, target)
+        return fired
+
+    def _insert(self, key, timer):
+        timer.tick = max(int(timer.deadline / self.tick), self.current_tick + 1)
+        self.slots[timer.tick % len(self.slots)].append((timer.tick, key))